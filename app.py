@@ -1,13 +1,24 @@
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 from config.config import AppConfig
-from services.text_processor_service import TextProcessorService
 from services.vllm_service import VllmService
 from services.automatic_review_service import AutomaticReviewService
+from services.admission_controller import AdmissionController, AdmissionRejected
+from services.stream_utils import SSE_HEADERS, format_sse_event, coalesce_chunks, replay_text_chunks
+from services.review_cache import ReviewCache
+from services.single_flight import SingleFlight
+from services.paper_ingest import load_review_request
+from services.paper_store import PaperStore, PaperNotFound
+from services.extraction_memo import ExtractionMemo
+from services.review_jobs import ReviewJobManager, JobNotFound, JobCancelled
+from services.review_pipeline import ReviewPipeline
 from models.paper_models import PaperRequest, PaperResponse
 import logging
+import threading
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import replace
 from datetime import datetime
 
 # 配置日志
@@ -28,18 +39,127 @@ def create_app():
     config = AppConfig()
     vllm_service = VllmService(config)
     automatic_review_service = AutomaticReviewService(config, vllm_service)
+    admission_controller = AdmissionController(
+        max_concurrent=config.vllm.max_parallel_requests,
+        max_queue_depth=config.vllm.max_queue_depth,
+        max_queue_wait=config.vllm.max_queue_wait
+    )
+    review_cache = ReviewCache(
+        cache_dir=config.cache.cache_dir,
+        memory_max_bytes=config.cache.memory_max_bytes,
+        disk_max_bytes=config.cache.disk_max_bytes,
+        ttl_seconds=config.cache.ttl_seconds
+    ) if config.cache.enabled else None
+    
+    single_flight = SingleFlight(idempotency_window=config.dedup.idempotency_window)
+    extraction_memo = ExtractionMemo(max_bytes=config.cache.extraction_memo_max_bytes)
+    paper_store = PaperStore(
+        max_bytes=config.paper_store.max_bytes,
+        ttl_seconds=config.paper_store.ttl_seconds
+    )
+    job_manager = ReviewJobManager(
+        max_workers=config.jobs.max_workers,
+        max_pending=config.jobs.max_pending,
+        retention_seconds=config.jobs.retention_seconds
+    )
+    
+    pipeline = ReviewPipeline(config, vllm_service, extraction_memo, paper_store, review_cache)
+    review_request_key = pipeline.review_request_key
+    is_cacheable = pipeline.is_cacheable
+    resolve_paper = pipeline.resolve_paper
+    prepare_peer_review = pipeline.prepare_peer_review
+    peer_review_stats = pipeline.peer_review_stats
+    
+    def generate_peer_review_text(prepared, paper_request, idempotency_key=None):
+        """非流式生成同行评审：先查缓存，相同请求合并，返回 (评审文本, 处理方法, 排队统计)"""
+        cache_key = prepared['cache_key']
+        review_chunks = prepared['review_chunks']
+        
+        # 确定性请求先查缓存
+        peer_review = review_cache.get(cache_key) if cache_key else None
+        if peer_review is not None:
+            return peer_review, "cached", {}
+        
+        def generate():
+            content, query = prepared['truncated_content'], prepared['review_query']
+            if review_chunks:
+                content, query = run_chunk_reviews(review_chunks, query, paper_request)
+            with admission_controller.admit() as ticket:
+                review = vllm_service.generate_peer_review(
+                    content, 
+                    query,
+                    temperature=paper_request.temperature,
+                    max_tokens=paper_request.max_tokens
+                )
+            if cache_key:
+                review_cache.put(cache_key, review)
+            return review, ticket.to_stats()
+        
+        # 相同请求合并：后到的请求等待并共享同一结果
+        (peer_review, queue_stats), shared = single_flight.do(
+            f"review:{prepared['request_key']}", generate,
+            idempotency_key=f"review:{idempotency_key}" if idempotency_key else None
+        )
+        if shared:
+            return peer_review, "deduplicated", queue_stats
+        return peer_review, "chunked_processing" if review_chunks else "normal_processing", queue_stats
     
     @app.route('/api/papers/health', methods=['GET'])
     def health():
         """健康检查接口"""
         return jsonify({"message": "Paper Review Backend is running!"}), 200
     
+    @app.route('/api/papers/stats', methods=['GET'])
+    def service_stats():
+        """服务运行统计接口"""
+        return jsonify({
+            "vllm_pool": vllm_service.get_pool_stats(),
+            "vllm_replicas": vllm_service.get_replica_stats(),
+            "admission": admission_controller.get_stats(),
+            "vllm_streams": vllm_service.get_stream_stats(),
+            "review_cache": review_cache.get_stats() if review_cache else None,
+            "single_flight": single_flight.get_stats(),
+            "paper_store": paper_store.get_stats(),
+            "extraction_memo": extraction_memo.get_stats(),
+            "review_jobs": job_manager.get_stats(),
+            "aspect_classification": automatic_review_service.get_classification_stats()
+        }), 200
+    
+    @app.route('/api/papers/register', methods=['POST'])
+    def register_paper():
+        """论文注册接口 - 上传一次论文，返回可在各评审接口中代替paper_json使用的paper_id"""
+        try:
+            data = load_review_request(request.stream)
+            paper_json = data.get('paper_json')
+            
+            if not paper_json:
+                return jsonify({
+                    "status": "error",
+                    "message": "paper_json is required"
+                }), 400
+            
+            return jsonify({"status": "success", **pipeline.register_paper(data)}), 200
+            
+        except ValueError as e:
+            logger.warning(f"论文注册参数无效: {str(e)}")
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+        except Exception as e:
+            logger.error(f"论文注册失败: {str(e)}")
+            return jsonify({
+                "status": "error",
+                "message": f"Paper registration failed: {str(e)}"
+            }), 500
+    
     @app.route('/api/papers/peer-review', methods=['POST'])
     def generate_peer_review():
         """生成paper review接口 - 支持流式和非流式输出"""
+        stream_output = False
         try:
-            # 获取请求数据
-            data = request.get_json()
+            # 获取请求数据（流式解析，只保留论文文本相关字段）
+            data = load_review_request(request.stream)
             paper_request = PaperRequest.from_dict(data)
             
             # 检查是否请求流式输出
@@ -49,60 +169,92 @@ def create_app():
             
             start_time = time.time()
 
-            # 根据请求参数创建文本处理器
-            text_processor = TextProcessorService(include_authors=paper_request.include_authors)
-            
-            # 获取完整论文内容（不截断）用于分块判断
-            full_paper_content = text_processor.process_paper_json(paper_request.paper_json, auto_truncate=False)
-            original_length = len(full_paper_content)
-            
-            logger.info(f"使用JSON格式论文数据，包含作者信息: {paper_request.include_authors}")
-            logger.info(f"完整文本长度: {original_length:,} 字符")
-            
-            # 同行评审prompt
-            review_query = """Please provide a comprehensive peer review of this academic paper. Focus on the following aspects:
-                1. Novelty and significance of the contribution
-                2. Technical quality and soundness of the methodology
-                3. Clarity of writing and presentation
-                4. Experimental validation and results analysis
-                5. Related work coverage and comparison
-                6. Limitations and potential improvements
-                Please provide detailed comments and recommendations."""
-            
-            # 处理文本长度
-            # 移除分块相关参数
+            prepared = prepare_peer_review(paper_request)
+            original_length = prepared['original_length']
+            reference_stats = prepared['reference_stats']
+            dedup_stats = prepared['dedup_stats']
+            review_query = prepared['review_query']
+            context_plan = prepared['context_plan']
+            truncated_content = prepared['truncated_content']
+            review_chunks = prepared['review_chunks']
+            chunk_count = prepared['chunk_count']
+            request_key = prepared['request_key']
+            cache_key = prepared['cache_key']
+            idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
             
             if stream_output:
-                # 流式输出
-                return Response(
+                # 流式输出（截断处理）
+                cached_review = review_cache.get(cache_key) if cache_key else None
+                
+                if cached_review is not None:
+                    # 命中缓存：按相同事件格式回放，不占用生成名额
+                    logger.info("同行评审命中缓存，回放流式结果")
+                    return Response(
+                        stream_peer_review_generator(
+                            replay_text_chunks(cached_review, pace_ms=paper_request.replay_pace_ms),
+                            paper_request,
+                            original_length,
+                            start_time,
+                            processing_method="cached",
+                            context_plan=context_plan,
+                            chunk_count=chunk_count,
+                            reference_stats=reference_stats,
+                            dedup_stats=dedup_stats
+                        ),
+                        mimetype='text/event-stream',
+                        headers=SSE_HEADERS
+                    )
+                
+                # 相同请求合并：后到的请求订阅同一路token流
+                flight, leader = single_flight.join(
+                    f"stream:{request_key}",
+                    f"stream:{idempotency_key}" if idempotency_key else None,
+                    stream=True
+                )
+                queue_stats = {}
+                if leader:
+                    ticket = None
+                    if not review_chunks:
+                        # 先获取生成名额，排队满时直接返回429（分块评审在后台逐块获取）
+                        try:
+                            ticket = admission_controller.acquire()
+                        except AdmissionRejected as e:
+                            single_flight.complete(flight, error=e)
+                            raise
+                        queue_stats = ticket.to_stats()
+                    start_stream_flight(flight, truncated_content, review_query, paper_request, ticket,
+                                        cache_key, review_chunks)
+                else:
+                    logger.info("相同的流式请求正在生成，订阅共享token流")
+                
+                subscription = flight.broadcast.subscribe()
+                response = Response(
                     stream_peer_review_generator(
-                        full_paper_content, 
-                        review_query, 
+                        subscription,
                         paper_request,
-                        vllm_service,
                         original_length,
-                        start_time
+                        start_time,
+                        processing_method="chunked_stream_processing" if review_chunks else "stream_processing",
+                        context_plan=context_plan,
+                        chunk_count=chunk_count,
+                        reference_stats=reference_stats,
+                        dedup_stats=dedup_stats,
+                        queue_stats=queue_stats,
+                        deduplicated=not leader
                     ),
                     mimetype='text/event-stream',
-                    headers={
-                        'Cache-Control': 'no-cache',
-                        'Connection': 'keep-alive',
-                        'Access-Control-Allow-Origin': '*',
-                        'Access-Control-Allow-Headers': 'Content-Type'
-                    }
+                    headers=SSE_HEADERS
                 )
+                # 响应结束时退订（事件生成器尚未开始迭代时同样会调用）
+                response.call_on_close(subscription.close)
+                return response
             else:
                 # 非流式输出（截断处理）
                 logger.info(f"文本长度 {original_length}, 使用截断处理")
-                # 截断文本以符合长度限制
-                truncated_content = text_processor._truncate_to_max_tokens(full_paper_content)
-                peer_review = vllm_service.generate_peer_review(
-                    truncated_content, 
-                    review_query,
-                    temperature=paper_request.temperature,
-                    max_tokens=paper_request.max_tokens
+                
+                peer_review, processing_method, queue_stats = generate_peer_review_text(
+                    prepared, paper_request, idempotency_key
                 )
-                processing_method = "normal_processing"
                 
                 end_time = time.time()
                 processing_time = end_time - start_time
@@ -113,18 +265,48 @@ def create_app():
                     response=peer_review,
                     timestamp=datetime.now(),
                     stats={
-                        'input_length': original_length,
+                        **peer_review_stats(prepared),
                         'output_length': len(peer_review),
                         'processing_time': processing_time,
                         'processing_method': processing_method,
-                        'max_tokens_limit': text_processor.MAX_TOKENS,
-                        'review_type': 'peer_review'
+                        **queue_stats
                     }
                 )
                 
                 logger.info(f"同行评审生成完成, 处理方法: {processing_method}")
                 return jsonify(response.to_dict()), 200
             
+        except AdmissionRejected as e:
+            logger.warning(f"同行评审请求被拒绝: {str(e)}")
+            retry_headers = {'Retry-After': str(e.retry_after)}
+            if stream_output:
+                error_data = {
+                    'type': 'error',
+                    'success': False,
+                    'error': str(e),
+                    'retry_after': e.retry_after,
+                    'timestamp': datetime.now().isoformat()
+                }
+                return Response(
+                    format_sse_event(error_data),
+                    status=429,
+                    mimetype='text/event-stream',
+                    headers={**SSE_HEADERS, **retry_headers}
+                )
+            error_response = PaperResponse(
+                success=False,
+                error=str(e),
+                timestamp=datetime.now()
+            )
+            return jsonify(error_response.to_dict()), 429, retry_headers
+        except PaperNotFound as e:
+            logger.warning(f"同行评审请求的论文不存在: {str(e)}")
+            error_response = PaperResponse(
+                success=False,
+                error=str(e),
+                timestamp=datetime.now()
+            )
+            return jsonify(error_response.to_dict()), 404
         except Exception as e:
             logger.error(f"同行评审生成失败: {str(e)}")
             if stream_output:
@@ -136,17 +318,12 @@ def create_app():
                         'error': str(e),
                         'timestamp': datetime.now().isoformat()
                     }
-                    yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+                    yield format_sse_event(error_data)
                 
                 return Response(
                     error_generator(),
                     mimetype='text/event-stream',
-                    headers={
-                        'Cache-Control': 'no-cache',
-                        'Connection': 'keep-alive',
-                        'Access-Control-Allow-Origin': '*',
-                        'Access-Control-Allow-Headers': 'Content-Type'
-                    }
+                    headers=SSE_HEADERS
                 )
             else:
                 # 非流式错误响应
@@ -157,65 +334,96 @@ def create_app():
                 )
                 return jsonify(error_response.to_dict()), 500
     
-    def stream_peer_review_generator(full_paper_content, review_query, paper_request, 
-                                   vllm_service, 
-                                   original_length, start_time):
-        """流式peer review生成器"""
+    def run_chunk_reviews(review_chunks, review_query, paper_request):
+        """分块评审的map阶段：各分块并发评审（每块单独占用生成名额），返回合并阶段的 (论文内容, query)"""
+        front_text, chunks = review_chunks
+        chunk_reviews = vllm_service.generate_chunk_reviews(
+            chunks, review_query,
+            temperature=paper_request.temperature,
+            max_workers=admission_controller.max_concurrent,
+            admit=admission_controller.admit
+        )
+        return vllm_service.build_merge_content(front_text, chunk_reviews), vllm_service.build_merge_query(review_query)
+    
+    def start_stream_flight(flight, truncated_content, review_query, paper_request, ticket, cache_key,
+                            review_chunks=None):
+        """后台线程执行流式生成并广播给所有订阅者；订阅者全部断开时取消生成"""
+        def produce():
+            upstream = None
+            stream_ticket = ticket
+            try:
+                content, query = truncated_content, review_query
+                if review_chunks:
+                    # 分块评审完成后再流式输出合并结果
+                    content, query = run_chunk_reviews(review_chunks, review_query, paper_request)
+                    stream_ticket = admission_controller.acquire()
+                
+                upstream = vllm_service.generate_peer_review_stream(
+                    content, 
+                    query,
+                    temperature=paper_request.temperature,
+                    max_tokens=paper_request.max_tokens
+                )
+                for chunk in upstream:
+                    if flight.broadcast.cancelled:
+                        logger.info("所有客户端已断开，取消流式同行评审生成")
+                        single_flight.complete(flight, error=RuntimeError("生成已取消"))
+                        return
+                    flight.broadcast.publish(chunk)
+                
+                full_content = flight.broadcast.get_text()
+                # 完整生成的确定性结果写入缓存
+                if cache_key and full_content.strip():
+                    review_cache.put(cache_key, full_content)
+                single_flight.complete(flight, result=full_content)
+            except Exception as e:
+                single_flight.complete(flight, error=e)
+            finally:
+                if upstream is not None:
+                    upstream.close()
+                if stream_ticket is not None:
+                    stream_ticket.release()
+        
+        threading.Thread(target=produce, name='peer-review-stream', daemon=True).start()
+    
+    def stream_peer_review_generator(chunks, paper_request, original_length, start_time,
+                                   processing_method, context_plan, chunk_count=0, reference_stats=None,
+                                   dedup_stats=None, queue_stats=None, deduplicated=False):
+        """流式peer review生成器：将增量文本转换为start/content/end事件"""
+        queue_stats = queue_stats or {}
         try:
-            # 重新创建文本处理器
-            text_processor = TextProcessorService(include_authors=paper_request.include_authors)
-            
             # 发送开始事件
             start_data = {
                 'type': 'start',
                 'message': '开始生成同行评审',
                 'stats': {
                     'input_length': original_length,
-                    'max_tokens_limit': text_processor.MAX_TOKENS
+                    'max_tokens_limit': context_plan.paper_budget,
+                    **queue_stats
                 }
             }
-            yield f"data: {json.dumps(start_data, ensure_ascii=False)}\n\n"
+            yield format_sse_event(start_data)
             
-            # 流式处理（截断处理）
-            processing_method = "stream_processing"
-            logger.info(f"文本长度 {original_length}, 使用流式截断处理")
+            logger.info(f"文本长度 {original_length}, 处理方法: {processing_method}")
+            
+            # 客户端请求合并输出时，按时间窗口/字节数批量发送
+            coalesce = paper_request.stream_coalesce_ms > 0 or paper_request.stream_coalesce_bytes > 0
+            if coalesce:
+                chunks = coalesce_chunks(
+                    chunks,
+                    interval_ms=paper_request.stream_coalesce_ms,
+                    max_bytes=paper_request.stream_coalesce_bytes
+                )
             
-            # 截断文本并进行流式处理
-            truncated_content = text_processor._truncate_to_max_tokens(full_paper_content)
             content_chunks = []
-            for chunk in vllm_service.generate_peer_review_stream(
-                truncated_content, 
-                review_query
-            ):
+            for chunk in chunks:
                 content_chunks.append(chunk)
-                chunk_data = {
+                yield format_sse_event({
                     'type': 'content',
                     'content': chunk
-                }
-                yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
-                
-                full_content = ''.join(content_chunks)
-            else:
-                processing_method = "normal_processing_stream"
-                logger.info(f"文本长度 {original_length} 在限制内, 使用流式普通处理")
-                
-                # 流式普通处理，先截断文本
-                truncated_content = text_processor._truncate_to_max_length(full_paper_content)
-                content_chunks = []
-                for chunk in vllm_service.generate_peer_review_stream(
-                    truncated_content, 
-                    review_query,
-                    temperature=paper_request.temperature,
-                    max_tokens=paper_request.max_tokens
-                ):
-                    content_chunks.append(chunk)
-                    chunk_data = {
-                        'type': 'content',
-                        'content': chunk
-                    }
-                    yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
-                
-                full_content = ''.join(content_chunks)
+                })
+            
+            full_content = ''.join(content_chunks)
             
             # 发送完成事件
             end_time = time.time()
@@ -230,11 +438,20 @@ def create_app():
                     'output_length': len(full_content),
                     'processing_time': processing_time,
                     'processing_method': processing_method,
-                    'max_tokens_limit': text_processor.MAX_TOKENS,
-                    'review_type': 'peer_review'
+                    'max_tokens_limit': context_plan.paper_budget,
+                    'review_type': 'peer_review',
+                    'context_plan': context_plan.to_dict(),
+                    'used_chunking': chunk_count > 0,
+                    'chunk_count': chunk_count,
+                    'reference_stats': reference_stats,
+                    'dedup_stats': dedup_stats,
+                    'content_events': len(content_chunks),
+                    'coalesced': coalesce,
+                    'deduplicated': deduplicated,
+                    **queue_stats
                 }
             }
-            yield f"data: {json.dumps(end_data, ensure_ascii=False)}\n\n"
+            yield format_sse_event(end_data)
             
             logger.info(f"流式同行评审生成完成, 处理方法: {processing_method}")
             
@@ -246,81 +463,341 @@ def create_app():
                 'error': str(e),
                 'timestamp': datetime.now().isoformat()
             }
-            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+            yield format_sse_event(error_data)
+        except GeneratorExit:
+            # 客户端断开：退订后若无其他订阅者，后台生成随之取消
+            logger.info("客户端已断开流式同行评审")
+            raise
+        finally:
+            # 合并输出时chunks是包装后的生成器；上游订阅另由响应的call_on_close关闭
+            chunks.close()
+    
+    def review_batch_item(index, item, common):
+        """批量评审中的一篇论文，失败时返回错误信息而不影响其他论文"""
+        started = time.time()
+        item_id = item.get('id', index) if isinstance(item, dict) else index
+        result = {'type': 'result', 'index': index, 'id': item_id}
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("papers中的每一项必须是包含paper_json或paper_id的对象")
+            paper_request = PaperRequest.from_dict({**common, **item})
+            prepared = prepare_peer_review(paper_request)
+            peer_review, processing_method, queue_stats = generate_peer_review_text(prepared, paper_request)
+            result.update({
+                'success': True,
+                'response': peer_review,
+                'stats': {
+                    **peer_review_stats(prepared),
+                    'output_length': len(peer_review),
+                    'processing_time': time.time() - started,
+                    'processing_method': processing_method,
+                    **queue_stats
+                }
+            })
+        except Exception as e:
+            logger.error(f"批量评审第 {index} 篇失败: {str(e)}")
+            result.update({
+                'success': False,
+                'error': str(e),
+                'stats': {'processing_time': time.time() - started}
+            })
+            if isinstance(e, AdmissionRejected):
+                result['retry_after'] = e.retry_after
+        return result
+    
+    def generate_batch_results(items, common, concurrency):
+        """并发评审并按完成顺序逐行输出NDJSON，最后一行为汇总；客户端断开时取消未开始的论文"""
+        start_time = time.time()
+        summary = {
+            'type': 'summary',
+            'total': len(items),
+            'succeeded': 0,
+            'failed': 0,
+            'processing_methods': {},
+            'input_length': 0,
+            'output_length': 0,
+            'concurrency': concurrency
+        }
+        
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch-review')
+        futures = [executor.submit(review_batch_item, index, item, common) for index, item in enumerate(items)]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                if result['success']:
+                    stats = result['stats']
+                    summary['succeeded'] += 1
+                    summary['input_length'] += stats['input_length']
+                    summary['output_length'] += stats['output_length']
+                    method = stats['processing_method']
+                    summary['processing_methods'][method] = summary['processing_methods'].get(method, 0) + 1
+                else:
+                    summary['failed'] += 1
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+            
+            summary['processing_time'] = time.time() - start_time
+            logger.info(f"批量评审完成: 成功 {summary['succeeded']}, 失败 {summary['failed']}")
+            yield json.dumps(summary, ensure_ascii=False) + "\n"
+        except GeneratorExit:
+            logger.info("客户端已断开批量评审，取消未开始的论文")
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+    
+    @app.route('/api/papers/batch-review', methods=['POST'])
+    def batch_peer_review():
+        """
+        批量同行评审接口 - papers为包含paper_json或paper_id的对象列表，其余参数对每篇论文生效
+        
+        以有限并发评审，每篇完成后立即输出一行JSON（完成顺序），最后一行为汇总
+        """
+        try:
+            data = load_review_request(request.stream)
+            items = data.get('papers')
+            if not isinstance(items, list) or not items:
+                return jsonify({
+                    "status": "error",
+                    "message": "papers is required"
+                }), 400
+            if len(items) > config.jobs.batch_max_items:
+                return jsonify({
+                    "status": "error",
+                    "message": f"papers最多 {config.jobs.batch_max_items} 篇"
+                }), 400
+            
+            common = {key: value for key, value in data.items() if key not in ('papers', 'stream', 'max_concurrency')}
+            max_concurrency = config.jobs.batch_max_concurrency
+            concurrency = max(1, min(int(data.get('max_concurrency') or max_concurrency), max_concurrency, len(items)))
+            logger.info(f"收到批量同行评审请求: {len(items)} 篇, 并发 {concurrency}")
+            
+            return Response(
+                generate_batch_results(items, common, concurrency),
+                mimetype='application/x-ndjson',
+                headers={'Cache-Control': 'no-cache'}
+            )
+            
+        except Exception as e:
+            logger.error(f"批量评审请求解析失败: {str(e)}")
+            return jsonify({
+                "status": "error",
+                "message": f"Batch review failed: {str(e)}"
+            }), 400
+    
+    def acquire_for_job(job):
+        """任务已在任务队列中排过队，被准入控制拒绝时等待后重试，而不是让任务失败"""
+        while True:
+            if job.cancel_requested:
+                raise JobCancelled()
+            try:
+                return admission_controller.acquire()
+            except AdmissionRejected as e:
+                logger.info(f"评审任务等待生成名额: {job.job_id}, {e.retry_after}s后重试")
+                time.sleep(min(e.retry_after, 5))
+    
+    def run_peer_review_job(job, prepared, paper_request):
+        """在后台任务中生成同行评审，增量通过job.broadcast发布给订阅者"""
+        cache_key = prepared['cache_key']
+        cached_review = review_cache.get(cache_key) if cache_key else None
+        if cached_review is not None:
+            job.stats['processing_method'] = 'cached'
+            job.broadcast.publish(cached_review)
+            return cached_review
+        
+        content, query = prepared['truncated_content'], prepared['review_query']
+        if prepared['review_chunks']:
+            content, query = run_chunk_reviews(prepared['review_chunks'], query, paper_request)
+        
+        ticket = acquire_for_job(job)
+        job.stats.update(ticket.to_stats())
+        upstream = None
+        try:
+            upstream = vllm_service.generate_peer_review_stream(
+                content,
+                query,
+                temperature=paper_request.temperature,
+                max_tokens=paper_request.max_tokens
+            )
+            for chunk in upstream:
+                if job.cancel_requested:
+                    raise JobCancelled()
+                job.broadcast.publish(chunk)
+        finally:
+            if upstream is not None:
+                upstream.close()
+            ticket.release()
+        
+        peer_review = job.broadcast.get_text()
+        if cache_key and peer_review.strip():
+            review_cache.put(cache_key, peer_review)
+        job.stats['processing_method'] = 'chunked_processing' if prepared['review_chunks'] else 'normal_processing'
+        job.stats['output_length'] = len(peer_review)
+        return peer_review
+    
+    @app.route('/api/papers/jobs', methods=['POST'])
+    def submit_review_job():
+        """提交异步同行评审任务 - 立即返回job_id，之后轮询状态或订阅token流"""
+        try:
+            data = load_review_request(request.stream)
+            paper_request = PaperRequest.from_dict(data)
+            prepared = prepare_peer_review(paper_request)
+            
+            context_plan = prepared['context_plan']
+            job = job_manager.submit(
+                lambda job: run_peer_review_job(job, prepared, paper_request),
+                key=prepared['request_key'],
+                # 任务保留期内订阅token流只需要流式输出参数，不保留论文JSON
+                context={
+                    'paper_request': replace(paper_request, paper_json=None),
+                    'context_plan': context_plan
+                },
+                stats=peer_review_stats(prepared)
+            )
+            
+            status_url = f"/api/papers/jobs/{job.job_id}"
+            return jsonify({
+                "status": "success",
+                "job": job.to_dict(include_result=False),
+                "deduplicated": job.submissions > 1,
+                "status_url": status_url,
+                "stream_url": f"{status_url}/stream"
+            }), 202, {'Location': status_url}
+            
+        except AdmissionRejected as e:
+            logger.warning(f"评审任务提交被拒绝: {str(e)}")
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 429, {'Retry-After': str(e.retry_after)}
+        except PaperNotFound as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 404
+        except Exception as e:
+            logger.error(f"评审任务提交失败: {str(e)}")
+            return jsonify({
+                "status": "error",
+                "message": f"Job submission failed: {str(e)}"
+            }), 500
+    
+    @app.route('/api/papers/jobs/<job_id>', methods=['GET'])
+    def get_review_job(job_id):
+        """查询评审任务状态，完成后包含评审结果"""
+        try:
+            job = job_manager.get(job_id)
+            return jsonify({"status": "success", "job": job.to_dict()}), 200
+        except JobNotFound as e:
+            return jsonify({"status": "error", "message": str(e)}), 404
+    
+    @app.route('/api/papers/jobs/<job_id>', methods=['DELETE'])
+    def cancel_review_job(job_id):
+        """取消评审任务"""
+        try:
+            job = job_manager.cancel(job_id)
+            return jsonify({"status": "success", "job": job.to_dict(include_result=False)}), 200
+        except JobNotFound as e:
+            return jsonify({"status": "error", "message": str(e)}), 404
+    
+    @app.route('/api/papers/jobs/<job_id>/stream', methods=['GET'])
+    def stream_review_job(job_id):
+        """订阅评审任务的token流：先回放已生成的内容，再实时接收；客户端断开不影响任务执行"""
+        try:
+            job = job_manager.get(job_id)
+        except JobNotFound as e:
+            return jsonify({"status": "error", "message": str(e)}), 404
+        
+        subscription = job.broadcast.subscribe()
+        response = Response(
+            stream_peer_review_generator(
+                subscription,
+                job.context['paper_request'],
+                job.stats['input_length'],
+                job.created_at,
+                processing_method="job_stream",
+                context_plan=job.context['context_plan'],
+                chunk_count=job.stats['chunk_count'],
+                reference_stats=job.stats['reference_stats'],
+                dedup_stats=job.stats['dedup_stats']
+            ),
+            mimetype='text/event-stream',
+            headers=SSE_HEADERS
+        )
+        response.call_on_close(subscription.close)
+        return response
+    
+    def build_automatic_reviews(paper_content, cache_key, single_pass=False):
+        """生成Automatic_Review评审并按方面分解为前端期望的格式"""
+        reviews, cacheable = automatic_review_service.generate_aspect_reviews(
+            paper_content, admit=admission_controller.admit, single_pass=single_pass
+        )
+        if cache_key and cacheable:
+            review_cache.put(cache_key, reviews)
+        return reviews
     
     @app.route('/api/papers/automatic-review', methods=['POST'])
     def automatic_review():
         """自动评审接口 - 使用Automatic_Review原始功能，返回符合前端期望的格式"""
         try:
-            # 获取请求数据
-            data = request.get_json()
+            # 获取请求数据（流式解析，只保留论文文本相关字段）
+            data = load_review_request(request.stream)
             paper_request = PaperRequest.from_dict(data)
+            resolve_paper(paper_request)
             
             logger.info("收到Automatic_Review评审请求")
             
             start_time = time.time()
             
             # 根据请求参数创建文本处理器
-            text_processor = TextProcessorService(include_authors=paper_request.include_authors)
+            text_processor = pipeline.create_text_processor(paper_request)
             
-            # 获取完整论文内容
-            paper_content = text_processor.process_paper_json(paper_request.paper_json, auto_truncate=False)
+            # 获取论文内容，按上下文规划截断到评审提示词之外的剩余预算
+            single_pass = paper_request.single_pass_review
+            paper_budget = automatic_review_service.get_paper_budget(single_pass)
+            paper_content = text_processor.process_paper_json(paper_request.paper_json, max_tokens=paper_budget)
             
             logger.info(f"论文内容长度: {len(paper_content):,} 字符")
             
-            # 生成评审 - 使用Automatic_Review原始功能
-            review_result = automatic_review_service.generate_review(paper_content=paper_content)
+            request_key = review_request_key(
+                paper_content, automatic_review_service.get_prompt_fingerprint(single_pass),
+                0.0, automatic_review_service.REVIEW_MAX_TOKENS, 'automatic_review'
+            )
+            cache_key = request_key if is_cacheable(0.0) else None
+            cached_reviews = review_cache.get(cache_key) if cache_key else None
+            if cached_reviews is not None:
+                logger.info("Automatic_Review评审命中缓存")
+                return jsonify({ "reviews": cached_reviews }), 200
+            
+            # 相同请求合并：后到的请求等待并共享同一结果
+            idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+            reviews, shared = single_flight.do(
+                f"automatic:{request_key}",
+                lambda: build_automatic_reviews(paper_content, cache_key, single_pass),
+                idempotency_key=f"automatic:{idempotency_key}" if idempotency_key else None
+            )
+            if shared:
+                logger.info("Automatic_Review评审复用了相同请求的结果")
             
-            # 如果评审成功，进行方面分类
-            if "error" not in review_result:
-                review_text = review_result.get("content", "")
-                aspects = automatic_review_service.classify_review_aspects(review_text)
-                review_result["aspects"] = aspects
-                
-                # 将评审内容按方面分解，符合前端期望的格式
-                reviews = []
-                
-                # 如果有方面分类，按方面分解内容
-                if aspects and len(aspects) > 0:
-                    # 简单的按方面分解策略：将评审内容按段落分割
-                    paragraphs = review_text.split('\n\n')
-                    
-                    # 为每个方面分配内容
-                    for i, aspect in enumerate(aspects):
-                        if i < len(paragraphs):
-                            content = paragraphs[i].strip()
-                        else:
-                            # 如果段落不够，使用剩余内容
-                            content = review_text.strip()
-                        
-                        reviews.append({
-                            "name": aspect,
-                            "content": content
-                        })
-                else:
-                    # 如果没有方面分类，将整个评审作为一个方面
-                    reviews.append({
-                        "name": "Overall Review",
-                        "content": review_text.strip()
-                    })
-                
-                end_time = time.time()
-                processing_time = end_time - start_time
-                
-                # 返回符合前端期望的格式
-                return jsonify({ "reviews": reviews }), 200
-            else:
-                # 评审失败，返回错误信息
-                end_time = time.time()
-                processing_time = end_time - start_time
-                
-                return jsonify({
-                    "reviews": [{
-                        "name": "Error",
-                        "content": f"评审生成失败: {review_result.get('error', '未知错误')}"
-                    }]
-                }), 200
+            # 返回符合前端期望的格式
+            return jsonify({ "reviews": reviews }), 200
             
+        except AdmissionRejected as e:
+            logger.warning(f"Automatic_Review评审请求被拒绝: {str(e)}")
+            return jsonify({
+                "reviews": [{
+                    "name": "Error",
+                    "content": f"评审生成失败: {str(e)}"
+                }]
+            }), 429, {'Retry-After': str(e.retry_after)}
+        except PaperNotFound as e:
+            logger.warning(f"Automatic_Review评审请求的论文不存在: {str(e)}")
+            return jsonify({
+                "reviews": [{
+                    "name": "Error",
+                    "content": f"评审生成失败: {str(e)}"
+                }]
+            }), 404
         except Exception as e:
             logger.error(f"Automatic_Review评审失败: {str(e)}")
             return jsonify({
@@ -344,7 +821,8 @@ def create_app():
                 }), 400
             
             # 进行方面分类
-            aspects = automatic_review_service.classify_review_aspects(review_text)
+            with admission_controller.admit():
+                aspects = automatic_review_service.classify_review_aspects(review_text)
             
             return jsonify({
                 "status": "success",
@@ -352,6 +830,12 @@ def create_app():
                 "review_text_length": len(review_text)
             }), 200
             
+        except AdmissionRejected as e:
+            logger.warning(f"方面分类请求被拒绝: {str(e)}")
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 429, {'Retry-After': str(e.retry_after)}
         except Exception as e:
             logger.error(f"方面分类失败: {str(e)}")
             return jsonify({
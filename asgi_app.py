@@ -0,0 +1,485 @@
+"""
+ASGI服务 - 与Flask应用相同的评审接口，流式响应为原生异步生成器，等待vLLM时不占用线程
+
+通过 serve_asgi.py 启动（多worker、预加载tokenizer、优雅关闭）；
+论文解析、token计数等CPU密集的步骤在线程池中执行，不阻塞事件循环
+
+尚未提供的Flask功能：异步评审任务（/api/papers/jobs）、批量评审（/api/papers/batch-review）、
+流式请求的相同请求合并（流式请求各自生成）以及Idempotency-Key；已注册论文和评审缓存按worker进程各自保存，
+多worker时paper_id只在注册它的worker中有效
+"""
+
+import asyncio
+import io
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, Optional
+
+try:
+    from starlette.applications import Starlette
+    from starlette.concurrency import run_in_threadpool
+    from starlette.middleware import Middleware
+    from starlette.middleware.cors import CORSMiddleware
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse, Response, StreamingResponse
+    from starlette.routing import Route
+    HAS_STARLETTE = True
+except ImportError:
+    HAS_STARLETTE = False
+
+from config.config import AppConfig
+from models.paper_models import PaperRequest, PaperResponse
+from services.admission_controller import AdmissionController, AdmissionRejected, AdmissionTicket
+from services.async_vllm_service import AsyncVllmService
+from services.async_automatic_review_service import AsyncAutomaticReviewService
+from services.extraction_memo import ExtractionMemo
+from services.paper_ingest import load_review_request
+from services.paper_store import PaperStore, PaperNotFound
+from services.review_cache import ReviewCache
+from services.review_pipeline import ReviewPipeline
+from services.stream_utils import (
+    SSE_HEADERS, format_sse_event, coalesce_chunks_async, replay_text_chunks_async
+)
+
+logger = logging.getLogger(__name__)
+
+def create_asgi_app(config: Optional[AppConfig] = None):
+    if not HAS_STARLETTE:
+        raise RuntimeError("ASGI服务需要安装 starlette 和 uvicorn")
+
+    # 初始化服务（每个worker进程各自创建；tokenizer在fork前已加载，进程间共享）
+    config = config or AppConfig()
+    vllm_service = AsyncVllmService(config)
+    automatic_review_service = AsyncAutomaticReviewService(config, vllm_service)
+    admission_controller = AdmissionController(
+        max_concurrent=config.vllm.max_parallel_requests,
+        max_queue_depth=config.vllm.max_queue_depth,
+        max_queue_wait=config.vllm.max_queue_wait
+    )
+    review_cache = ReviewCache(
+        cache_dir=config.cache.cache_dir,
+        memory_max_bytes=config.cache.memory_max_bytes,
+        disk_max_bytes=config.cache.disk_max_bytes,
+        ttl_seconds=config.cache.ttl_seconds
+    ) if config.cache.enabled else None
+    extraction_memo = ExtractionMemo(max_bytes=config.cache.extraction_memo_max_bytes)
+    paper_store = PaperStore(
+        max_bytes=config.paper_store.max_bytes,
+        ttl_seconds=config.paper_store.ttl_seconds
+    )
+    pipeline = ReviewPipeline(config, vllm_service, extraction_memo, paper_store, review_cache)
+
+    inflight: Dict[str, asyncio.Future] = {}
+    active_streams = {'count': 0}
+
+    async def read_review_request(request: 'Request') -> Dict[str, Any]:
+        body = await request.body()
+        return await run_in_threadpool(load_review_request, io.BytesIO(body))
+
+    async def build_review_input(prepared: Dict[str, Any], paper_request: PaperRequest):
+        """分块评审时先并发评审各分块（每块单独占用生成名额），返回最终生成使用的 (论文内容, query)"""
+        review_query = prepared['review_query']
+        if not prepared['review_chunks']:
+            return prepared['truncated_content'], review_query
+        front_text, chunks = prepared['review_chunks']
+        chunk_reviews = await vllm_service.generate_chunk_reviews(
+            chunks, review_query,
+            temperature=paper_request.temperature,
+            max_workers=admission_controller.max_concurrent,
+            admit=admission_controller.admit_async
+        )
+        return vllm_service.build_merge_content(front_text, chunk_reviews), vllm_service.build_merge_query(review_query)
+
+    async def generate_review_text(prepared: Dict[str, Any], paper_request: PaperRequest) -> Dict[str, Any]:
+        """非流式生成（分块评审完成后合并阶段占用一个生成名额），确定性结果写入缓存"""
+        content, query = await build_review_input(prepared, paper_request)
+        ticket = await admission_controller.acquire_async()
+        try:
+            review = await vllm_service.generate_peer_review(
+                content, query,
+                temperature=paper_request.temperature,
+                max_tokens=paper_request.max_tokens
+            )
+        finally:
+            ticket.release()
+        if prepared['cache_key']:
+            await run_in_threadpool(review_cache.put, prepared['cache_key'], review)
+        return {'review': review, 'queue_stats': ticket.to_stats()}
+
+    async def generate_review_stream(prepared: Dict[str, Any], paper_request: PaperRequest,
+                                     ticket: Optional[AdmissionTicket]) -> AsyncGenerator[str, None]:
+        """流式生成；客户端断开时关闭上游，vLLM随之停止生成（分块评审完成后再获取合并阶段的名额）"""
+        try:
+            content, query = await build_review_input(prepared, paper_request)
+            if ticket is None:
+                ticket = await admission_controller.acquire_async()
+            upstream = vllm_service.generate_peer_review_stream(
+                content, query,
+                temperature=paper_request.temperature,
+                max_tokens=paper_request.max_tokens
+            )
+            parts = []
+            try:
+                async for chunk in upstream:
+                    parts.append(chunk)
+                    yield chunk
+            finally:
+                await upstream.aclose()
+        finally:
+            if ticket is not None:
+                ticket.release()
+
+        # 完整生成的确定性结果写入缓存
+        full_content = ''.join(parts)
+        if prepared['cache_key'] and full_content.strip():
+            await run_in_threadpool(review_cache.put, prepared['cache_key'], full_content)
+
+    async def stream_peer_review_events(source, paper_request: PaperRequest, prepared: Dict[str, Any],
+                                        start_time: float, processing_method: str,
+                                        queue_stats: Dict[str, Any],
+                                        ticket: Optional[AdmissionTicket] = None) -> AsyncGenerator[str, None]:
+        """将增量文本转换为start/content/end事件，格式与Flask接口一致"""
+        active_streams['count'] += 1
+        chunks = source
+        try:
+            stats = pipeline.peer_review_stats(prepared)
+            yield format_sse_event({
+                'type': 'start',
+                'message': '开始生成同行评审',
+                'stats': {
+                    'input_length': stats['input_length'],
+                    'max_tokens_limit': stats['max_tokens_limit'],
+                    **queue_stats
+                }
+            })
+
+            # 客户端请求合并输出时，按时间窗口/字节数批量发送
+            coalesce = paper_request.stream_coalesce_ms > 0 or paper_request.stream_coalesce_bytes > 0
+            if coalesce:
+                chunks = coalesce_chunks_async(
+                    chunks,
+                    interval_ms=paper_request.stream_coalesce_ms,
+                    max_bytes=paper_request.stream_coalesce_bytes
+                )
+
+            content_events = 0
+            output_length = 0
+            async for chunk in chunks:
+                content_events += 1
+                output_length += len(chunk)
+                yield format_sse_event({
+                    'type': 'content',
+                    'content': chunk
+                })
+
+            yield format_sse_event({
+                'type': 'end',
+                'success': True,
+                'message': '同行评审生成完成',
+                'stats': {
+                    **stats,
+                    'output_length': output_length,
+                    'processing_time': time.time() - start_time,
+                    'processing_method': processing_method,
+                    'content_events': content_events,
+                    'coalesced': coalesce,
+                    'deduplicated': False,
+                    **queue_stats
+                }
+            })
+            logger.info(f"流式同行评审生成完成, 处理方法: {processing_method}")
+
+        except Exception as e:
+            logger.error(f"流式同行评审生成失败: {str(e)}")
+            yield format_sse_event({
+                'type': 'error',
+                'success': False,
+                'error': str(e),
+                'timestamp': datetime.now().isoformat()
+            })
+        finally:
+            active_streams['count'] -= 1
+            # 上游可能尚未开始迭代（客户端在首个事件后断开），需显式关闭并归还名额
+            await chunks.aclose()
+            await source.aclose()
+            if ticket is not None:
+                ticket.release()
+
+    async def health(request: 'Request'):
+        """健康检查接口"""
+        return JSONResponse({"message": "Paper Review Backend is running!"})
+
+    async def service_stats(request: 'Request'):
+        """服务运行统计接口"""
+        return JSONResponse({
+            "vllm_pool": vllm_service.get_pool_stats(),
+            "vllm_replicas": vllm_service.get_replica_stats(),
+            "admission": admission_controller.get_stats(),
+            "vllm_streams": vllm_service.get_stream_stats(),
+            "review_cache": review_cache.get_stats() if review_cache else None,
+            "paper_store": paper_store.get_stats(),
+            "extraction_memo": extraction_memo.get_stats(),
+            "active_streams": active_streams['count'],
+            "aspect_classification": automatic_review_service.get_classification_stats()
+        })
+
+    async def register_paper(request: 'Request'):
+        """论文注册接口 - 上传一次论文，返回可在各评审接口中代替paper_json使用的paper_id"""
+        try:
+            data = await read_review_request(request)
+            if not data.get('paper_json'):
+                return JSONResponse({"status": "error", "message": "paper_json is required"}, status_code=400)
+
+            registered = await run_in_threadpool(pipeline.register_paper, data)
+            return JSONResponse({"status": "success", **registered})
+
+        except ValueError as e:
+            logger.warning(f"论文注册参数无效: {str(e)}")
+            return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+        except Exception as e:
+            logger.error(f"论文注册失败: {str(e)}")
+            return JSONResponse({"status": "error", "message": f"Paper registration failed: {str(e)}"},
+                                status_code=500)
+
+    async def peer_review(request: 'Request'):
+        """生成paper review接口 - 支持流式和非流式输出"""
+        stream_output = False
+        try:
+            data = await read_review_request(request)
+            paper_request = PaperRequest.from_dict(data)
+            stream_output = data.get('stream', False)
+            logger.info(f"收到同行评审请求，流式输出: {stream_output}")
+
+            start_time = time.time()
+            prepared = await run_in_threadpool(pipeline.prepare_peer_review, paper_request)
+            cache_key = prepared['cache_key']
+            cached_review = await run_in_threadpool(review_cache.get, cache_key) if cache_key else None
+
+            if stream_output:
+                if cached_review is not None:
+                    # 命中缓存：按相同事件格式回放，不占用生成名额
+                    logger.info("同行评审命中缓存，回放流式结果")
+                    chunks = replay_text_chunks_async(cached_review, pace_ms=paper_request.replay_pace_ms)
+                    processing_method = "cached"
+                    queue_stats = {}
+                    ticket = None
+                elif prepared['review_chunks']:
+                    # 分块评审在生成中逐块获取名额
+                    chunks = generate_review_stream(prepared, paper_request, None)
+                    processing_method = "chunked_stream_processing"
+                    queue_stats = {}
+                    ticket = None
+                else:
+                    # 先获取生成名额，排队满时直接返回429
+                    ticket = await admission_controller.acquire_async()
+                    chunks = generate_review_stream(prepared, paper_request, ticket)
+                    processing_method = "stream_processing"
+                    queue_stats = ticket.to_stats()
+                return StreamingResponse(
+                    stream_peer_review_events(chunks, paper_request, prepared, start_time,
+                                              processing_method, queue_stats, ticket),
+                    media_type='text/event-stream',
+                    headers=SSE_HEADERS
+                )
+
+            queue_stats = {}
+            if cached_review is not None:
+                peer_review_text = cached_review
+                processing_method = "cached"
+            else:
+                # 相同请求合并：本进程内后到的请求等待同一生成任务
+                request_key = prepared['request_key']
+                flight = inflight.get(request_key)
+                shared = flight is not None
+                if not shared:
+                    flight = asyncio.ensure_future(generate_review_text(prepared, paper_request))
+                    inflight[request_key] = flight
+                    flight.add_done_callback(lambda _: inflight.pop(request_key, None))
+                result = await asyncio.shield(flight)
+                peer_review_text = result['review']
+                queue_stats = result['queue_stats']
+                if shared:
+                    processing_method = "deduplicated"
+                else:
+                    processing_method = "chunked_processing" if prepared['review_chunks'] else "normal_processing"
+
+            response = PaperResponse(
+                success=True,
+                response=peer_review_text,
+                timestamp=datetime.now(),
+                stats={
+                    **pipeline.peer_review_stats(prepared),
+                    'output_length': len(peer_review_text),
+                    'processing_time': time.time() - start_time,
+                    'processing_method': processing_method,
+                    **queue_stats
+                }
+            )
+            logger.info(f"同行评审生成完成, 处理方法: {processing_method}")
+            return JSONResponse(response.to_dict())
+
+        except AdmissionRejected as e:
+            logger.warning(f"同行评审请求被拒绝: {str(e)}")
+            retry_headers = {'Retry-After': str(e.retry_after)}
+            if stream_output:
+                error_data = {
+                    'type': 'error',
+                    'success': False,
+                    'error': str(e),
+                    'retry_after': e.retry_after,
+                    'timestamp': datetime.now().isoformat()
+                }
+                return Response(
+                    format_sse_event(error_data),
+                    status_code=429,
+                    media_type='text/event-stream',
+                    headers={**SSE_HEADERS, **retry_headers}
+                )
+            error_response = PaperResponse(success=False, error=str(e), timestamp=datetime.now())
+            return JSONResponse(error_response.to_dict(), status_code=429, headers=retry_headers)
+        except PaperNotFound as e:
+            logger.warning(f"同行评审请求的论文不存在: {str(e)}")
+            error_response = PaperResponse(success=False, error=str(e), timestamp=datetime.now())
+            return JSONResponse(error_response.to_dict(), status_code=404)
+        except Exception as e:
+            logger.error(f"同行评审生成失败: {str(e)}")
+            if stream_output:
+                error_data = {
+                    'type': 'error',
+                    'success': False,
+                    'error': str(e),
+                    'timestamp': datetime.now().isoformat()
+                }
+                return Response(format_sse_event(error_data), media_type='text/event-stream', headers=SSE_HEADERS)
+            error_response = PaperResponse(success=False, error=str(e), timestamp=datetime.now())
+            return JSONResponse(error_response.to_dict(), status_code=500)
+
+    def prepare_automatic_review(paper_request: PaperRequest):
+        """在工作线程中准备论文内容，返回 (论文内容, 缓存键, 缓存的评审)"""
+        pipeline.resolve_paper(paper_request)
+        text_processor = pipeline.create_text_processor(paper_request)
+
+        # 获取论文内容，按上下文规划截断到评审提示词之外的剩余预算
+        single_pass = paper_request.single_pass_review
+        paper_budget = automatic_review_service.get_paper_budget(single_pass)
+        paper_content = text_processor.process_paper_json(paper_request.paper_json, max_tokens=paper_budget)
+        logger.info(f"论文内容长度: {len(paper_content):,} 字符")
+
+        request_key = pipeline.review_request_key(
+            paper_content, automatic_review_service.get_prompt_fingerprint(single_pass),
+            0.0, automatic_review_service.REVIEW_MAX_TOKENS, 'automatic_review'
+        )
+        cache_key = request_key if pipeline.is_cacheable(0.0) else None
+        cached_reviews = review_cache.get(cache_key) if cache_key else None
+        return paper_content, cache_key, cached_reviews
+
+    async def build_automatic_reviews(paper_request: PaperRequest):
+        """生成Automatic_Review评审，返回前端期望的格式；排队和生成期间不占用线程"""
+        paper_content, cache_key, cached_reviews = await run_in_threadpool(prepare_automatic_review, paper_request)
+        if cached_reviews is not None:
+            logger.info("Automatic_Review评审命中缓存")
+            return cached_reviews
+
+        reviews, cacheable = await automatic_review_service.generate_aspect_reviews(
+            paper_content, admit=admission_controller.admit_async, single_pass=paper_request.single_pass_review
+        )
+        if cache_key and cacheable:
+            await run_in_threadpool(review_cache.put, cache_key, reviews)
+        return reviews
+
+    async def automatic_review(request: 'Request'):
+        """自动评审接口 - 使用Automatic_Review原始功能，返回符合前端期望的格式"""
+        try:
+            data = await read_review_request(request)
+            paper_request = PaperRequest.from_dict(data)
+            logger.info("收到Automatic_Review评审请求")
+            reviews = await build_automatic_reviews(paper_request)
+            return JSONResponse({"reviews": reviews})
+
+        except AdmissionRejected as e:
+            logger.warning(f"Automatic_Review评审请求被拒绝: {str(e)}")
+            return JSONResponse({
+                "reviews": [{"name": "Error", "content": f"评审生成失败: {str(e)}"}]
+            }, status_code=429, headers={'Retry-After': str(e.retry_after)})
+        except PaperNotFound as e:
+            logger.warning(f"Automatic_Review评审请求的论文不存在: {str(e)}")
+            return JSONResponse({
+                "reviews": [{"name": "Error", "content": f"评审生成失败: {str(e)}"}]
+            }, status_code=404)
+        except Exception as e:
+            logger.error(f"Automatic_Review评审失败: {str(e)}")
+            return JSONResponse({
+                "reviews": [{"name": "Error", "content": f"评审生成失败: {str(e)}"}]
+            })
+
+    async def classify_review_aspects(request: 'Request'):
+        """评审方面分类接口"""
+        try:
+            data = await request.json()
+            review_text = data.get('review_text', '')
+            if not review_text:
+                return JSONResponse({"status": "error", "message": "review_text is required"}, status_code=400)
+
+            async with admission_controller.admit_async():
+                aspects = await automatic_review_service.classify_review_aspects(review_text)
+            return JSONResponse({
+                "status": "success",
+                "aspects": aspects,
+                "review_text_length": len(review_text)
+            })
+
+        except AdmissionRejected as e:
+            logger.warning(f"方面分类请求被拒绝: {str(e)}")
+            return JSONResponse({"status": "error", "message": str(e)}, status_code=429,
+                                headers={'Retry-After': str(e.retry_after)})
+        except Exception as e:
+            logger.error(f"方面分类失败: {str(e)}")
+            return JSONResponse({"status": "error", "message": f"Aspect classification failed: {str(e)}"},
+                                status_code=500)
+
+    async def evaluate_review_quality(request: 'Request'):
+        """评审质量评估接口"""
+        try:
+            data = await request.json()
+            review_text = data.get('review_text', '')
+            reference_review = data.get('reference_review', None)
+            if not review_text:
+                return JSONResponse({"status": "error", "message": "review_text is required"}, status_code=400)
+
+            quality_scores = await run_in_threadpool(
+                automatic_review_service.evaluate_review_quality, review_text, reference_review
+            )
+            return JSONResponse({
+                "status": "success",
+                "quality_scores": quality_scores,
+                "review_text_length": len(review_text)
+            })
+
+        except Exception as e:
+            logger.error(f"质量评估失败: {str(e)}")
+            return JSONResponse({"status": "error", "message": f"Quality evaluation failed: {str(e)}"},
+                                status_code=500)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        await vllm_service.warmup()
+        yield
+        # 服务器已停止接收新连接并等待进行中的响应结束，这里只释放连接池
+        logger.info(f"ASGI worker关闭，未结束的流式响应: {active_streams['count']}")
+        await vllm_service.close()
+
+    return Starlette(
+        routes=[
+            Route('/api/papers/health', health, methods=['GET']),
+            Route('/api/papers/stats', service_stats, methods=['GET']),
+            Route('/api/papers/register', register_paper, methods=['POST']),
+            Route('/api/papers/peer-review', peer_review, methods=['POST']),
+            Route('/api/papers/automatic-review', automatic_review, methods=['POST']),
+            Route('/api/papers/review-aspects', classify_review_aspects, methods=['POST']),
+            Route('/api/papers/review-quality', evaluate_review_quality, methods=['POST']),
+        ],
+        middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+        lifespan=lifespan
+    )
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+离线批量同行评审脚本 - 不经过Flask，直接调用TextProcessorService和VllmService
+
+对目录下的论文JSON并发生成评审，结果逐行追加到JSONL文件；
+重新运行时跳过输出文件中已成功的论文，中断后可以继续
+
+用法:
+    python bulk_review.py static/papers --output results/reviews.jsonl --concurrency 8
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+from config.config import AppConfig
+from services.extraction_memo import ExtractionMemo
+from services.text_processor_service import TextProcessorService
+from services.vllm_service import VllmService, CHUNK_REVIEW_MAX_TOKENS, PEER_REVIEW_QUERY
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger('bulk_review')
+
+class BulkReviewer:
+    """批量评审执行器：准备论文输入、调用vLLM，并把结果追加写入JSONL"""
+
+    def __init__(self, config: AppConfig, args: argparse.Namespace):
+        self.args = args
+        # 离线评审没有等待中的客户端：连接池按并发数分配，满时一直等待空闲连接，
+        # 而不是像请求路径那样在pool_timeout后失败
+        config.vllm.pool_size = max(config.vllm.pool_size, args.concurrency)
+        config.vllm.pool_timeout = None
+        self.vllm_service = VllmService(config)
+        self.text_processor = TextProcessorService(
+            include_authors=args.include_authors,
+            tokenizer_path=config.tokenizer_path,
+            extraction_memo=ExtractionMemo(max_bytes=config.cache.extraction_memo_max_bytes),
+            reference_mode=args.reference_mode,
+            dedup_paragraphs=not args.no_dedup
+        )
+        self._write_lock = threading.Lock()
+
+    def review_paper(self, path: Path) -> Dict[str, Any]:
+        """评审一篇论文，失败时返回错误记录"""
+        start_time = time.time()
+        record = {'paper': path.relative_to(self.args.input_dir).as_posix()}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            paper_json = data.get('paper_json', data) if isinstance(data, dict) else None
+            if not isinstance(paper_json, dict):
+                raise ValueError("论文文件必须是JSON对象")
+
+            peer_review, stats = self._generate(paper_json)
+            record.update({
+                'success': True,
+                'response': peer_review,
+                'stats': {
+                    **stats,
+                    'output_length': len(peer_review),
+                    'processing_time': time.time() - start_time
+                }
+            })
+        except Exception as e:
+            record.update({
+                'success': False,
+                'error': str(e),
+                'stats': {'processing_time': time.time() - start_time}
+            })
+        record['timestamp'] = datetime.now().isoformat()
+        return record
+
+    def _generate(self, paper_json: Dict[str, Any]):
+        """与/api/papers/peer-review相同的输入准备和生成流程"""
+        args = self.args
+        full_text = self.text_processor.process_paper_json(paper_json, auto_truncate=False)
+        context_plan = self.vllm_service.plan_context(PEER_REVIEW_QUERY, args.max_tokens)
+        if context_plan.paper_budget <= 0:
+            raise ValueError(
+                f"max_tokens ({args.max_tokens}) 过大，超出上下文窗口 ({context_plan.context_length} tokens)"
+            )
+        content = self.text_processor.process_paper_json(paper_json, max_tokens=context_plan.paper_budget)
+        query = PEER_REVIEW_QUERY
+
+        chunk_count = 0
+        if args.use_chunking and len(content) < len(full_text):
+            chunk_plan = self.vllm_service.plan_context(
+                self.vllm_service.build_chunk_review_query(query, 0, 1), CHUNK_REVIEW_MAX_TOKENS
+            )
+            front_text, chunks = self.text_processor.build_review_chunks(
+                paper_json, max_tokens=chunk_plan.paper_budget
+            )
+            if len(chunks) > 1:
+                chunk_count = len(chunks)
+                chunk_reviews = self.vllm_service.generate_chunk_reviews(
+                    chunks, query, temperature=args.temperature
+                )
+                content = self.vllm_service.build_merge_content(front_text, chunk_reviews)
+                query = self.vllm_service.build_merge_query(query)
+
+        peer_review = self.vllm_service.generate_peer_review(
+            content, query, temperature=args.temperature, max_tokens=args.max_tokens
+        )
+        return peer_review, {
+            'input_length': len(full_text),
+            'max_tokens_limit': context_plan.paper_budget,
+            'used_chunking': chunk_count > 0,
+            'chunk_count': chunk_count
+        }
+
+    def append_record(self, output, record: Dict[str, Any]):
+        """追加一条结果并立即落盘，中断时最多丢失正在写的一行"""
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._write_lock:
+            output.write(line)
+            output.flush()
+            os.fsync(output.fileno())
+
+def load_completed(output_path: Path) -> Set[str]:
+    """读取输出文件中已成功评审的论文；中断时写了一半的行直接忽略"""
+    completed = set()
+    if not output_path.exists():
+        return completed
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('success'):
+                completed.add(record['paper'])
+    return completed
+
+def open_output(output_path: Path):
+    """以追加方式打开输出文件；上次中断在行中间时先补一个换行"""
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    needs_newline = False
+    if output_path.exists() and output_path.stat().st_size > 0:
+        with open(output_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b'\n'
+    output = open(output_path, 'a', encoding='utf-8')
+    if needs_newline:
+        output.write('\n')
+    return output
+
+def parse_args(config: AppConfig) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='离线批量同行评审（可中断续跑）')
+    parser.add_argument('input_dir', type=Path, help='论文JSON目录')
+    parser.add_argument('--output', type=Path, default=Path('results/bulk_reviews.jsonl'), help='结果JSONL文件')
+    parser.add_argument('--pattern', default='**/*.json', help='论文文件匹配模式')
+    parser.add_argument('--concurrency', type=int, default=config.jobs.batch_max_concurrency,
+                        help='同时评审的论文数（默认BATCH_MAX_CONCURRENCY）')
+    parser.add_argument('--max-tokens', type=int, default=8192, help='评审输出的最大token数')
+    parser.add_argument('--temperature', type=float, default=0.0)
+    parser.add_argument('--reference-mode', default='full', choices=TextProcessorService.REFERENCE_MODES,
+                        help='参考文献渲染方式：full（原有输出）、compact（缩写作者）、cited（只保留正文引用过的）')
+    parser.add_argument('--include-authors', action='store_true', help='包含作者信息')
+    parser.add_argument('--no-dedup', action='store_true', help='不去除重复段落')
+    parser.add_argument('--use-chunking', action='store_true', help='超出上下文窗口时分块评审再合并')
+    parser.add_argument('--limit', type=int, default=0, help='本次最多评审的论文数，0表示不限')
+    return parser.parse_args()
+
+def main():
+    config = AppConfig()
+    args = parse_args(config)
+
+    papers: List[Path] = sorted(p for p in args.input_dir.glob(args.pattern) if p.is_file())
+    completed = load_completed(args.output)
+    pending = [p for p in papers if p.relative_to(args.input_dir).as_posix() not in completed]
+    skipped = len(papers) - len(pending)
+    if args.limit > 0:
+        pending = pending[:args.limit]
+
+    print(f"论文总数: {len(papers)}, 已完成（跳过）: {skipped}, 本次评审: {len(pending)}, 并发: {args.concurrency}")
+    if not pending:
+        return 0
+
+    reviewer = BulkReviewer(config, args)
+    start_time = time.time()
+    succeeded = failed = 0
+
+    output = open_output(args.output)
+    executor = ThreadPoolExecutor(max_workers=max(1, args.concurrency), thread_name_prefix='bulk-review')
+    futures = [executor.submit(reviewer.review_paper, path) for path in pending]
+    recorded = set()
+
+    def write_result(future):
+        nonlocal succeeded, failed
+        record = future.result()
+        reviewer.append_record(output, record)
+        recorded.add(future)
+        if record['success']:
+            succeeded += 1
+            status = f"成功 {record['stats']['output_length']} 字符"
+        else:
+            failed += 1
+            status = f"失败: {record['error']}"
+        elapsed = time.time() - start_time
+        print(f"[{len(recorded)}/{len(pending)}] {record['paper']} {status} "
+              f"({record['stats']['processing_time']:.1f}s, 吞吐 {len(recorded) / elapsed * 60:.1f} 篇/分钟)")
+
+    try:
+        for future in as_completed(futures):
+            write_result(future)
+    except KeyboardInterrupt:
+        # 未开始的论文直接取消；正在评审的论文等待完成并写入结果，再次Ctrl+C立即退出
+        remaining = [f for f in futures if f not in recorded and not f.cancel()]
+        print(f"已中断：取消未开始的论文，等待 {len(remaining)} 篇正在评审的论文完成并写入结果"
+              f"（再次 Ctrl+C 立即退出，这些论文下次运行时重新评审）")
+        try:
+            for future in as_completed(remaining):
+                write_result(future)
+        except KeyboardInterrupt:
+            print("立即退出，未完成的论文将在下次运行时重新评审")
+            output.close()
+            os._exit(130)  # 评审线程不会被中断，正常退出会等待它们结束
+        print(f"已停止: 成功 {succeeded}, 失败 {failed}, 剩余论文下次运行时继续")
+        return 130
+    finally:
+        executor.shutdown(wait=False)
+        output.close()
+
+    elapsed = time.time() - start_time
+    print(f"完成: 成功 {succeeded}, 失败 {failed}, 耗时 {elapsed:.1f}s, 结果: {args.output}")
+    return 0 if failed == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,128 @@
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional, List
 
 @dataclass
 class VllmConfig:
     base_url: str = "http://127.0.0.1:8000"  
     model_name: str = "scientific-reviewer-7b"  
     timeout: int = 300
-    max_context_length: int = 32000  # 32k上下文
+    max_context_length: int = 32768  # 模型上下文窗口（token），与vLLM的max_model_len一致
+    context_safety_margin: int = 64  # chat模板等未计入部分的余量（token）
     batch_size: int = 1
     max_parallel_requests: int = 1
+    # 准入控制：超出max_parallel_requests的请求排队，队列满或等待超时返回429
+    max_queue_depth: int = 32
+    max_queue_wait: float = 120.0
+    # 连接池配置（每个vLLM地址共享一个连接池）
+    pool_size: int = 16
+    pool_timeout: Optional[float] = 30.0  # 连接池满时等待空闲连接的最长时间（秒），超时返回429；None表示不限时（离线调用）
+    keep_alive: bool = True
+    connect_timeout: float = 5.0
+    read_timeout: Optional[float] = None  # 为None时使用timeout
+    # 多副本路由配置（为空时仅使用base_url）
+    replica_urls: List[str] = field(default_factory=list)
+    routing_strategy: str = "least_requests"  # least_requests / least_tokens
+    health_check_interval: float = 10.0
+    
+    def get_replica_urls(self) -> List[str]:
+        return self.replica_urls or [self.base_url]
+
+@dataclass
+class CacheConfig:
+    enabled: bool = True
+    cache_dir: Optional[str] = "cache/reviews"  # 为空时仅使用内存缓存
+    memory_max_bytes: int = 64 * 1024 * 1024
+    disk_max_bytes: int = 1024 * 1024 * 1024
+    ttl_seconds: float = 7 * 24 * 3600
+    extraction_memo_max_bytes: int = 128 * 1024 * 1024  # 论文提取结果memo的字节上限
+
+@dataclass
+class PaperStoreConfig:
+    max_bytes: int = 256 * 1024 * 1024  # 已注册论文JSON的总字节上限，超出按LRU淘汰
+    ttl_seconds: float = 24 * 3600
+
+@dataclass
+class DedupConfig:
+    idempotency_window: float = 600.0  # 幂等键的有效期（秒）
+
+@dataclass
+class JobConfig:
+    max_workers: int = 0  # 异步评审任务的后台线程数，0表示与vLLM并发请求数一致
+    max_pending: int = 64  # 排队任务上限，超出返回429
+    retention_seconds: float = 3600.0  # 已结束任务的结果保留时间
+    batch_max_concurrency: int = 0  # 批量评审接口同时处理的论文数上限，0表示与vLLM并发请求数一致
+    batch_max_items: int = 100  # 批量评审接口单次请求的论文数上限
+
+@dataclass
+class AutomaticReviewConfig:
+    # 流式生成评审，已完成的段落分批进行方面分类（默认关闭）。分类不占用准入名额，
+    # 开启后vLLM最多同时处理 max_parallel_requests + classification_concurrency 个请求
+    pipelined_classification: bool = False
+    classification_concurrency: int = 4  # 同时进行的分类调用上限（进程内共享）
+    classification_batch_paragraphs: int = 3  # 生成期间每批至少包含的段落数（生成结束时剩余段落为一批）
+
+@dataclass
+class ServerConfig:
+    host: str = "0.0.0.0"
+    port: int = 8080
+    workers: int = 1  # ASGI模式的worker进程数
+    graceful_timeout: float = 300.0  # 关闭时等待进行中的流式响应结束的最长时间（秒）
 
 class AppConfig:
     def __init__(self):
+        # tokenizer路径（本地目录或HuggingFace模型名），为空时按字符截断
+        self.tokenizer_path = os.getenv('TOKENIZER_PATH') or None
+        read_timeout = os.getenv('VLLM_READ_TIMEOUT')
+        replica_urls = [url.strip() for url in os.getenv('VLLM_BASE_URLS', '').split(',') if url.strip()]
         self.vllm = VllmConfig(
             base_url=os.getenv('VLLM_BASE_URL', 'http://127.0.0.1:8000'),
             model_name=os.getenv('VLLM_MODEL_NAME', 'scientific-reviewer-7b'),
-            timeout=int(os.getenv('VLLM_TIMEOUT', '300'))
-        )
\ No newline at end of file
+            timeout=int(os.getenv('VLLM_TIMEOUT', '300')),
+            max_context_length=int(os.getenv('VLLM_MAX_CONTEXT_LENGTH', '32768')),
+            context_safety_margin=int(os.getenv('VLLM_CONTEXT_SAFETY_MARGIN', '64')),
+            max_parallel_requests=int(os.getenv('VLLM_MAX_PARALLEL_REQUESTS', '1')),
+            max_queue_depth=int(os.getenv('VLLM_MAX_QUEUE_DEPTH', '32')),
+            max_queue_wait=float(os.getenv('VLLM_MAX_QUEUE_WAIT', '120')),
+            pool_size=int(os.getenv('VLLM_POOL_SIZE', '16')),
+            pool_timeout=float(os.getenv('VLLM_POOL_TIMEOUT', '30')),
+            keep_alive=os.getenv('VLLM_KEEP_ALIVE', 'true').lower() in ('1', 'true', 'yes'),
+            connect_timeout=float(os.getenv('VLLM_CONNECT_TIMEOUT', '5')),
+            read_timeout=float(read_timeout) if read_timeout else None,
+            replica_urls=replica_urls,
+            routing_strategy=os.getenv('VLLM_ROUTING_STRATEGY', 'least_requests'),
+            health_check_interval=float(os.getenv('VLLM_HEALTH_CHECK_INTERVAL', '10'))
+        )
+        self.cache = CacheConfig(
+            enabled=os.getenv('REVIEW_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+            cache_dir=os.getenv('REVIEW_CACHE_DIR', 'cache/reviews') or None,
+            memory_max_bytes=int(os.getenv('REVIEW_CACHE_MEMORY_MAX_BYTES', str(64 * 1024 * 1024))),
+            disk_max_bytes=int(os.getenv('REVIEW_CACHE_DISK_MAX_BYTES', str(1024 * 1024 * 1024))),
+            ttl_seconds=float(os.getenv('REVIEW_CACHE_TTL_SECONDS', str(7 * 24 * 3600))),
+            extraction_memo_max_bytes=int(os.getenv('EXTRACTION_MEMO_MAX_BYTES', str(128 * 1024 * 1024)))
+        )
+        self.paper_store = PaperStoreConfig(
+            max_bytes=int(os.getenv('PAPER_STORE_MAX_BYTES', str(256 * 1024 * 1024))),
+            ttl_seconds=float(os.getenv('PAPER_STORE_TTL_SECONDS', str(24 * 3600)))
+        )
+        self.dedup = DedupConfig(
+            idempotency_window=float(os.getenv('IDEMPOTENCY_WINDOW_SECONDS', '600'))
+        )
+        self.jobs = JobConfig(
+            max_workers=int(os.getenv('REVIEW_JOB_WORKERS', '0')) or self.vllm.max_parallel_requests,
+            max_pending=int(os.getenv('REVIEW_JOB_MAX_PENDING', '64')),
+            retention_seconds=float(os.getenv('REVIEW_JOB_RETENTION_SECONDS', '3600')),
+            batch_max_concurrency=int(os.getenv('BATCH_MAX_CONCURRENCY', '0')) or self.vllm.max_parallel_requests,
+            batch_max_items=int(os.getenv('BATCH_MAX_ITEMS', '100'))
+        )
+        self.automatic_review = AutomaticReviewConfig(
+            pipelined_classification=os.getenv('AUTOMATIC_REVIEW_PIPELINED_CLASSIFICATION', 'false').lower() in ('1', 'true', 'yes'),
+            classification_concurrency=int(os.getenv('AUTOMATIC_REVIEW_CLASSIFICATION_CONCURRENCY', '4')),
+            classification_batch_paragraphs=int(os.getenv('AUTOMATIC_REVIEW_CLASSIFICATION_BATCH_PARAGRAPHS', '3'))
+        )
+        self.server = ServerConfig(
+            host=os.getenv('SERVER_HOST', '0.0.0.0'),
+            port=int(os.getenv('SERVER_PORT', '8080')),
+            workers=int(os.getenv('SERVER_WORKERS', '1')),
+            graceful_timeout=float(os.getenv('SERVER_GRACEFUL_TIMEOUT', '300'))
+        )
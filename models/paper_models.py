@@ -4,22 +4,38 @@ from typing import Optional, Dict, Any, List
 
 @dataclass
 class PaperRequest:
-    paper_json: Dict[str, Any]  # JSON格式论文
+    paper_json: Optional[Dict[str, Any]] = None  # JSON格式论文
+    paper_id: Optional[str] = None  # 已注册论文的ID，可代替paper_json
     temperature: float = 0.0  # 确定性输出
     max_tokens: int = 8192  
     include_authors: bool = False  # 是否包含作者信息（peer review建议False避免偏见）
+    use_chunking: bool = False  # 超出上下文窗口时分块并发评审再合并，而不是截断
+    reference_mode: str = 'full'  # 参考文献渲染方式：full（原有输出）/ compact（缩写作者）/ cited（紧凑且只保留正文引用过的）
+    dedup_paragraphs: bool = True  # 去除正文中完全重复或近似重复的段落（保留首次出现）
+    stream_coalesce_ms: int = 0  # 流式输出合并时间窗口（毫秒），0表示逐token输出
+    stream_coalesce_bytes: int = 0  # 流式输出合并字节数，0表示不按大小合并
+    replay_pace_ms: int = 0  # 回放缓存结果时每个事件间隔（毫秒）
+    single_pass_review: bool = False  # 自动评审一次生成带方面标签的段落，不再单独调用方面分类
     
     @classmethod
     def from_dict(cls, data: dict):
-        # 检查是否提供了JSON格式的论文内容
-        if not data.get('paper_json'):
-            raise ValueError("必须提供 paper_json（JSON格式的论文数据）")
+        # 检查是否提供了JSON格式的论文内容或已注册的论文ID
+        if not data.get('paper_json') and not data.get('paper_id'):
+            raise ValueError("必须提供 paper_json（JSON格式的论文数据）或 paper_id")
             
         return cls(
-            paper_json=data['paper_json'],
+            paper_json=data.get('paper_json'),
+            paper_id=data.get('paper_id'),
             temperature=data.get('temperature', 0.0),
             max_tokens=data.get('max_tokens', 8192),
-            include_authors=data.get('include_authors', False)
+            include_authors=data.get('include_authors', False),
+            use_chunking=bool(data.get('use_chunking', False)),
+            reference_mode=data.get('reference_mode', 'full'),
+            dedup_paragraphs=bool(data.get('dedup_paragraphs', True)),
+            stream_coalesce_ms=int(data.get('stream_coalesce_ms', 0)),
+            stream_coalesce_bytes=int(data.get('stream_coalesce_bytes', 0)),
+            replay_pace_ms=int(data.get('replay_pace_ms', 0)),
+            single_pass_review=bool(data.get('single_pass_review', False))
         )
 
 @dataclass
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+ASGI生产服务启动脚本 - 预加载tokenizer后fork多个uvicorn worker共享同一监听socket
+
+收到SIGTERM/SIGINT时转发给各worker：停止接收新连接，等待进行中的流式响应结束
+（最长SERVER_GRACEFUL_TIMEOUT秒）后退出；worker异常退出时自动重启
+
+用法:
+    SERVER_WORKERS=4 python serve_asgi.py
+    python serve_asgi.py --port 8080 --workers 4
+"""
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+from dataclasses import replace
+
+try:
+    import uvicorn
+    HAS_UVICORN = True
+except ImportError:
+    HAS_UVICORN = False
+
+from config.config import AppConfig
+from services.tokenizer_registry import get_tokenizer
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('serve_asgi')
+
+def build_uvicorn_config(config: AppConfig) -> 'uvicorn.Config':
+    from asgi_app import create_asgi_app
+
+    return uvicorn.Config(
+        lambda: create_asgi_app(config),
+        factory=True,
+        host=config.server.host,
+        port=config.server.port,
+        timeout_graceful_shutdown=config.server.graceful_timeout,
+        log_config=None
+    )
+
+def run_worker(uvicorn_config: 'uvicorn.Config', sock) -> int:
+    """worker进程入口：恢复默认信号处理后交给uvicorn（uvicorn自行处理SIGTERM/SIGINT）"""
+    os.setpgid(0, 0)  # 终端Ctrl+C只发给主进程，由主进程统一转发
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+    try:
+        uvicorn.Server(uvicorn_config).run(sockets=[sock])
+        return 0
+    except Exception as e:
+        logger.error(f"worker异常退出: {str(e)}")
+        return 1
+
+def spawn_worker(uvicorn_config: 'uvicorn.Config', sock) -> int:
+    pid = os.fork()
+    if pid == 0:
+        os._exit(run_worker(uvicorn_config, sock))
+    logger.info(f"启动worker: pid {pid}")
+    return pid
+
+def serve(config: AppConfig) -> int:
+    if not HAS_UVICORN:
+        logger.error("ASGI服务需要安装 uvicorn 和 starlette")
+        return 1
+
+    # fork前加载tokenizer，worker进程直接继承，不再各自加载
+    get_tokenizer(config.tokenizer_path)
+    uvicorn_config = build_uvicorn_config(config)
+
+    if config.server.workers <= 1:
+        uvicorn.Server(uvicorn_config).run()
+        return 0
+
+    sock = uvicorn_config.bind_socket()
+    workers = set(spawn_worker(uvicorn_config, sock) for _ in range(config.server.workers))
+    stopping = False
+
+    def handle_stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        logger.info(f"收到信号 {signum}，等待 {len(workers)} 个worker处理完进行中的请求后退出")
+        sock.close()
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid not in workers:
+            continue
+        workers.discard(pid)
+        code = os.waitstatus_to_exitcode(status)
+        if stopping:
+            logger.info(f"worker已退出: pid {pid}")
+            continue
+        logger.warning(f"worker意外退出: pid {pid}, 退出码 {code}，重新启动")
+        time.sleep(1)  # 避免启动即失败时反复fork
+        workers.add(spawn_worker(uvicorn_config, sock))
+
+    logger.info("ASGI服务已停止")
+    return 0
+
+def parse_args(config: AppConfig) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='ASGI生产服务（多worker）')
+    parser.add_argument('--host', default=config.server.host)
+    parser.add_argument('--port', type=int, default=config.server.port)
+    parser.add_argument('--workers', type=int, default=config.server.workers, help='worker进程数（默认SERVER_WORKERS）')
+    parser.add_argument('--graceful-timeout', type=float, default=config.server.graceful_timeout,
+                        help='关闭时等待进行中请求的最长时间（秒）')
+    return parser.parse_args()
+
+def main():
+    config = AppConfig()
+    args = parse_args(config)
+    config.server = replace(
+        config.server,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        graceful_timeout=args.graceful_timeout
+    )
+    return serve(config)
+
+if __name__ == '__main__':
+    sys.exit(main())
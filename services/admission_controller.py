@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+class AdmissionRejected(Exception):
+    """排队已满或等待超时，调用方应返回429"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionTicket:
+    """一次准入许可，release可重复调用"""
+
+    def __init__(self, controller: 'AdmissionController', queue_depth: int, wait_time: float):
+        self.controller = controller
+        self.queue_depth = queue_depth
+        self.wait_time = wait_time
+        self.admitted_at = time.time()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.controller._release(time.time() - self.admitted_at)
+
+    def to_stats(self) -> Dict[str, Any]:
+        return {
+            'queue_depth': self.queue_depth,
+            'queue_wait_time': round(self.wait_time, 4)
+        }
+
+class AdmissionController:
+    """并发生成准入控制 - 限制同时进行的生成数，超出部分FIFO排队，队列满或等待超时则拒绝"""
+
+    def __init__(self, max_concurrent: int, max_queue_depth: int, max_queue_wait: float):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue_depth = max(0, max_queue_depth)
+        self.max_queue_wait = max_queue_wait
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queue = deque()
+        self._next_seq = 0
+        # 协程排队者：序号 -> (事件循环, asyncio.Event)，名额变化时在各自的事件循环中唤醒
+        self._async_waiters = {}
+
+        # 统计
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._total_wait_time = 0.0
+        self._avg_service_time = 60.0  # 生成耗时的滑动平均，用于估算Retry-After
+
+    def acquire(self) -> AdmissionTicket:
+        """获取准入许可，必要时排队等待"""
+        arrived_at = time.time()
+        with self._cond:
+            queue_depth = len(self._queue)
+
+            if self._active < self.max_concurrent and not self._queue:
+                return self._admit(queue_depth, arrived_at)
+
+            seq = self._enqueue(queue_depth)
+            deadline = arrived_at + self.max_queue_wait
+
+            try:
+                while not self._can_admit(seq):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise self._queue_timeout()
+                    self._cond.wait(remaining)
+            finally:
+                self._dequeue(seq)
+
+            return self._admit(queue_depth, arrived_at)
+
+    async def acquire_async(self) -> AdmissionTicket:
+        """acquire的协程版本：排队时只挂起协程，不占用线程；与acquire共用同一个FIFO队列"""
+        arrived_at = time.time()
+        wakeup = asyncio.Event()
+        with self._cond:
+            queue_depth = len(self._queue)
+
+            if self._active < self.max_concurrent and not self._queue:
+                return self._admit(queue_depth, arrived_at)
+
+            seq = self._enqueue(queue_depth)
+            self._async_waiters[seq] = (asyncio.get_running_loop(), wakeup)
+        deadline = arrived_at + self.max_queue_wait
+
+        try:
+            while True:
+                with self._cond:
+                    if self._can_admit(seq):
+                        self._dequeue(seq)
+                        return self._admit(queue_depth, arrived_at)
+                    # 在锁内清除，之后的唤醒不会丢失
+                    wakeup.clear()
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    with self._cond:
+                        raise self._queue_timeout()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # 超时、被取消或已准入，都要离开队列
+            with self._cond:
+                self._async_waiters.pop(seq, None)
+                if seq in self._queue:
+                    self._dequeue(seq)
+
+    @contextmanager
+    def admit(self):
+        """在上下文中占用一个生成名额"""
+        ticket = self.acquire()
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    @asynccontextmanager
+    async def admit_async(self):
+        """admit的协程版本"""
+        ticket = await self.acquire_async()
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue_depth': self.max_queue_depth,
+                'max_queue_wait': self.max_queue_wait,
+                'active': self._active,
+                'queue_depth': len(self._queue),
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+                'timed_out': self._timed_out,
+                'avg_queue_wait_time': round(self._total_wait_time / self._admitted, 4) if self._admitted else 0.0,
+                'avg_service_time': round(self._avg_service_time, 2)
+            }
+
+    def _enqueue(self, queue_depth: int) -> int:
+        """进入等待队列，队列已满时拒绝（调用方需持有锁）"""
+        if queue_depth >= self.max_queue_depth:
+            self._rejected += 1
+            raise AdmissionRejected(
+                f"服务繁忙，排队请求已达上限 ({self.max_queue_depth})",
+                self._estimate_retry_after(queue_depth)
+            )
+        seq = self._next_seq
+        self._next_seq += 1
+        self._queue.append(seq)
+        return seq
+
+    def _can_admit(self, seq: int) -> bool:
+        return self._queue[0] == seq and self._active < self.max_concurrent
+
+    def _dequeue(self, seq: int):
+        """离开等待队列（调用方需持有锁）"""
+        self._queue.remove(seq)
+        # 队首变化，唤醒其他等待者
+        self._notify_waiters()
+
+    def _queue_timeout(self) -> AdmissionRejected:
+        """排队超时（调用方需持有锁）"""
+        self._timed_out += 1
+        self._rejected += 1
+        return AdmissionRejected(
+            f"排队等待超时 ({self.max_queue_wait:.0f}s)",
+            self._estimate_retry_after(len(self._queue))
+        )
+
+    def _notify_waiters(self):
+        """唤醒线程和协程排队者（调用方需持有锁）"""
+        self._cond.notify_all()
+        for loop, wakeup in self._async_waiters.values():
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # 事件循环已关闭，该排队者不会再等待
+                pass
+
+    def _admit(self, queue_depth: int, arrived_at: float) -> AdmissionTicket:
+        """登记准入（调用方需持有锁）"""
+        wait_time = time.time() - arrived_at
+        self._active += 1
+        self._admitted += 1
+        self._total_wait_time += wait_time
+        return AdmissionTicket(self, queue_depth, wait_time)
+
+    def _release(self, service_time: float):
+        with self._cond:
+            self._active -= 1
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+            self._notify_waiters()
+
+    def _estimate_retry_after(self, queue_depth: int) -> int:
+        """按平均生成耗时估算排到的时间（秒）"""
+        rounds = (queue_depth + 1) / self.max_concurrent
+        return max(1, math.ceil(rounds * self._avg_service_time))
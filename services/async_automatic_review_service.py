@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Async Automatic Review Service - 基于AsyncVllmService的自动评审，等待生成和分类时不占用线程
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.automatic_review_service import AutomaticReviewService, _PARAGRAPH_BREAK
+
+logger = logging.getLogger(__name__)
+
+class AsyncAutomaticReviewService(AutomaticReviewService):
+    """
+    自动评审服务的协程版本 - 提示词、解析和结果组装与AutomaticReviewService一致，
+    调用LLM的方法（generate_aspect_reviews、classify_review_aspects等）为协程
+
+    vllm_service 为 AsyncVllmService；admit 为异步上下文管理器工厂（如 AdmissionController.admit_async）
+    """
+
+    def __init__(self, config, vllm_service=None):
+        super().__init__(config, vllm_service)
+        self._classification_slots: Optional[asyncio.Semaphore] = None  # 在事件循环内延迟创建
+
+    async def generate_review(self, paper_content: str, single_pass: bool = False) -> Dict[str, Any]:
+        """生成评审 - 使用Automatic_Review的原始功能"""
+        try:
+            return await self._generate_review_using_automatic_review(paper_content, single_pass)
+        except Exception as e:
+            logger.error(f"生成评审失败: {str(e)}")
+            return {"error": str(e)}
+
+    async def generate_aspect_reviews(self, paper_content: str, admit: Optional[Callable] = None,
+                                      single_pass: bool = False) -> Tuple[List[Dict[str, str]], bool]:
+        """生成评审并按方面分解，返回 (按方面分解的评审, 是否可以缓存)"""
+        if not single_pass and self._can_pipeline_classification():
+            return await self._generate_with_pipelined_classification(paper_content, admit)
+
+        async with admit() if admit else nullcontext():
+            review_result = await self.generate_review(paper_content=paper_content, single_pass=single_pass)
+
+            aspects = None
+            if "error" not in review_result and not single_pass:
+                aspects = await self._classify_aspects(review_result.get("content", ""))
+
+        return self._build_aspect_reviews(review_result, aspects, single_pass)
+
+    async def _generate_with_pipelined_classification(self, paper_content: str,
+                                                      admit: Optional[Callable] = None) -> Tuple[List[Dict[str, str]], bool]:
+        """流式生成评审，已完成的段落分批作为任务分类，分批规则与同步版本一致"""
+        batches: List[Tuple[List[str], asyncio.Task]] = []
+        pending: List[str] = []
+
+        def submit():
+            if pending:
+                batch = pending[:]
+                pending.clear()
+                batches.append((batch, asyncio.ensure_future(self._classify_batch(batch))))
+
+        async with admit() if admit else nullcontext():
+            try:
+                prompt = self._build_review_prompt(paper_content)
+                stream = self.vllm_service.generate_peer_review_stream(
+                    paper_content="",
+                    query=prompt,
+                    temperature=0.0,  # 确定性输出
+                    max_tokens=self.REVIEW_MAX_TOKENS
+                )
+                buffer = ""
+                try:
+                    async for chunk in stream:
+                        buffer += chunk
+                        *completed, buffer = _PARAGRAPH_BREAK.split(buffer)
+                        pending.extend(paragraph.strip() for paragraph in completed if paragraph.strip())
+                        if len(pending) >= self.classification_batch_paragraphs and \
+                                (not batches or batches[-1][1].done()):
+                            submit()
+                finally:
+                    await stream.aclose()
+                if buffer.strip():
+                    pending.append(buffer.strip())
+                submit()
+            except BaseException as e:
+                for _, task in batches:
+                    task.cancel()
+                if not isinstance(e, Exception):
+                    raise
+                logger.error(f"生成评审失败: {str(e)}")
+                return [{
+                    "name": "Error",
+                    "content": f"评审生成失败: {str(e)}"
+                }], False
+
+        generated_at = time.time()
+        results = await asyncio.gather(*(task for _, task in batches))
+        return self._build_pipelined_reviews(
+            [(batch, aspects) for (batch, _), aspects in zip(batches, results)], generated_at
+        )
+
+    async def _classify_batch(self, paragraphs: List[str]) -> Optional[List[str]]:
+        """一批段落合并为一次方面分类调用，同时进行的分类调用不超过classification_concurrency"""
+        if self._classification_slots is None:
+            self._classification_slots = asyncio.Semaphore(self.classification_concurrency)
+        async with self._classification_slots:
+            with self._track_classification(paragraphs):
+                return await self._classify_aspects("\n\n".join(paragraphs))
+
+    async def _generate_review_using_automatic_review(self, paper_content: str,
+                                                      single_pass: bool = False) -> Dict[str, Any]:
+        """使用Automatic_Review的原始功能生成评审"""
+        prompt = self._build_review_prompt(paper_content, single_pass)
+        review_content = await self._call_llm_for_review(prompt)
+        return {
+            "type": "automatic_review",
+            "content": review_content,
+            "source": "Automatic_Review"
+        }
+
+    async def classify_review_aspects(self, review_text: str) -> List[str]:
+        """对评审文本进行方面分类（LLM分类失败时为关键词匹配的结果）"""
+        aspects = await self._classify_aspects(review_text)
+        return aspects if aspects is not None else self._simple_aspect_classification(review_text)
+
+    async def _classify_aspects(self, review_text: str) -> Optional[List[str]]:
+        """方面分类，LLM调用或结果解析失败时返回None（没有分类模板时按设计使用关键词匹配）"""
+        try:
+            classification_prompt = self._build_classification_prompt(review_text)
+            if classification_prompt is None:
+                return self._simple_aspect_classification(review_text)
+            return self._parse_classification(await self._call_llm_for_classification(classification_prompt))
+        except Exception as e:
+            logger.error(f"方面分类失败: {str(e)}")
+            return None
+
+    async def _call_llm_for_review(self, prompt: str) -> str:
+        """调用LLM生成评审"""
+        if not self.vllm_service:
+            return "This is a placeholder review content. Please provide VllmService for actual LLM call."
+        try:
+            return await self.vllm_service.generate_peer_review(
+                paper_content="",
+                query=prompt,
+                temperature=0.0,  # 确定性输出
+                max_tokens=self.REVIEW_MAX_TOKENS
+            )
+        except Exception as e:
+            logger.error(f"调用VllmService失败: {str(e)}")
+            return f"Error generating review: {str(e)}"
+
+    async def _call_llm_for_classification(self, prompt: str) -> Optional[str]:
+        """调用LLM进行分类，调用失败时返回None"""
+        if not self.vllm_service:
+            return '{"aspects": ["Novelty", "Contribution of the research"]}'
+        try:
+            return await self.vllm_service.generate_peer_review(
+                paper_content="",
+                query=prompt,
+                temperature=0.0,
+                max_tokens=self.CLASSIFICATION_MAX_TOKENS
+            )
+        except Exception as e:
+            logger.error(f"调用VllmService进行分类失败: {str(e)}")
+            return None
@@ -0,0 +1,282 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager, nullcontext
+from typing import Dict, Any, AsyncGenerator, Callable, Optional, List
+from config.config import AppConfig, VllmConfig
+from models.vllm_models import VllmRequest, VllmResponse
+from services.vllm_service import BaseVllmService, VllmPoolTimeout, parse_stream_line, CHUNK_REVIEW_MAX_TOKENS
+
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+logger = logging.getLogger(__name__)
+
+class AsyncVllmTransport:
+    """异步vLLM HTTP传输层 - 基于aiohttp的keep-alive连接池（绑定到当前事件循环）"""
+
+    def __init__(self, base_url: str, vllm_config: VllmConfig):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = max(1, vllm_config.pool_size)
+        self.pool_timeout = None if vllm_config.pool_timeout is None else max(0.0, vllm_config.pool_timeout)
+        self.keep_alive = vllm_config.keep_alive
+        self.timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=vllm_config.connect_timeout,
+            sock_read=vllm_config.read_timeout or vllm_config.timeout
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+        # 连接名额（在事件循环内延迟创建）：连接池满时限时等待并统计等待数，aiohttp自身的等待没有单独的超时
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._total_requests = 0
+        self._waiting = 0
+        self._peak_waiting = 0
+        self._pool_timeouts = 0
+
+    def _get_session(self) -> 'aiohttp.ClientSession':
+        """在事件循环内延迟创建会话"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                force_close=not self.keep_alive
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={'Content-Type': 'application/json'}
+            )
+        return self._session
+
+    async def _checkout(self):
+        """占用一个连接名额，连接池满时最多等待pool_timeout秒（为None时一直等待）"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return
+        self._waiting += 1
+        self._peak_waiting = max(self._peak_waiting, self._waiting)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.pool_timeout)
+        except asyncio.TimeoutError:
+            self._pool_timeouts += 1
+            raise VllmPoolTimeout(self.base_url, self.pool_timeout) from None
+        finally:
+            self._waiting -= 1
+
+    @asynccontextmanager
+    async def post(self, path: str, payload: Dict[str, Any]):
+        """发送POST请求，退出上下文时释放连接；连接池满且等待超时时抛出VllmPoolTimeout"""
+        session = self._get_session()
+        await self._checkout()
+        self._in_flight += 1
+        self._total_requests += 1
+        self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        try:
+            async with session.post(f"{self.base_url}{path}", json=payload) as response:
+                try:
+                    yield response
+                except BaseException:
+                    # 提前退出（如下游断开）时直接关闭连接，不归还未读完的连接
+                    response.close()
+                    raise
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    async def close(self):
+        """关闭会话"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """连接池统计"""
+        return {
+            'base_url': self.base_url,
+            'pool_size': self.pool_size,
+            'pool_timeout': self.pool_timeout,
+            'in_flight': self._in_flight,
+            'peak_in_flight': self._peak_in_flight,
+            'checkouts_waiting': self._waiting,
+            'peak_checkouts_waiting': self._peak_waiting,
+            'pool_timeouts': self._pool_timeouts,
+            'total_requests': self._total_requests
+        }
+
+def _is_replica_failure(error: Exception) -> bool:
+    """连接失败、超时和5xx视为副本故障；4xx属于请求本身的问题"""
+    if isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return False
+
+class AsyncVllmService(BaseVllmService):
+    """异步vLLM服务 - 与VllmService行为一致，但不占用线程等待生成"""
+
+    def __init__(self, config: AppConfig):
+        if not HAS_AIOHTTP:
+            raise RuntimeError("AsyncVllmService 需要安装 aiohttp")
+        super().__init__(config)
+        self.transports = {
+            replica.url: AsyncVllmTransport(replica.url, config.vllm)
+            for replica in self.router.replicas
+        }
+
+    async def generate_peer_review(self, paper_content: str, query: str,
+                                   temperature: float = 0.0, max_tokens: int = 8192) -> str:
+        """Generate peer review"""
+        logger.info("Calling vLLM to generate peer review (async)")
+
+        try:
+            vllm_request = self._build_peer_review_request(paper_content, query, temperature, max_tokens)
+
+            response = await self._call_vllm_api(vllm_request)
+            content = response.get_content()
+
+            if not content.strip():
+                raise RuntimeError("vLLM 服务返回空结果")
+
+            logger.info(f"vLLM peer review 生成完成，输出长度: {len(content)} 字符")
+            return content
+
+        except VllmPoolTimeout:
+            raise
+        except Exception as e:
+            logger.error(f"vLLM 异步调用失败: {str(e)}")
+            raise RuntimeError(f"论文总结生成失败: {str(e)}")
+
+    async def generate_peer_review_stream(self, paper_content: str, query: str,
+                                          temperature: float = 0.0, max_tokens: int = 8192) -> AsyncGenerator[str, None]:
+        """Generate peer review with streaming output (async generator)"""
+        logger.info("Calling vLLM to generate peer review (async streaming)")
+
+        try:
+            vllm_request = self._build_peer_review_request(paper_content, query, temperature, max_tokens, stream=True)
+
+            # 下游关闭时显式关闭上游，中断vLLM生成
+            stream = self._call_vllm_stream_api(vllm_request)
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+
+            logger.info("vLLM peer review async streaming completed")
+
+        except VllmPoolTimeout:
+            raise
+        except Exception as e:
+            logger.error(f"vLLM 异步流式调用失败: {str(e)}")
+            raise RuntimeError(f"论文总结流式生成失败: {str(e)}")
+
+    async def generate_chunk_reviews(self, chunks: List[str], query: str, temperature: float = 0.0,
+                                     max_tokens: int = CHUNK_REVIEW_MAX_TOKENS,
+                                     max_workers: Optional[int] = None,
+                                     admit: Optional[Callable] = None) -> List[str]:
+        """
+        长论文分块评审的map阶段：各分块并发生成评审笔记，并发数默认为副本数
+
+        admit: 每个分块生成前获取名额的异步上下文管理器工厂（如准入控制）
+        """
+        if not chunks:
+            return []
+        semaphore = asyncio.Semaphore(max_workers or len(self.router.replicas))
+        logger.info(f"分块评审: {len(chunks)} 个分块（async）")
+
+        async def review_chunk(index: int) -> str:
+            chunk_query = self.build_chunk_review_query(query, index, len(chunks))
+            async with semaphore:
+                async with admit() if admit else nullcontext():
+                    return await self.generate_peer_review(chunks[index], chunk_query, temperature, max_tokens)
+
+        return list(await asyncio.gather(*(review_chunk(i) for i in range(len(chunks)))))
+
+    async def warmup(self):
+        """预热模型"""
+        try:
+            logger.info("正在预热vLLM模型...")
+            payload = self._build_warmup_request().to_dict()
+            for replica in self.router.replicas:
+                try:
+                    async with self.transports[replica.url].post('/v1/chat/completions', payload) as response:
+                        response.raise_for_status()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.warning(f"vLLM副本预热失败: {replica.url}, {str(e)}")
+                    if _is_replica_failure(e):
+                        # 预热失败的副本先摘除，由后台探活恢复
+                        self.router.mark_unhealthy(replica, str(e))
+            logger.info("vLLM模型预热完成")
+        except Exception as e:
+            logger.warning(f"模型预热失败，但服务仍可正常运行: {str(e)}")
+
+    async def close(self):
+        """关闭连接池"""
+        self.router.stop()
+        for transport in self.transports.values():
+            await transport.close()
+
+    def get_pool_stats(self) -> List[Dict[str, Any]]:
+        """获取各副本连接池统计"""
+        return [transport.get_stats() for transport in self.transports.values()]
+
+    async def _call_vllm_api(self, vllm_request: VllmRequest) -> VllmResponse:
+        """调用API"""
+        tokens = self._estimate_request_tokens(vllm_request)
+        attempts = len(self.router.replicas)
+
+        for attempt in range(attempts):
+            try:
+                with self.router.lease(tokens, _is_replica_failure) as replica:
+                    transport = self.transports[replica.url]
+                    async with transport.post('/v1/chat/completions', vllm_request.to_dict()) as response:
+                        response.raise_for_status()
+                        return VllmResponse.from_dict(await response.json())
+
+            except aiohttp.ClientConnectorError as e:
+                # 连接失败时请求未被副本处理，换一个副本重试
+                if attempt + 1 < attempts:
+                    logger.warning(f"vLLM副本连接失败，尝试其他副本: {str(e)}")
+                    continue
+                logger.error(f"vLLM API 调用失败: {str(e)}")
+                raise RuntimeError(f"vLLM API 调用失败: {str(e)}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"vLLM API 调用失败: {str(e)}")
+                raise RuntimeError(f"vLLM API 调用失败: {str(e)}")
+
+    async def _call_vllm_stream_api(self, vllm_request: VllmRequest) -> AsyncGenerator[str, None]:
+        """调用流式API"""
+        tokens = self._estimate_request_tokens(vllm_request)
+        generated_tokens = 0
+
+        try:
+            with self.router.lease(tokens, _is_replica_failure) as replica:
+                transport = self.transports[replica.url]
+                async with transport.post('/v1/chat/completions', vllm_request.to_dict()) as response:
+                    response.raise_for_status()
+
+                    async for line in response.content:
+                        line = line.strip()
+                        if line:
+                            done, content = parse_stream_line(line.decode('utf-8'))
+                            if done:
+                                break
+                            if content:
+                                # vLLM每个增量约对应一个token
+                                generated_tokens += 1
+                                yield content
+
+            self._record_stream(vllm_request.max_tokens, generated_tokens, cancelled=False)
+
+        except (GeneratorExit, asyncio.CancelledError):
+            # 下游已断开：退出上下文时释放响应连接，vLLM检测到断开后中止该请求
+            logger.info(f"流式请求被取消，已生成 {generated_tokens} tokens")
+            self._record_stream(vllm_request.max_tokens, generated_tokens, cancelled=True)
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"vLLM 流式API 调用失败: {str(e)}")
+            raise RuntimeError(f"vLLM 流式API 调用失败: {str(e)}")
@@ -4,11 +4,17 @@
 Automatic Review Service - 集成Automatic_Review项目的功能
 """
 
+import hashlib
 import json
 import logging
 import os
+import re
 import sys
-from typing import Dict, List, Optional, Any
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional, Any, Tuple
 from pathlib import Path
 
 # 添加Automatic_Review路径到sys.path
@@ -18,9 +24,35 @@ if automatic_review_path.exists():
 
 logger = logging.getLogger(__name__)
 
+# 单次生成模式：要求模型在每个评审段落前标注方面，省去第二次分类调用
+SINGLE_PASS_INSTRUCTION = """
+Write the review as separate paragraphs divided by blank lines. Start every paragraph with exactly one aspect tag in square brackets, chosen from the following list:
+{aspects}
+For example: "[Novelty] The proposed method ..."
+"""
+
+# 段落首部的方面标签；方括号后紧跟"("的是markdown链接，不算标签
+_ASPECT_TAG_PATTERN = re.compile(r'^\s*\[([^\]\n]{1,80})\](?!\()\s*')
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+
 class AutomaticReviewService:
     """自动评审服务 - 集成Automatic_Review项目的功能"""
     
+    REVIEW_MAX_TOKENS = 8192
+    CLASSIFICATION_MAX_TOKENS = 1024
+    
+    # 评审方面及其关键词（单次生成模式的可选标签，以及无分类模板时的简单分类）
+    ASPECT_KEYWORDS = {
+        "Novelty": ["novel", "novelty", "original", "innovative", "new"],
+        "Contribution of the research": ["contribution", "contributes", "contributed"],
+        "Algorithm Performance": ["performance", "accuracy", "efficiency", "speed"],
+        "Clarity and Presentation": ["clear", "clarity", "presentation", "writing"],
+        "Theoretical Soundness": ["theoretical", "theory", "soundness", "methodology"],
+        "Experimental Validation": ["experiment", "validation", "results", "evaluation"],
+        "Comparison to Previous Studies": ["comparison", "previous", "existing", "baseline"],
+        "Reproducibility": ["reproducibility", "reproducible", "implementation"]
+    }
+    
     def __init__(self, config, vllm_service=None):
         self.config = config
         self.vllm_service = vllm_service
@@ -28,33 +60,298 @@ class AutomaticReviewService:
         self.evaluation_path = automatic_review_path / "evaluation"
         self.generation_path = automatic_review_path / "generation"
         
+        # 两阶段评审时流式生成，已完成的段落分批在线程池中分类；
+        # 分类使用独立的并发上限，不占用评审的准入名额
+        self.pipelined_classification = config.automatic_review.pipelined_classification
+        self.classification_concurrency = max(1, config.automatic_review.classification_concurrency)
+        self.classification_batch_paragraphs = max(1, config.automatic_review.classification_batch_paragraphs)
+        self._classification_executor = ThreadPoolExecutor(
+            max_workers=self.classification_concurrency,
+            thread_name_prefix='aspect-classify'
+        )
+        self._classification_lock = threading.Lock()
+        self._classification_active = 0
+        self._classification_peak_active = 0
+        self._classification_calls = 0
+        self._classified_paragraphs = 0
+        
         # 检查Automatic_Review项目是否存在
         if not automatic_review_path.exists():
             logger.warning("Automatic_Review项目不存在，某些功能可能不可用")
     
-    def generate_review(self, paper_content: str) -> Dict[str, Any]:
+    def generate_review(self, paper_content: str, single_pass: bool = False) -> Dict[str, Any]:
         """
         生成评审 - 使用Automatic_Review的原始功能
         
         Args:
             paper_content: 论文内容
+            single_pass: 要求模型为每个段落标注方面
             
         Returns:
             包含评审结果的字典
         """
         try:
-            return self._generate_review_using_automatic_review(paper_content)
+            return self._generate_review_using_automatic_review(paper_content, single_pass)
         except Exception as e:
             logger.error(f"生成评审失败: {str(e)}")
             return {"error": str(e)}
     
-    def _generate_review_using_automatic_review(self, paper_content: str) -> Dict[str, Any]:
-        """使用Automatic_Review的原始功能生成评审"""
-        # 使用Automatic_Review的prompt模板
-        prompt_template = self._load_prompt_template("generation", "prompt_generate_review_v2.txt")
+    def generate_aspect_reviews(self, paper_content: str, admit: Optional[Callable] = None,
+                                single_pass: bool = False) -> Tuple[List[Dict[str, str]], bool]:
+        """
+        生成评审并按方面分解为前端期望的格式 [{"name": 方面, "content": 内容}]
+        
+        Args:
+            paper_content: 论文内容
+            admit: 生成前获取名额的上下文管理器工厂（如准入控制）
+            single_pass: 一次生成带方面标签的评审段落，不再单独调用方面分类
+            
+        Returns:
+            (按方面分解的评审, 是否可以缓存)
+        """
+        if not single_pass and self._can_pipeline_classification():
+            return self._generate_with_pipelined_classification(paper_content, admit)
+        
+        with admit() if admit else nullcontext():
+            # 生成评审 - 使用Automatic_Review原始功能
+            review_result = self.generate_review(paper_content=paper_content, single_pass=single_pass)
+            
+            # 如果评审成功，进行方面分类（单次生成模式下方面已在评审文本中）
+            aspects = None
+            if "error" not in review_result and not single_pass:
+                aspects = self._classify_aspects(review_result.get("content", ""))
+        
+        return self._build_aspect_reviews(review_result, aspects, single_pass)
+    
+    def _build_aspect_reviews(self, review_result: Dict[str, Any], aspects: Optional[List[str]],
+                              single_pass: bool) -> Tuple[List[Dict[str, str]], bool]:
+        """将评审结果和方面分类（分类失败时为None）组装为 (按方面分解的评审, 是否可以缓存)"""
+        if "error" in review_result:
+            # 评审失败，返回错误信息
+            return [{
+                "name": "Error",
+                "content": f"评审生成失败: {review_result.get('error', '未知错误')}"
+            }], False
         
-        # 在<paper>标签处插入论文内容
+        review_text = review_result.get("content", "")
+        cacheable = not review_text.startswith("Error generating review")
+        if single_pass:
+            return self.parse_tagged_review(review_text), cacheable
+        classified = aspects is not None
+        cacheable = cacheable and classified
+        if not classified:
+            aspects = self._simple_aspect_classification(review_text)
+        
+        # 将评审内容按方面分解，符合前端期望的格式
+        reviews = []
+        
+        # 如果有方面分类，按方面分解内容
+        if aspects and len(aspects) > 0:
+            # 简单的按方面分解策略：将评审内容按段落分割
+            paragraphs = review_text.split('\n\n')
+            
+            # 为每个方面分配内容
+            for i, aspect in enumerate(aspects):
+                if i < len(paragraphs):
+                    content = paragraphs[i].strip()
+                else:
+                    # 如果段落不够，使用剩余内容
+                    content = review_text.strip()
+                
+                reviews.append({
+                    "name": aspect,
+                    "content": content
+                })
+        else:
+            # 如果没有方面分类，将整个评审作为一个方面
+            reviews.append({
+                "name": "Overall Review",
+                "content": review_text.strip()
+            })
+        
+        # LLM调用失败时服务返回的是错误文本，分类失败时是关键词匹配的结果，都不能缓存
+        return reviews, cacheable
+    
+    def _can_pipeline_classification(self) -> bool:
+        return self.pipelined_classification and \
+            hasattr(self.vllm_service, 'generate_peer_review_stream')
+    
+    def _generate_with_pipelined_classification(self, paper_content: str,
+                                                admit: Optional[Callable] = None) -> Tuple[List[Dict[str, str]], bool]:
+        """
+        流式生成评审，已完成的段落分批提交方面分类，分类与后续段落的生成重叠进行
+        
+        生成期间同一评审最多一个分类调用：上一批完成且已完成的段落达到
+        classification_batch_paragraphs段时合并为下一批；生成结束时剩余段落立即提交。每批按两阶段评审的方式把第i个方面分配给第i段，
+        没有对应方面的段落为Overall Review；任一批分类失败（改用关键词匹配）时结果不缓存。
+        生成占用admit的名额，分类使用classification_concurrency的独立并发
+        """
+        batches: List[Tuple[List[str], Future]] = []
+        pending: List[str] = []
+        
+        def submit():
+            if pending:
+                batch = pending[:]
+                pending.clear()
+                batches.append((batch, self._classification_executor.submit(self._classify_batch, batch)))
+        
+        with admit() if admit else nullcontext():
+            try:
+                prompt = self._build_review_prompt(paper_content)
+                stream = self.vllm_service.generate_peer_review_stream(
+                    paper_content="",
+                    query=prompt,
+                    temperature=0.0,  # 确定性输出
+                    max_tokens=self.REVIEW_MAX_TOKENS
+                )
+                buffer = ""
+                try:
+                    for chunk in stream:
+                        buffer += chunk
+                        *completed, buffer = _PARAGRAPH_BREAK.split(buffer)
+                        pending.extend(paragraph.strip() for paragraph in completed if paragraph.strip())
+                        if len(pending) >= self.classification_batch_paragraphs and \
+                                (not batches or batches[-1][1].done()):
+                            submit()
+                finally:
+                    stream.close()
+                if buffer.strip():
+                    pending.append(buffer.strip())
+                submit()
+            except Exception as e:
+                logger.error(f"生成评审失败: {str(e)}")
+                for _, future in batches:
+                    future.cancel()
+                return [{
+                    "name": "Error",
+                    "content": f"评审生成失败: {str(e)}"
+                }], False
+        
+        generated_at = time.time()
+        return self._build_pipelined_reviews(
+            [(batch, future.result()) for batch, future in batches], generated_at
+        )
+    
+    def _build_pipelined_reviews(self, classified_batches: List[Tuple[List[str], Optional[List[str]]]],
+                                 generated_at: float) -> Tuple[List[Dict[str, str]], bool]:
+        """将各批段落及其方面分类（失败时为None）组装为 (按方面分解的评审, 是否可以缓存)"""
+        reviews = []
+        failed = 0
+        for batch, aspects in classified_batches:
+            if aspects is None:
+                failed += 1
+                names = [(self._simple_aspect_classification(paragraph) or ["Overall Review"])[0] for paragraph in batch]
+            else:
+                names = [aspects[i] if i < len(aspects) else "Overall Review" for i in range(len(batch))]
+            reviews.extend({"name": name, "content": paragraph} for name, paragraph in zip(names, batch))
+        logger.info(f"段落方面分类完成: {len(reviews)} 段 {len(classified_batches)} 批，"
+                    f"生成结束后等待 {time.time() - generated_at:.2f}s")
+        if failed:
+            logger.warning(f"{failed} 批段落方面分类失败，已使用关键词匹配，结果不缓存")
+        
+        if not reviews:
+            reviews.append({
+                "name": "Overall Review",
+                "content": ""
+            })
+        return reviews, not failed
+    
+    def _classify_batch(self, paragraphs: List[str]) -> Optional[List[str]]:
+        """一批段落合并为一次方面分类调用，返回方面列表（失败时为None）"""
+        with self._track_classification(paragraphs):
+            return self._classify_aspects("\n\n".join(paragraphs))
+    
+    @contextmanager
+    def _track_classification(self, paragraphs: List[str]):
+        """统计进行中的分类调用"""
+        with self._classification_lock:
+            self._classification_active += 1
+            self._classification_peak_active = max(self._classification_peak_active, self._classification_active)
+            self._classification_calls += 1
+            self._classified_paragraphs += len(paragraphs)
+        try:
+            yield
+        finally:
+            with self._classification_lock:
+                self._classification_active -= 1
+    
+    def get_classification_stats(self) -> Dict[str, Any]:
+        """流水线方面分类统计：分类调用与评审生成分开计数，vLLM同时处理的请求最多为准入上限加capacity"""
+        with self._classification_lock:
+            return {
+                'pipelined': self._can_pipeline_classification(),
+                'capacity': self.classification_concurrency,
+                'active': self._classification_active,
+                'peak_active': self._classification_peak_active,
+                'calls': self._classification_calls,
+                'paragraphs': self._classified_paragraphs
+            }
+    
+    def parse_tagged_review(self, review_text: str) -> List[Dict[str, str]]:
+        """
+        将单次生成模式的评审按段落首部的方面标签分解
+
+        只有ASPECT_KEYWORDS中的方面名（不区分大小写）算作标签，其他方括号开头的内容
+        （如"[1]"引用、"[Strengths]"、markdown链接）按普通段落处理；
+        没有标签的段落并入上一个方面，完全没有标签时整个评审作为一个方面
+        """
+        canonical = {aspect.lower(): aspect for aspect in self.ASPECT_KEYWORDS}
+        reviews = []
+        for paragraph in _PARAGRAPH_BREAK.split(review_text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            match = _ASPECT_TAG_PATTERN.match(paragraph)
+            aspect = canonical.get(match.group(1).strip().lower()) if match else None
+            if aspect:
+                reviews.append({
+                    "name": aspect,
+                    "content": paragraph[match.end():].strip()
+                })
+            elif reviews:
+                reviews[-1]["content"] += "\n\n" + paragraph
+            else:
+                # 标签之前的开头段落（如总结）单独作为一个方面
+                reviews.append({
+                    "name": "Overall Review",
+                    "content": paragraph
+                })
+        
+        if not reviews:
+            reviews.append({
+                "name": "Overall Review",
+                "content": review_text.strip()
+            })
+        return reviews
+    
+    def get_paper_budget(self, single_pass: bool = False) -> Optional[int]:
+        """论文可用的token预算（扣除评审提示词模板和预留输出），没有VllmService时返回None"""
+        if not self.vllm_service:
+            return None
+        prompt_template = self._load_prompt_template("generation", "prompt_generate_review_v2.txt") or ""
+        instruction = "\n" + self._single_pass_instruction() if single_pass else ""
+        return self.vllm_service.plan_context(
+            prompt_template + "\n</paper>" + instruction, self.REVIEW_MAX_TOKENS
+        ).paper_budget
+    
+    def _build_review_prompt(self, paper_content: str, single_pass: bool = False) -> str:
+        """在Automatic_Review模板的<paper>标签处插入论文内容，单次生成模式追加方面标注要求"""
+        prompt_template = self._load_prompt_template("generation", "prompt_generate_review_v2.txt")
         prompt = prompt_template + paper_content + "\n</paper>"
+        if single_pass:
+            prompt += "\n" + self._single_pass_instruction()
+        return prompt
+    
+    def _single_pass_instruction(self) -> str:
+        return SINGLE_PASS_INSTRUCTION.format(
+            aspects="\n".join(f"- {aspect}" for aspect in self.ASPECT_KEYWORDS)
+        )
+    
+    def _generate_review_using_automatic_review(self, paper_content: str,
+                                                single_pass: bool = False) -> Dict[str, Any]:
+        """使用Automatic_Review的原始功能生成评审"""
+        # 使用Automatic_Review的prompt模板
+        prompt = self._build_review_prompt(paper_content, single_pass)
         
         # 调用LLM生成评审
         review_content = self._call_llm_for_review(prompt)
@@ -65,6 +362,22 @@ class AutomaticReviewService:
             "source": "Automatic_Review"
         }
     
+    def get_prompt_fingerprint(self, single_pass: bool = False) -> str:
+        """生成/分类提示词模板的指纹，模板变化时缓存随之失效"""
+        templates = [
+            self._load_prompt_template("generation", "prompt_generate_review_v2.txt") or "",
+            self._single_pass_instruction() if single_pass else
+            self._load_prompt_template("evaluation", "prompt_aspect_classicification.txt") or ""
+        ]
+        digest = hashlib.sha256("\0".join(templates).encode('utf-8')).hexdigest()
+        if single_pass:
+            mode = "automatic_review_single_pass"
+        elif self._can_pipeline_classification():
+            mode = "automatic_review_pipelined"
+        else:
+            mode = "automatic_review"
+        return f"{mode}:{digest}"
+    
     def classify_review_aspects(self, review_text: str) -> List[str]:
         """
         对评审文本进行方面分类
@@ -73,51 +386,51 @@ class AutomaticReviewService:
             review_text: 评审文本
             
         Returns:
-            分类的方面列表
+            分类的方面列表（LLM分类失败时为关键词匹配的结果）
         """
+        aspects = self._classify_aspects(review_text)
+        return aspects if aspects is not None else self._simple_aspect_classification(review_text)
+    
+    def _classify_aspects(self, review_text: str) -> Optional[List[str]]:
+        """方面分类，LLM调用或结果解析失败时返回None（没有分类模板时按设计使用关键词匹配）"""
         try:
             # 加载方面分类prompt
-            aspect_prompt = self._load_prompt_template("evaluation", "prompt_aspect_classicification.txt")
+            classification_prompt = self._build_classification_prompt(review_text)
             
-            if not aspect_prompt:
+            if classification_prompt is None:
                 # 使用简化的分类逻辑
                 return self._simple_aspect_classification(review_text)
             
-            # 构建分类请求
-            classification_prompt = aspect_prompt.replace("<claim>", review_text)
-            
             # 调用LLM进行分类
-            result = self._call_llm_for_classification(classification_prompt)
-            
-            # 解析JSON结果
-            try:
-                parsed_result = json.loads(result)
-                return parsed_result.get("aspects", [])
-            except json.JSONDecodeError:
-                logger.warning("无法解析分类结果JSON，使用简单分类")
-                return self._simple_aspect_classification(review_text)
+            return self._parse_classification(self._call_llm_for_classification(classification_prompt))
                 
         except Exception as e:
             logger.error(f"方面分类失败: {str(e)}")
-            return []
+            return None
+    
+    def _build_classification_prompt(self, review_text: str) -> Optional[str]:
+        """构建分类请求，没有分类模板时返回None"""
+        aspect_prompt = self._load_prompt_template("evaluation", "prompt_aspect_classicification.txt")
+        if not aspect_prompt:
+            return None
+        return aspect_prompt.replace("<claim>", review_text)
+    
+    def _parse_classification(self, result: Optional[str]) -> Optional[List[str]]:
+        """解析JSON结果，LLM调用失败或无法解析时返回None"""
+        if result is None:
+            return None
+        try:
+            return list(json.loads(result).get("aspects", []))
+        except (json.JSONDecodeError, AttributeError, TypeError):
+            logger.warning("无法解析分类结果JSON")
+            return None
     
     def _simple_aspect_classification(self, review_text: str) -> List[str]:
         """简单的方面分类（基于关键词匹配）"""
-        aspect_keywords = {
-            "Novelty": ["novel", "novelty", "original", "innovative", "new"],
-            "Contribution of the research": ["contribution", "contributes", "contributed"],
-            "Algorithm Performance": ["performance", "accuracy", "efficiency", "speed"],
-            "Clarity and Presentation": ["clear", "clarity", "presentation", "writing"],
-            "Theoretical Soundness": ["theoretical", "theory", "soundness", "methodology"],
-            "Experimental Validation": ["experiment", "validation", "results", "evaluation"],
-            "Comparison to Previous Studies": ["comparison", "previous", "existing", "baseline"],
-            "Reproducibility": ["reproducibility", "reproducible", "implementation"]
-        }
-        
         matched_aspects = []
         review_lower = review_text.lower()
         
-        for aspect, keywords in aspect_keywords.items():
+        for aspect, keywords in self.ASPECT_KEYWORDS.items():
             if any(keyword in review_lower for keyword in keywords):
                 matched_aspects.append(aspect)
         
@@ -153,7 +466,7 @@ class AutomaticReviewService:
                     paper_content="",  
                     query=prompt,
                     temperature=0.0,  # 确定性输出
-                    max_tokens=8192 
+                    max_tokens=self.REVIEW_MAX_TOKENS
                 )
             except Exception as e:
                 logger.error(f"调用VllmService失败: {str(e)}")
@@ -162,8 +475,8 @@ class AutomaticReviewService:
             # 如果没有VllmService，返回占位符
             return "This is a placeholder review content. Please provide VllmService for actual LLM call."
     
-    def _call_llm_for_classification(self, prompt: str) -> str:
-        """调用LLM进行分类"""
+    def _call_llm_for_classification(self, prompt: str) -> Optional[str]:
+        """调用LLM进行分类，调用失败时返回None"""
         if self.vllm_service:
             try:
                 # 使用现有的VllmService进行分类
@@ -171,11 +484,11 @@ class AutomaticReviewService:
                     paper_content="",  # 这里paper_content已经在prompt中了
                     query=prompt,
                     temperature=0.0, 
-                    max_tokens=1024  
+                    max_tokens=self.CLASSIFICATION_MAX_TOKENS
                 )
             except Exception as e:
                 logger.error(f"调用VllmService进行分类失败: {str(e)}")
-                return '{"aspects": ["Novelty", "Contribution of the research"]}'
+                return None
         else:
             # 如果没有VllmService，返回默认分类
             return '{"aspects": ["Novelty", "Contribution of the research"]}'
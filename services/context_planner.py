@@ -0,0 +1,60 @@
+import logging
+import math
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional
+
+from services.tokenizer_registry import count_tokens, find_token_cut
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4  # 没有tokenizer时的估算比例
+
+@dataclass
+class ContextPlan:
+    """一次请求的上下文窗口分配（单位：token）"""
+    context_length: int
+    prompt_tokens: int  # system消息 + 模板 + query
+    output_tokens: int  # 为输出预留的max_tokens
+    safety_margin: int  # chat模板特殊token等误差余量
+    paper_budget: int  # 剩余全部分给论文
+    estimated: bool = False  # 没有tokenizer时按字符估算
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+class ContextPlanner:
+    """
+    上下文窗口规划 - 统一计算prompt各部分的token数，预留输出空间，
+    剩余预算全部交给论文，避免多处截断互不协调导致溢出或浪费窗口
+    """
+
+    def __init__(self, context_length: int, tokenizer: Optional[Any] = None, safety_margin: int = 64):
+        self.context_length = context_length
+        self.tokenizer = tokenizer
+        self.safety_margin = safety_margin
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer:
+            return count_tokens(self.tokenizer, text)
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    def plan(self, prompt_texts: List[str], max_tokens: int) -> ContextPlan:
+        """按固定prompt部分和预留输出计算论文预算"""
+        prompt_tokens = sum(self.count_tokens(text) for text in prompt_texts)
+        paper_budget = self.context_length - prompt_tokens - max_tokens - self.safety_margin
+        return ContextPlan(
+            context_length=self.context_length,
+            prompt_tokens=prompt_tokens,
+            output_tokens=max_tokens,
+            safety_margin=self.safety_margin,
+            paper_budget=paper_budget,
+            estimated=self.tokenizer is None
+        )
+
+    def fit(self, text: str, budget: int) -> str:
+        """截断到budget以内（保留原文前缀）"""
+        if budget <= 0:
+            return ""
+        if self.tokenizer:
+            return text[:find_token_cut(self.tokenizer, text, budget)]
+        return text[:budget * CHARS_PER_TOKEN]
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 参与提取的论文字段，memo键只对这些字段的内容做哈希
+PAPER_KEY_FIELDS = ('title', 'author', 'publication', 'abstract', 'body', 'reference')
+
+class ExtractedPaper:
+    """
+    一篇论文的提取结果：前置信息、正文章节、参考文献、去重时去除的段落、拼接后的全文和章节偏移，
+    以及按键缓存的派生数据（token数、按预算截断的文本等）
+
+    memo为None时不缓存派生数据（未配置memo的调用方）
+    """
+
+    def __init__(self, memo: Optional['ExtractionMemo'], key: Optional[str], parts: Dict[str, Any]):
+        self.memo = memo
+        self.key = key
+        self.front_text: str = parts['front_text']
+        self.sections: List[Dict[str, Any]] = parts['sections']
+        self.references_text: str = parts['references_text']
+        self.removed_paragraphs: List[str] = parts['removed_paragraphs']  # 段落去重时去除的段落
+        self.text: str = parts['text']
+        self.section_offsets: List[Tuple[str, int, int]] = parts['section_offsets']  # [(章节标题, 起始偏移, 结束偏移)]
+        self.size = 2 * len(self.text.encode('utf-8'))  # 全文与章节文本各一份
+        self.extract_cost = 0.0  # 提取耗时，命中时计入节省的CPU时间
+        self._derived: Dict[Hashable, Tuple[Any, float]] = {}
+        self._lock = threading.Lock()
+
+    def derive(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """返回派生数据，不存在时计算并记录耗时，命中时计入节省的CPU时间"""
+        if self.memo is None:
+            return compute()
+        with self._lock:
+            entry = self._derived.get(key)
+        if entry is not None:
+            self.memo._record_hit(entry[1])
+            return entry[0]
+
+        started = time.perf_counter()
+        value = compute()
+        cost = time.perf_counter() - started
+        with self._lock:
+            if key in self._derived:
+                return self._derived[key][0]
+            self._derived[key] = (value, cost)
+        self.memo._record_miss(self, _estimate_size(value), cost)
+        return value
+
+class ExtractionMemo:
+    """
+    论文提取结果的进程内memo - 以论文JSON内容和提取参数的哈希为键，按字节数LRU淘汰
+
+    命中时直接复用提取结果（包括段落去重），不再解析论文；token计数、按预算截断和分块等派生数据也只计算一次
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, ExtractedPaper]' = OrderedDict()
+        self._bytes = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._saved_seconds = 0.0
+        self._computed_seconds = 0.0
+
+    @staticmethod
+    def make_key(paper_json: Dict[str, Any], include_authors: bool, reference_mode: str,
+                 dedup_paragraphs: bool) -> str:
+        """论文JSON中参与提取的字段（规范化JSON）加上提取参数的哈希；不包含作者时作者字段不参与"""
+        fields = {
+            field: paper_json.get(field) for field in PAPER_KEY_FIELDS
+            if include_authors or field != 'author'
+        }
+        payload = json.dumps(
+            [include_authors, reference_mode, dedup_paragraphs, fields],
+            sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def lookup(self, key: str, extract: Callable[[], Dict[str, Any]]) -> ExtractedPaper:
+        """取出论文的提取结果，不存在时调用extract提取并登记"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                self._saved_seconds += entry.extract_cost
+                return entry
+
+        started = time.perf_counter()
+        parts = extract()
+        cost = time.perf_counter() - started
+        with self._lock:
+            self._misses += 1
+            self._computed_seconds += cost
+            entry = self._entries.get(key)
+            if entry is not None:
+                # 并发提取同一论文时保留先登记的结果
+                return entry
+            entry = ExtractedPaper(self, key, parts)
+            entry.extract_cost = cost
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._evict()
+            return entry
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'saved_seconds': round(self._saved_seconds, 4),
+                'computed_seconds': round(self._computed_seconds, 4)
+            }
+
+    def _record_hit(self, cost: float):
+        with self._lock:
+            self._hits += 1
+            self._saved_seconds += cost
+
+    def _record_miss(self, entry: ExtractedPaper, added_bytes: int, cost: float):
+        with self._lock:
+            self._misses += 1
+            self._computed_seconds += cost
+            entry.size += added_bytes
+            if self._entries.get(entry.key) is entry:
+                self._bytes += added_bytes
+                self._evict()
+
+    def _evict(self):
+        """超出容量时淘汰最久未使用的条目（调用方需持有锁）"""
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+
+def _estimate_size(value: Any) -> int:
+    """估算派生数据占用的字节数"""
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_size(item) for item in value)
+    return 8
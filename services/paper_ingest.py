@@ -0,0 +1,138 @@
+import json
+import logging
+import sys
+from functools import lru_cache
+from typing import Any, BinaryIO, Dict, Iterable, Tuple
+
+try:
+    import ijson
+    HAS_IJSON = True
+except ImportError:
+    HAS_IJSON = False
+
+logger = logging.getLogger(__name__)
+
+# paper_json中文本处理需要的字段（数组元素用item表示），其余字段（chart、quote上下文等）在解析时丢弃
+PAPER_FIELDS = (
+    'title',
+    'author.item.name',
+    'publication.date',
+    'publication.publisher.name',
+    'abstract',
+    'body.item.section.index',
+    'body.item.section.name',
+    'body.item.p.item.text',
+    'body.item.p.item.quote.item.target',
+    'reference.item.index',
+    'reference.item.title',
+    'reference.item.authors',
+    'reference.item.year',
+)
+
+# 批量请求中每一项的paper_json按同样规则裁剪
+_BATCH_ITEM_PREFIX = 'papers.item.'
+
+_KEEP_PATHS = {f'paper_json.{field}' for field in PAPER_FIELDS}
+_ANCESTOR_PATHS = {
+    '.'.join(path.split('.')[:i])
+    for path in _KEEP_PATHS
+    for i in range(1, path.count('.') + 1)
+}
+
+class _StreamReader:
+    """请求体流包装：ijson先调用read(0)探测类型，werkzeug的LimitedStream会把空读当作客户端断开"""
+
+    def __init__(self, stream: BinaryIO):
+        self._stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        return b'' if size == 0 else self._stream.read(size)
+
+def load_review_request(stream: BinaryIO) -> Dict[str, Any]:
+    """
+    从请求体解析评审请求：顶层参数原样保留，paper_json（包括批量请求papers中每一项的paper_json）
+    只保留文本处理需要的字段
+
+    安装ijson时边读边解析，不构建完整对象树；否则回退到json整体解析后再裁剪
+    """
+    if HAS_IJSON:
+        data = _build_filtered(ijson.parse(_StreamReader(stream), use_float=True))
+    else:
+        data = _filter_value(json.load(stream), '')
+    return data if isinstance(data, dict) else {}
+
+@lru_cache(maxsize=1024)
+def _is_kept(path: str) -> bool:
+    """路径是否需要保留：请求顶层参数、保留字段本身及其子树、保留字段的祖先节点"""
+    if path.startswith(_BATCH_ITEM_PREFIX):
+        path = path[len(_BATCH_ITEM_PREFIX):]
+    if path != 'paper_json' and not path.startswith('paper_json.'):
+        return True
+    if path in _ANCESTOR_PATHS or path in _KEEP_PATHS:
+        return True
+    return any(path.startswith(keep + '.') for keep in _KEEP_PATHS)
+
+def _build_filtered(events: Iterable[Tuple[str, str, Any]]) -> Any:
+    """按ijson事件流构建对象，不需要的子树直接跳过"""
+    containers = []  # [容器, 下一个map_key]
+    skip_depth = 0
+
+    for prefix, event, value in events:
+        if skip_depth:
+            if event in ('start_map', 'start_array'):
+                skip_depth += 1
+            elif event in ('end_map', 'end_array'):
+                skip_depth -= 1
+            continue
+
+        if event == 'map_key':
+            # 键名驻留，相同字段名只保留一份字符串
+            containers[-1][1] = sys.intern(value)
+            continue
+
+        if event in ('end_map', 'end_array'):
+            node = containers.pop()[0]
+            if not containers:
+                return node
+            continue
+
+        if containers and not _is_kept(prefix):
+            if event in ('start_map', 'start_array'):
+                skip_depth = 1
+            continue
+
+        if event == 'start_map':
+            node = {}
+        elif event == 'start_array':
+            node = []
+        else:
+            node = value
+
+        if containers:
+            parent, key = containers[-1]
+            if isinstance(parent, list):
+                parent.append(node)
+            else:
+                parent[key] = node
+
+        if event in ('start_map', 'start_array'):
+            containers.append([node, None])
+        elif not containers:
+            return node
+
+    return None
+
+def _filter_value(value: Any, path: str) -> Any:
+    """对已解析的对象做同样的字段裁剪（没有ijson时使用）"""
+    if isinstance(value, dict):
+        return {
+            key: _filter_value(item, f'{path}.{key}' if path else key)
+            for key, item in value.items()
+            if _is_kept(f'{path}.{key}' if path else key)
+        }
+    if isinstance(value, list):
+        item_path = f'{path}.item'
+        if not _is_kept(item_path):
+            return []
+        return [_filter_value(item, item_path) for item in value]
+    return value
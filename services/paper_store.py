@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class PaperNotFound(Exception):
+    """paper_id未注册或已被淘汰，调用方应返回404"""
+
+class StoredPaper:
+    """已注册的论文（提取结果和派生数据由ExtractionMemo按内容复用，不在这里另存一份）"""
+
+    def __init__(self, paper_id: str, paper_json: Dict[str, Any], size: int):
+        self.paper_id = paper_id
+        self.paper_json = paper_json
+        self.size = size
+        self.created_at = time.time()
+
+class PaperStore:
+    """
+    论文注册表 - 论文上传一次，以内容哈希作为paper_id，各评审接口直接引用
+
+    进程内LRU，按论文JSON字节数淘汰，支持TTL；提取文本、截断文本和分块等派生数据计入extraction_memo的字节上限
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._papers: 'OrderedDict[str, StoredPaper]' = OrderedDict()
+        self._bytes = 0
+
+        self._registered = 0
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def make_paper_id(paper_json: Dict[str, Any]) -> Tuple[str, int]:
+        """计算paper_id（规范化JSON的sha256），同时返回JSON字节数"""
+        data = json.dumps(paper_json, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        return hashlib.sha256(data).hexdigest(), len(data)
+
+    def register(self, paper_json: Dict[str, Any]) -> Tuple[StoredPaper, bool]:
+        """注册论文，返回 (论文, 是否新注册)；相同内容重复注册返回已有条目"""
+        paper_id, size = self.make_paper_id(paper_json)
+        with self._lock:
+            stored = self._get_live(paper_id, time.time())
+            if stored is not None:
+                self._papers.move_to_end(paper_id)
+                return stored, False
+
+            stored = StoredPaper(paper_id, paper_json, size)
+            self._papers[paper_id] = stored
+            self._bytes += size
+            self._registered += 1
+            while self._bytes > self.max_bytes and len(self._papers) > 1:
+                oldest_id = next(iter(self._papers))
+                self._remove(oldest_id)
+                logger.info(f"论文注册表已满，淘汰: {oldest_id[:16]}")
+            return stored, True
+
+    def get(self, paper_id: str) -> StoredPaper:
+        """按paper_id获取论文，不存在或已过期时抛出PaperNotFound"""
+        with self._lock:
+            stored = self._get_live(paper_id, time.time())
+            if stored is None:
+                self._misses += 1
+                raise PaperNotFound(f"paper_id不存在或已过期，请重新注册: {paper_id}")
+            self._papers.move_to_end(paper_id)
+            self._hits += 1
+            return stored
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'papers': len(self._papers),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'registered': self._registered,
+                'hits': self._hits,
+                'misses': self._misses
+            }
+
+    def _get_live(self, paper_id: str, now: float) -> Optional[StoredPaper]:
+        """取出未过期的条目（调用方需持有锁）"""
+        stored = self._papers.get(paper_id)
+        if stored is not None and now - stored.created_at > self.ttl_seconds:
+            self._remove(paper_id)
+            return None
+        return stored
+
+    def _remove(self, paper_id: str):
+        stored = self._papers.pop(paper_id, None)
+        if stored is not None:
+            self._bytes -= stored.size
@@ -0,0 +1,88 @@
+import hashlib
+import re
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+_WORD_PATTERN = re.compile(r'\w+')
+
+# _BIT_TABLES[i]把字节映射为其第i位（0或1），配合bytes.translate按位计数
+_BIT_TABLES = [bytes((value >> i) & 1 for value in range(256)) for i in range(8)]
+
+class ParagraphDeduplicator:
+    """
+    段落去重 - 按出现顺序登记段落，完全重复或近似重复（SimHash汉明距离很小）的段落判为重复
+
+    SimHash按64位分为8段建LSH索引，只与至少一段完全相同的段落比较，整体接近线性；
+    shingle哈希用blake2b，同一论文在不同进程中的去重结果一致
+    """
+
+    BANDS = 8
+    BAND_BITS = 8
+
+    def __init__(self, max_distance: int = 7, min_words: int = 8, min_chars: int = 16,
+                 shingle_size: int = 3):
+        """
+        Args:
+            max_distance: 判为近似重复的最大汉明距离（不超过BANDS - 1时LSH不会漏检）
+            min_words: 少于该词数的段落只做完全重复判断
+            min_chars: 短于该字符数的段落不参与去重
+            shingle_size: 词级shingle长度
+        """
+        self.max_distance = max_distance
+        self.min_words = min_words
+        self.min_chars = min_chars
+        self.shingle_size = shingle_size
+
+        self._exact: Set[int] = set()
+        self._fingerprints: List[int] = []
+        self._bands: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+
+    def is_duplicate(self, paragraph: str) -> bool:
+        """判断段落是否与已登记段落重复；不重复时登记该段落"""
+        words = _WORD_PATTERN.findall(paragraph.lower())
+        normalized = ' '.join(words)
+        if len(normalized) < self.min_chars:
+            return False
+
+        exact_key = hash(normalized)
+        if exact_key in self._exact:
+            return True
+
+        if len(words) < self.min_words:
+            self._exact.add(exact_key)
+            return False
+
+        fingerprint = self._simhash(words)
+        band_keys = self._band_keys(fingerprint)
+        candidates = {index for key in band_keys for index in self._bands.get(key, ())}
+        for index in candidates:
+            if bin(self._fingerprints[index] ^ fingerprint).count('1') <= self.max_distance:
+                return True
+
+        self._exact.add(exact_key)
+        index = len(self._fingerprints)
+        self._fingerprints.append(fingerprint)
+        for key in band_keys:
+            self._bands[key].append(index)
+        return False
+
+    def _simhash(self, words: List[str]) -> int:
+        """64位SimHash：各位取所有shingle哈希在该位上的多数值"""
+        size = self.shingle_size
+        shingles = [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+        digests = b''.join([
+            hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in shingles
+        ])
+
+        # 按字节位置取出一列（每个shingle一个字节），再用translate统计该列每一位为1的个数
+        fingerprint = 0
+        for k in range(8):
+            column = digests[k::8]
+            for i, bit_table in enumerate(_BIT_TABLES):
+                if column.translate(bit_table).count(1) * 2 > len(shingles):
+                    fingerprint |= 1 << (8 * k + i)
+        return fingerprint
+
+    def _band_keys(self, fingerprint: int) -> List[Tuple[int, int]]:
+        mask = (1 << self.BAND_BITS) - 1
+        return [(band, (fingerprint >> (band * self.BAND_BITS)) & mask) for band in range(self.BANDS)]
@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+import requests
+
+logger = logging.getLogger(__name__)
+
+class VllmReplica:
+    """单个vLLM副本及其负载计数"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.healthy = True
+        self.in_flight = 0
+        self.in_flight_tokens = 0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.total_tokens = 0
+        self.last_error: Optional[str] = None
+        self.last_failure_time: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'in_flight': self.in_flight,
+            'in_flight_tokens': self.in_flight_tokens,
+            'total_requests': self.total_requests,
+            'total_failures': self.total_failures,
+            'total_tokens': self.total_tokens,
+            'last_error': self.last_error,
+            'last_failure_time': self.last_failure_time
+        }
+
+class ReplicaRouter:
+    """vLLM多副本路由 - 最少在途请求/最少在途token负载均衡，失败副本后台探活后恢复"""
+
+    STRATEGIES = ('least_requests', 'least_tokens')
+
+    def __init__(self, urls: List[str], strategy: str = 'least_requests',
+                 health_check_interval: float = 10.0, health_check_timeout: float = 5.0):
+        if not urls:
+            raise ValueError("至少需要配置一个vLLM副本地址")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"不支持的路由策略: {strategy}")
+
+        self.replicas = [VllmReplica(url) for url in urls]
+        self.strategy = strategy
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._probe_thread: Optional[threading.Thread] = None
+
+    def acquire(self, tokens: int = 0) -> VllmReplica:
+        """选择负载最低的健康副本并登记在途请求"""
+        with self._lock:
+            candidates = [r for r in self.replicas if r.healthy]
+            if not candidates:
+                # 全部不可用时仍尝试负载最低的副本，避免单副本部署直接拒绝服务
+                candidates = self.replicas
+
+            if self.strategy == 'least_tokens':
+                replica = min(candidates, key=lambda r: (r.in_flight_tokens, r.in_flight))
+            else:
+                replica = min(candidates, key=lambda r: (r.in_flight, r.in_flight_tokens))
+
+            replica.in_flight += 1
+            replica.in_flight_tokens += tokens
+            replica.total_requests += 1
+            replica.total_tokens += tokens
+            return replica
+
+    def release(self, replica: VllmReplica, tokens: int = 0, failed: bool = False, error: Optional[str] = None):
+        """释放在途请求，失败时将副本摘除"""
+        with self._lock:
+            replica.in_flight -= 1
+            replica.in_flight_tokens -= tokens
+            if failed:
+                replica.total_failures += 1
+                replica.last_error = error
+                replica.last_failure_time = time.time()
+                if replica.healthy:
+                    replica.healthy = False
+                    logger.warning(f"vLLM副本不可用，已摘除: {replica.url}, 原因: {error}")
+
+        if failed:
+            self._ensure_probe_thread()
+
+    @contextmanager
+    def lease(self, tokens: int = 0, is_failure=None):
+        """在上下文中占用一个副本；is_failure(e) 判断异常是否应摘除副本"""
+        replica = self.acquire(tokens)
+        failed = False
+        error = None
+        try:
+            yield replica
+        except Exception as e:
+            failed = is_failure(e) if is_failure else True
+            error = str(e)
+            raise
+        finally:
+            self.release(replica, tokens, failed=failed, error=error)
+
+    def mark_unhealthy(self, replica: VllmReplica, error: str):
+        """直接标记副本不可用（如预热失败）"""
+        with self._lock:
+            replica.healthy = False
+            replica.last_error = error
+            replica.last_failure_time = time.time()
+        self._ensure_probe_thread()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """各副本负载统计"""
+        with self._lock:
+            replicas = [r.to_dict() for r in self.replicas]
+
+        return {
+            'strategy': self.strategy,
+            'healthy_replicas': sum(1 for r in replicas if r['healthy']),
+            'total_replicas': len(replicas),
+            'replicas': replicas
+        }
+
+    def stop(self):
+        """停止后台探活"""
+        self._stop_event.set()
+
+    def _ensure_probe_thread(self):
+        """按需启动后台探活线程"""
+        with self._lock:
+            if self._probe_thread is not None and self._probe_thread.is_alive():
+                return
+            self._probe_thread = threading.Thread(
+                target=self._probe_loop, name='vllm-replica-probe', daemon=True
+            )
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        """定期探测不可用副本，恢复后重新加入路由；全部恢复后线程退出"""
+        while not self._stop_event.wait(self.health_check_interval):
+            with self._lock:
+                unhealthy = [r for r in self.replicas if not r.healthy]
+                if not unhealthy:
+                    self._probe_thread = None
+                    return
+
+            for replica in unhealthy:
+                if self._probe(replica):
+                    with self._lock:
+                        replica.healthy = True
+                    logger.info(f"vLLM副本已恢复: {replica.url}")
+
+    def _probe(self, replica: VllmReplica) -> bool:
+        """探测副本健康状态"""
+        try:
+            response = requests.get(f"{replica.url}/health", timeout=self.health_check_timeout)
+            return response.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
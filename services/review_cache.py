@@ -0,0 +1,209 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class ReviewCache:
+    """
+    评审结果缓存 - 以论文文本、prompt、模型名和采样参数的哈希为键
+
+    两级存储：进程内LRU（按字节数淘汰）+ 磁盘目录（按字节数淘汰最久未访问项），均支持TTL
+    """
+
+    def __init__(self, cache_dir: Optional[str], memory_max_bytes: int, disk_max_bytes: int,
+                 ttl_seconds: float):
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._memory: 'OrderedDict[str, Tuple[float, Any, int]]' = OrderedDict()
+        self._memory_bytes = 0
+
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self._disk_index: Dict[str, Tuple[float, int]] = {}  # key -> (最近访问时间, 字节数)
+        self._disk_bytes = 0
+        if self.cache_dir is not None:
+            self._load_disk_index()
+
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def make_key(paper_text: str, prompt: str, model_name: str, **params) -> str:
+        """计算缓存键：空白归一化后的论文文本 + prompt + 模型名 + 采样参数"""
+        normalized_text = re.sub(r'\s+', ' ', paper_text).strip()
+        payload = json.dumps({
+            'paper': normalized_text,
+            'prompt': prompt,
+            'model': model_name,
+            'params': params
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """查询缓存，先内存后磁盘；磁盘命中时回填内存"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value, _ = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._memory_hits += 1
+                    return value
+                self._remove_memory(key)
+
+        disk_entry = self._read_disk(key, now)
+        with self._lock:
+            if disk_entry is None:
+                self._misses += 1
+                return None
+            self._disk_hits += 1
+            created_at, value = disk_entry
+            self._put_memory(key, created_at, value)
+            return value
+
+    def put(self, key: str, value: Any):
+        """写入缓存（value需可JSON序列化）"""
+        created_at = time.time()
+        with self._lock:
+            self._put_memory(key, created_at, value)
+        self._write_disk(key, created_at, value)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self._memory_hits + self._disk_hits
+            lookups = hits + self._misses
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'memory_max_bytes': self.memory_max_bytes,
+                'disk_entries': len(self._disk_index),
+                'disk_bytes': self._disk_bytes,
+                'disk_max_bytes': self.disk_max_bytes,
+                'memory_hits': self._memory_hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _put_memory(self, key: str, created_at: float, value: Any):
+        """写入内存LRU并按字节数淘汰（调用方需持有锁）"""
+        size = len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+        if size > self.memory_max_bytes:
+            return
+        self._remove_memory(key)
+        self._memory[key] = (created_at, value, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_max_bytes:
+            oldest_key = next(iter(self._memory))
+            self._remove_memory(oldest_key)
+
+    def _remove_memory(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry[2]
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _load_disk_index(self):
+        """启动时扫描磁盘缓存目录"""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            for path in self.cache_dir.glob('*.json'):
+                stat = path.stat()
+                self._disk_index[path.stem] = (stat.st_mtime, stat.st_size)
+                self._disk_bytes += stat.st_size
+            logger.info(f"评审缓存目录: {self.cache_dir}, 已有 {len(self._disk_index)} 条")
+        except OSError as e:
+            logger.warning(f"无法初始化评审缓存目录，磁盘缓存已禁用: {str(e)}")
+            self.cache_dir = None
+
+    def _read_disk(self, key: str, now: float) -> Optional[Tuple[float, Any]]:
+        if self.cache_dir is None:
+            return None
+        with self._lock:
+            if key not in self._disk_index:
+                return None
+
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"读取评审缓存失败: {path}, {str(e)}")
+            self._remove_disk(key)
+            return None
+
+        if now - entry['created_at'] > self.ttl_seconds:
+            self._remove_disk(key)
+            return None
+
+        # 更新访问时间，供淘汰使用
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            if key in self._disk_index:
+                self._disk_index[key] = (now, self._disk_index[key][1])
+        return entry['created_at'], entry['value']
+
+    def _write_disk(self, key: str, created_at: float, value: Any):
+        if self.cache_dir is None:
+            return
+        data = json.dumps({'created_at': created_at, 'value': value}, ensure_ascii=False).encode('utf-8')
+        if len(data) > self.disk_max_bytes:
+            return
+
+        path = self._disk_path(key)
+        tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入评审缓存失败: {path}, {str(e)}")
+            return
+
+        evicted = []
+        with self._lock:
+            previous = self._disk_index.pop(key, None)
+            if previous is not None:
+                self._disk_bytes -= previous[1]
+            self._disk_index[key] = (created_at, len(data))
+            self._disk_bytes += len(data)
+
+            # 超出容量时淘汰最久未访问的条目
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk_index) > 1:
+                oldest_key = min(self._disk_index, key=lambda k: self._disk_index[k][0])
+                _, size = self._disk_index.pop(oldest_key)
+                self._disk_bytes -= size
+                evicted.append(oldest_key)
+
+        for evicted_key in evicted:
+            try:
+                self._disk_path(evicted_key).unlink()
+            except OSError:
+                pass
+
+    def _remove_disk(self, key: str):
+        with self._lock:
+            entry = self._disk_index.pop(key, None)
+            if entry is not None:
+                self._disk_bytes -= entry[1]
+        try:
+            self._disk_path(key).unlink()
+        except OSError:
+            pass
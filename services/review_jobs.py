@@ -0,0 +1,203 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from services.admission_controller import AdmissionRejected
+from services.single_flight import StreamBroadcast
+
+logger = logging.getLogger(__name__)
+
+class JobNotFound(Exception):
+    """job_id不存在或结果已过保留期，调用方应返回404"""
+
+class JobCancelled(Exception):
+    """任务被客户端取消"""
+
+class ReviewJob:
+    """一次异步评审任务：状态、结果，以及供SSE订阅的token流"""
+
+    def __init__(self, job_id: str, key: Optional[str], context: Dict[str, Any],
+                 stats: Dict[str, Any]):
+        self.job_id = job_id
+        self.key = key
+        self.context = context  # 订阅token流时需要的请求参数
+        self.status = 'queued'  # queued / running / succeeded / failed / cancelled
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.stats = stats
+        self.broadcast = StreamBroadcast()
+        self.cancel_requested = False
+        self.submissions = 1
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('succeeded', 'failed', 'cancelled')
+
+    def to_dict(self, include_result: bool = True) -> Dict[str, Any]:
+        data = {
+            'job_id': self.job_id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+            'stats': self.stats
+        }
+        if include_result:
+            data['result'] = self.result
+        return data
+
+class ReviewJobManager:
+    """
+    异步评审任务 - 提交后立即返回job_id，由有界线程池在后台执行，客户端轮询状态或订阅token流
+
+    相同key的任务未结束时重复提交返回同一任务；已结束任务的结果保留retention_seconds后清理
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, retention_seconds: float):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(0, max_pending)
+        self.retention_seconds = retention_seconds
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='review-job')
+        self._lock = threading.Lock()
+        self._jobs: 'OrderedDict[str, ReviewJob]' = OrderedDict()
+        self._active_keys: Dict[str, ReviewJob] = {}
+        self._queued = 0
+        self._running = 0
+
+        self._submitted = 0
+        self._deduplicated = 0
+        self._rejected = 0
+        self._completed = {'succeeded': 0, 'failed': 0, 'cancelled': 0}
+        self._avg_run_time = 60.0  # 任务耗时的滑动平均，用于估算Retry-After
+
+    def submit(self, run: Callable[[ReviewJob], Any], key: Optional[str] = None,
+               context: Optional[Dict[str, Any]] = None,
+               stats: Optional[Dict[str, Any]] = None) -> ReviewJob:
+        """
+        提交任务，返回任务对象；排队任务已满时抛出AdmissionRejected
+
+        Args:
+            run: 任务函数，接收任务对象，通过job.broadcast发布增量，返回最终结果
+            key: 请求内容哈希，相同key的未结束任务只执行一次
+            context: 随任务保存的请求参数（订阅token流时使用）
+            stats: 任务的初始统计，执行过程中可继续补充
+        """
+        with self._lock:
+            self._purge_expired(time.time())
+
+            if key is not None and key in self._active_keys:
+                job = self._active_keys[key]
+                job.submissions += 1
+                self._deduplicated += 1
+                return job
+
+            if self._queued >= self.max_pending:
+                self._rejected += 1
+                rounds = (self._queued + 1) / self.max_workers
+                raise AdmissionRejected(
+                    f"评审任务排队已达上限 ({self.max_pending})",
+                    max(1, int(rounds * self._avg_run_time))
+                )
+
+            job = ReviewJob(uuid.uuid4().hex, key, context or {}, dict(stats or {}))
+            self._jobs[job.job_id] = job
+            if key is not None:
+                self._active_keys[key] = job
+            self._queued += 1
+            self._submitted += 1
+
+        self._executor.submit(self._run, job, run)
+        logger.info(f"评审任务已提交: {job.job_id}")
+        return job
+
+    def get(self, job_id: str) -> ReviewJob:
+        """按job_id获取任务，不存在或已过保留期时抛出JobNotFound"""
+        with self._lock:
+            self._purge_expired(time.time())
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise JobNotFound(f"job_id不存在或结果已过期: {job_id}")
+            return job
+
+    def cancel(self, job_id: str) -> ReviewJob:
+        """取消任务：排队中的任务不再执行，运行中的任务在下一个增量处停止"""
+        job = self.get(job_id)
+        with self._lock:
+            if not job.finished:
+                job.cancel_requested = True
+        return job
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._purge_expired(time.time())
+            return {
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'retention_seconds': self.retention_seconds,
+                'queued': self._queued,
+                'running': self._running,
+                'retained': len(self._jobs),
+                'submitted': self._submitted,
+                'deduplicated': self._deduplicated,
+                'rejected': self._rejected,
+                **self._completed,
+                'avg_run_time': round(self._avg_run_time, 2)
+            }
+
+    def _run(self, job: ReviewJob, run: Callable[[ReviewJob], Any]):
+        with self._lock:
+            self._queued -= 1
+            if job.cancel_requested:
+                self._finish(job, 'cancelled', error="任务已取消")
+                return
+            self._running += 1
+            job.status = 'running'
+            job.started_at = time.time()
+
+        try:
+            result = run(job)
+        except JobCancelled:
+            logger.info(f"评审任务已取消: {job.job_id}")
+            with self._lock:
+                self._running -= 1
+                self._finish(job, 'cancelled', error="任务已取消")
+        except Exception as e:
+            logger.error(f"评审任务失败: {job.job_id}, {str(e)}")
+            with self._lock:
+                self._running -= 1
+                self._finish(job, 'failed', error=str(e))
+        else:
+            with self._lock:
+                self._running -= 1
+                job.result = result
+                self._avg_run_time = 0.8 * self._avg_run_time + 0.2 * (time.time() - job.started_at)
+                self._finish(job, 'succeeded')
+            logger.info(f"评审任务完成: {job.job_id}")
+
+    def _finish(self, job: ReviewJob, status: str, error: Optional[str] = None):
+        """结束任务并唤醒订阅者（调用方需持有锁）"""
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        self._completed[status] += 1
+        if job.key is not None and self._active_keys.get(job.key) is job:
+            del self._active_keys[job.key]
+        job.broadcast.finish(RuntimeError(error) if error else None)
+
+    def _purge_expired(self, now: float):
+        """清理超过保留期的已结束任务（调用方需持有锁）"""
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and now - job.finished_at > self.retention_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
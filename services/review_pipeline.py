@@ -0,0 +1,156 @@
+import logging
+from typing import Any, Dict, Optional
+
+from config.config import AppConfig
+from models.paper_models import PaperRequest
+from services.extraction_memo import ExtractionMemo
+from services.paper_store import PaperStore
+from services.review_cache import ReviewCache
+from services.text_processor_service import TextProcessorService
+from services.vllm_service import BaseVllmService, CHUNK_REVIEW_MAX_TOKENS, PEER_REVIEW_QUERY
+
+logger = logging.getLogger(__name__)
+
+class ReviewPipeline:
+    """
+    评审请求的输入准备 - 论文解析、上下文规划、按预算截断或分块、请求哈希
+
+    与服务框架无关，Flask（WSGI）和ASGI两种服务方式共用；vllm_service可以是同步或异步实现，
+    这里只用到上下文规划和提示词构建
+    """
+
+    def __init__(self, config: AppConfig, vllm_service: BaseVllmService, extraction_memo: ExtractionMemo,
+                 paper_store: PaperStore, review_cache: Optional[ReviewCache]):
+        self.config = config
+        self.vllm_service = vllm_service
+        self.extraction_memo = extraction_memo
+        self.paper_store = paper_store
+        self.review_cache = review_cache
+
+    def review_request_key(self, paper_text: str, prompt: str, temperature: float, max_tokens: int,
+                           review_type: str) -> str:
+        """评审请求的内容哈希，用于缓存和相同请求合并"""
+        return ReviewCache.make_key(
+            paper_text, prompt, self.config.vllm.model_name,
+            temperature=temperature, max_tokens=max_tokens, review_type=review_type
+        )
+
+    def is_cacheable(self, temperature: float) -> bool:
+        """仅确定性请求（temperature=0）可缓存"""
+        return self.review_cache is not None and temperature == 0.0
+
+    def resolve_paper(self, paper_request: PaperRequest):
+        """
+        按paper_id取出已注册的论文并填入paper_request
+
+        已注册论文的提取结果和派生数据（截断文本、分块、token数等）由extraction_memo按内容复用
+        """
+        if paper_request.paper_id:
+            paper_request.paper_json = self.paper_store.get(paper_request.paper_id).paper_json
+
+    def register_paper(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        注册论文并预先提取全文、统计token数（后续评审请求直接复用），返回paper_id和论文统计
+
+        提取参数（如reference_mode）无效时抛出ValueError，论文不会被注册
+        """
+        paper_request = PaperRequest.from_dict(data)
+        text_processor = self.create_text_processor(paper_request)
+        stored, created = self.paper_store.register(paper_request.paper_json)
+        paper_stats = text_processor.get_paper_stats(stored.paper_json)
+        logger.info(f"论文注册完成: {stored.paper_id[:16]}, 新注册: {created}")
+        return {
+            'paper_id': stored.paper_id,
+            'created': created,
+            'text_length': paper_stats['text_length'],
+            'token_count': paper_stats['token_count'],
+            'sections': paper_stats['sections']
+        }
+
+    def create_text_processor(self, paper_request: PaperRequest) -> TextProcessorService:
+        """根据请求参数创建文本处理器"""
+        return TextProcessorService(
+            include_authors=paper_request.include_authors,
+            tokenizer_path=self.config.tokenizer_path,
+            extraction_memo=self.extraction_memo,
+            reference_mode=paper_request.reference_mode,
+            dedup_paragraphs=paper_request.dedup_paragraphs
+        )
+
+    def prepare_peer_review(self, paper_request: PaperRequest) -> Dict[str, Any]:
+        """同行评审的输入准备：取出已注册论文、提取论文文本、上下文规划、按预算截断或分块，并计算请求哈希"""
+        self.resolve_paper(paper_request)
+        text_processor = self.create_text_processor(paper_request)
+
+        # 获取完整论文内容（不截断）用于分块判断
+        full_paper_content = text_processor.process_paper_json(paper_request.paper_json, auto_truncate=False)
+        original_length = len(full_paper_content)
+
+        reference_stats = text_processor.get_reference_stats(paper_request.paper_json)
+        dedup_stats = text_processor.get_dedup_stats(paper_request.paper_json)
+
+        logger.info(f"使用JSON格式论文数据，包含作者信息: {paper_request.include_authors}")
+        logger.info(f"完整文本长度: {original_length:,} 字符")
+
+        # 同行评审prompt
+        review_query = PEER_REVIEW_QUERY
+
+        # 上下文规划：扣除system消息、模板、query和预留输出后，剩余token全部分给论文
+        context_plan = self.vllm_service.plan_context(review_query, paper_request.max_tokens)
+        if context_plan.paper_budget <= 0:
+            raise ValueError(
+                f"max_tokens ({paper_request.max_tokens}) 过大，超出上下文窗口 ({context_plan.context_length} tokens)"
+            )
+
+        # 按章节分配token预算，截断文本以符合长度限制
+        truncated_content = text_processor.process_paper_json(
+            paper_request.paper_json, max_tokens=context_plan.paper_budget
+        )
+
+        # 分块评审：论文超出上下文窗口且客户端请求分块时，按章节分块并发评审再合并
+        review_chunks = None
+        if paper_request.use_chunking and len(truncated_content) < original_length:
+            chunk_plan = self.vllm_service.plan_context(
+                self.vllm_service.build_chunk_review_query(review_query, 0, 1), CHUNK_REVIEW_MAX_TOKENS
+            )
+            front_text, chunks = text_processor.build_review_chunks(
+                paper_request.paper_json, max_tokens=chunk_plan.paper_budget
+            )
+            if len(chunks) > 1:
+                review_chunks = (front_text, chunks)
+        chunk_count = len(review_chunks[1]) if review_chunks else 0
+
+        request_key = self.review_request_key(
+            truncated_content, review_query,
+            paper_request.temperature, paper_request.max_tokens,
+            'peer_review_chunked' if review_chunks else 'peer_review'
+        )
+        cache_key = request_key if self.is_cacheable(paper_request.temperature) else None
+
+        return {
+            'original_length': original_length,
+            'reference_stats': reference_stats,
+            'dedup_stats': dedup_stats,
+            'review_query': review_query,
+            'context_plan': context_plan,
+            'truncated_content': truncated_content,
+            'review_chunks': review_chunks,
+            'chunk_count': chunk_count,
+            'request_key': request_key,
+            'cache_key': cache_key
+        }
+
+    @staticmethod
+    def peer_review_stats(prepared: Dict[str, Any]) -> Dict[str, Any]:
+        """同行评审响应中与输入准备相关的统计"""
+        context_plan = prepared['context_plan']
+        return {
+            'input_length': prepared['original_length'],
+            'max_tokens_limit': context_plan.paper_budget,
+            'review_type': 'peer_review',
+            'context_plan': context_plan.to_dict(),
+            'used_chunking': prepared['chunk_count'] > 0,
+            'chunk_count': prepared['chunk_count'],
+            'reference_stats': prepared['reference_stats'],
+            'dedup_stats': prepared['dedup_stats']
+        }
@@ -0,0 +1,214 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Generator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class StreamBroadcast:
+    """单路上游流的多订阅者广播 - 缓存全部增量，后加入的订阅者先回放已有内容再继续接收"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._chunks = []
+        self._done = False
+        self._error: Optional[Exception] = None
+        self._subscribers = 0
+        self._ever_subscribed = False
+
+    @property
+    def cancelled(self) -> bool:
+        """所有订阅者都已离开（上游可以停止生成）"""
+        with self._cond:
+            return self._ever_subscribed and self._subscribers == 0 and not self._done
+
+    def publish(self, chunk: str):
+        with self._cond:
+            self._chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error: Optional[Exception] = None):
+        with self._cond:
+            self._done = True
+            self._error = error
+            self._cond.notify_all()
+
+    def get_text(self) -> str:
+        with self._cond:
+            return ''.join(self._chunks)
+
+    def subscribe(self) -> 'Subscription':
+        """
+        订阅增量；上游出错时向订阅者抛出同一异常
+
+        调用时即计入订阅者，之后关闭订阅（包括尚未开始迭代就关闭）视为离开，
+        客户端在收到首个事件前断开时上游同样可以取消
+        """
+        with self._cond:
+            self._subscribers += 1
+            self._ever_subscribed = True
+        return Subscription(self)
+
+    def _unsubscribe(self, subscription: 'Subscription'):
+        """退订并唤醒该订阅者等待中的迭代"""
+        with self._cond:
+            if subscription.closed:
+                return
+            subscription.closed = True
+            self._subscribers -= 1
+            self._cond.notify_all()
+
+    def _iterate(self, subscription: 'Subscription') -> Generator[str, None, None]:
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self._chunks) and not self._done and not subscription.closed:
+                    self._cond.wait()
+                if subscription.closed:
+                    return
+                batch = self._chunks[index:]
+                index = len(self._chunks)
+                done = self._done
+                error = self._error
+
+            for chunk in batch:
+                yield chunk
+            if done and not batch:
+                if error is not None:
+                    raise error
+                return
+
+class Subscription:
+    """
+    一个订阅者的增量迭代器；迭代结束、出错或close时退订
+
+    close可重复调用，也可以在其他线程正在迭代时调用（如合并输出的后台读取线程），等待中的迭代随之结束
+    """
+
+    def __init__(self, broadcast: StreamBroadcast):
+        self.closed = False
+        self._broadcast = broadcast
+        self._iterator = broadcast._iterate(self)
+
+    def __iter__(self) -> 'Subscription':
+        return self
+
+    def __next__(self) -> str:
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        self._broadcast._unsubscribe(self)
+
+class Flight:
+    """一次正在进行（或在幂等窗口内保留）的生成"""
+
+    def __init__(self, key: str, stream: bool = False):
+        self.key = key
+        self.created_at = time.time()
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[Exception] = None
+        self.broadcast = StreamBroadcast() if stream else None
+        self.followers = 0
+
+class SingleFlight:
+    """
+    相同请求合并执行：同一内容哈希的并发请求只生成一次，后到者共享结果；
+    客户端携带幂等键时，窗口期内相同幂等键直接复用已完成（或进行中）的结果
+    """
+
+    def __init__(self, idempotency_window: float = 600.0):
+        self.idempotency_window = idempotency_window
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Flight] = {}
+        self._idempotent: Dict[str, Tuple[float, Flight]] = {}
+
+        self._leaders = 0
+        self._followers = 0
+        self._idempotent_hits = 0
+
+    def join(self, key: str, idempotency_key: Optional[str] = None,
+             stream: bool = False) -> Tuple[Flight, bool]:
+        """加入生成，返回 (flight, 是否由当前请求负责执行)"""
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+
+            if idempotency_key and idempotency_key in self._idempotent:
+                flight = self._idempotent[idempotency_key][1]
+                flight.followers += 1
+                self._idempotent_hits += 1
+                return flight, False
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = Flight(key, stream=stream)
+                self._inflight[key] = flight
+                self._leaders += 1
+            else:
+                flight.followers += 1
+                self._followers += 1
+
+            if idempotency_key:
+                self._idempotent[idempotency_key] = (now + self.idempotency_window, flight)
+            return flight, leader
+
+    def complete(self, flight: Flight, result: Any = None, error: Optional[Exception] = None):
+        """结束生成并唤醒等待者；失败的结果不在幂等窗口内保留"""
+        flight.result = result
+        flight.error = error
+        if flight.broadcast is not None:
+            flight.broadcast.finish(error)
+        flight.done.set()
+
+        with self._lock:
+            if self._inflight.get(flight.key) is flight:
+                del self._inflight[flight.key]
+            if error is not None:
+                for idempotency_key in [k for k, (_, f) in self._idempotent.items() if f is flight]:
+                    del self._idempotent[idempotency_key]
+
+    def wait(self, flight: Flight, timeout: Optional[float] = None) -> Any:
+        """等待其他请求执行的生成结束"""
+        if not flight.done.wait(timeout):
+            raise TimeoutError("等待相同请求的生成结果超时")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def do(self, key: str, fn: Callable[[], Any], idempotency_key: Optional[str] = None,
+           timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """执行fn或复用相同请求的结果，返回 (结果, 是否复用)"""
+        flight, leader = self.join(key, idempotency_key)
+        if not leader:
+            logger.info(f"相同请求正在生成，等待共享结果: {key[:16]}")
+            return self.wait(flight, timeout), True
+
+        try:
+            result = fn()
+        except Exception as e:
+            self.complete(flight, error=e)
+            raise
+        self.complete(flight, result=result)
+        return result, False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'inflight': len(self._inflight),
+                'idempotency_keys': len(self._idempotent),
+                'leaders': self._leaders,
+                'followers': self._followers,
+                'idempotent_hits': self._idempotent_hits
+            }
+
+    def _purge_expired(self, now: float):
+        """清理过期幂等键（调用方需持有锁）"""
+        expired = [k for k, (expires_at, _) in self._idempotent.items() if expires_at <= now]
+        for idempotency_key in expired:
+            del self._idempotent[idempotency_key]
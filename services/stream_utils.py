@@ -0,0 +1,185 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from typing import Dict, Any, Iterable, Generator, AsyncIterator, AsyncGenerator, Optional
+
+REPLAY_CHUNK_CHARS = 64  # 回放缓存结果时每个content事件的字符数
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
+
+def format_sse_event(data: Dict[str, Any]) -> str:
+    """格式化一条SSE事件"""
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class _UpstreamError:
+    """后台读取上游时的异常，交给消费方重新抛出"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+_UPSTREAM_END = object()
+
+class _ChunkBuffer:
+    """合并缓冲：记录缓冲内容和上次输出时间，判断是否需要输出"""
+
+    def __init__(self, interval: Optional[float], max_bytes: int):
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.parts = []
+        self.size = 0
+        self.last_flush = time.monotonic()
+
+    def add(self, chunk: str) -> bool:
+        """加入增量，返回是否达到输出条件"""
+        self.parts.append(chunk)
+        self.size += len(chunk.encode('utf-8'))
+        return (self.max_bytes > 0 and self.size >= self.max_bytes) or \
+            (self.interval is not None and time.monotonic() - self.last_flush >= self.interval) or \
+            (self.max_bytes <= 0 and self.interval is None)
+
+    def timeout(self) -> Optional[float]:
+        """距按时间输出的剩余秒数；缓冲为空或不按时间合并时为None（一直等待下一个增量）"""
+        if self.interval is None or not self.parts:
+            return None
+        return max(0.0, self.last_flush + self.interval - time.monotonic())
+
+    def flush(self) -> str:
+        text = ''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        self.last_flush = time.monotonic()
+        return text
+
+def coalesce_chunks(chunks: Iterable[str], interval_ms: int = 50,
+                    max_bytes: int = 256) -> Generator[str, None, None]:
+    """
+    合并token增量，按时间窗口或字节数批量输出
+
+    按时间合并时上游在后台线程中读取，缓冲内容最多等待interval_ms即输出，不必等到下一个增量到达；
+    上游由后台线程关闭，下游提前关闭时后台线程在收到下一个增量（或上游被关闭）后退出
+
+    Args:
+        chunks: 上游增量文本
+        interval_ms: 缓冲内容最长等待该毫秒数后输出，<=0表示不按时间合并
+        max_bytes: 缓冲内容达到该字节数时输出，<=0表示不按大小合并
+    """
+    buffer = _ChunkBuffer(interval_ms / 1000.0 if interval_ms > 0 else None, max_bytes)
+    if buffer.interval is None:
+        try:
+            for chunk in chunks:
+                if buffer.add(chunk):
+                    yield buffer.flush()
+            if buffer.parts:
+                yield buffer.flush()
+        finally:
+            # 下游提前关闭时同步关闭上游
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+        return
+
+    items: 'queue.Queue' = queue.Queue()
+    stopped = threading.Event()
+
+    def read_upstream():
+        try:
+            for chunk in chunks:
+                items.put(chunk)
+                if stopped.is_set():
+                    break
+            items.put(_UPSTREAM_END)
+        except Exception as e:
+            items.put(_UpstreamError(e))
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+    threading.Thread(target=read_upstream, name='coalesce-chunks', daemon=True).start()
+    try:
+        while True:
+            try:
+                item = items.get(timeout=buffer.timeout())
+            except queue.Empty:
+                yield buffer.flush()
+                continue
+            if item is _UPSTREAM_END:
+                break
+            if isinstance(item, _UpstreamError):
+                raise item.error
+            if buffer.add(item):
+                yield buffer.flush()
+
+        if buffer.parts:
+            yield buffer.flush()
+    finally:
+        stopped.set()
+
+def replay_text_chunks(text: str, chunk_chars: int = REPLAY_CHUNK_CHARS,
+                       pace_ms: int = 0) -> Generator[str, None, None]:
+    """
+    将已有文本切分为流式增量，用于回放缓存结果
+
+    Args:
+        text: 完整文本
+        chunk_chars: 每段字符数
+        pace_ms: 每段之间的间隔（毫秒），0表示不等待
+    """
+    for start in range(0, len(text), chunk_chars):
+        if start > 0 and pace_ms > 0:
+            time.sleep(pace_ms / 1000.0)
+        yield text[start:start + chunk_chars]
+
+async def coalesce_chunks_async(chunks: AsyncIterator[str], interval_ms: int = 50,
+                                max_bytes: int = 256) -> AsyncGenerator[str, None]:
+    """coalesce_chunks的异步版本（ASGI服务使用）：按时间合并时上游在单独的任务中读取"""
+    buffer = _ChunkBuffer(interval_ms / 1000.0 if interval_ms > 0 else None, max_bytes)
+    items: 'asyncio.Queue' = asyncio.Queue()
+
+    async def read_upstream():
+        try:
+            async for chunk in chunks:
+                await items.put(chunk)
+            await items.put(_UPSTREAM_END)
+        except Exception as e:
+            await items.put(_UpstreamError(e))
+
+    reader = asyncio.ensure_future(read_upstream())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(items.get(), buffer.timeout())
+            except asyncio.TimeoutError:
+                yield buffer.flush()
+                continue
+            if item is _UPSTREAM_END:
+                break
+            if isinstance(item, _UpstreamError):
+                raise item.error
+            if buffer.add(item):
+                yield buffer.flush()
+
+        if buffer.parts:
+            yield buffer.flush()
+    finally:
+        # 下游提前关闭时停止读取并关闭上游
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+        aclose = getattr(chunks, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+
+async def replay_text_chunks_async(text: str, chunk_chars: int = REPLAY_CHUNK_CHARS,
+                                   pace_ms: int = 0) -> AsyncGenerator[str, None]:
+    """replay_text_chunks的异步版本（ASGI服务使用）"""
+    for start in range(0, len(text), chunk_chars):
+        if start > 0 and pace_ms > 0:
+            await asyncio.sleep(pace_ms / 1000.0)
+        yield text[start:start + chunk_chars]
@@ -1,20 +1,31 @@
 import logging
-from typing import Dict, Any, List, Optional
+import math
+from bisect import bisect_left
+from typing import Dict, Any, List, Optional, Tuple
 import re
-
-try:
-    from transformers import AutoTokenizer
-    HAS_TOKENIZER = True
-except ImportError:
-    HAS_TOKENIZER = False
+from services.tokenizer_registry import get_tokenizer, count_tokens, find_token_cut
+from services.context_planner import CHARS_PER_TOKEN
+from services.paragraph_dedup import ParagraphDeduplicator
+from services.extraction_memo import ExtractedPaper, ExtractionMemo
 
 logger = logging.getLogger(__name__)
 
 class TextProcessorService:
     MAX_LENGTH = 32768  # 32k字符限制
     MAX_TOKENS = 32000  # 32k token限制
+    TOKENIZE_BLOCK_CHARS = 8192  # 增量编码的分块大小（字符）
+    
+    REFERENCE_MODES = ('full', 'compact', 'cited')
     
-    def __init__(self, include_authors=False, tokenizer_path=None):
+    # 预算紧张时优先裁剪的章节
+    APPENDIX_SECTION_PATTERN = re.compile(
+        r'appendix|appendices|supplementary|supplemental|acknowledg|'
+        r'ethics statement|reproducibility statement|author contributions|funding',
+        re.IGNORECASE
+    )
+    
+    def __init__(self, include_authors=False, tokenizer_path=None, extraction_memo=None,
+                 reference_mode='full', dedup_paragraphs=False):
         """
         初始化文本处理服务
         
@@ -22,81 +33,371 @@ class TextProcessorService:
             include_authors (bool): 是否包含作者信息，默认False
                                   对于peer review，建议设为False以避免偏见
             tokenizer_path (str): tokenizer路径，用于token级别处理
+                                  （进程内共享，首次使用时加载）
+            extraction_memo (ExtractionMemo): 进程内共享的提取结果memo，
+                                  相同论文只提取一次，token计数、截断和分块结果也只计算一次
+            reference_mode (str): 参考文献渲染方式，full（完整）、compact（紧凑）
+                                  或cited（紧凑且只保留正文引用过的文献）
+            dedup_paragraphs (bool): 是否去除正文中与摘要或前文完全重复、近似重复的段落
+                                  （页眉、重复的图注、附录副本等），保留首次出现
         """
+        if reference_mode not in self.REFERENCE_MODES:
+            raise ValueError(f"不支持的reference_mode: {reference_mode}，可选: {', '.join(self.REFERENCE_MODES)}")
         self.include_authors = include_authors
-        self.tokenizer = None
-        
-        # 初始化tokenizer（如果可用）
-        if HAS_TOKENIZER and tokenizer_path:
-            try:
-                self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
-                logger.info(f"成功加载tokenizer: {tokenizer_path}")
-            except Exception as e:
-                logger.warning(f"无法加载tokenizer {tokenizer_path}: {str(e)}")
-                self.tokenizer = None
-    
-    def process_paper_json(self, paper_json: Dict[str, Any], auto_truncate: bool = True) -> str:
+        self.tokenizer = get_tokenizer(tokenizer_path)
+        self.extraction_memo = extraction_memo
+        self.reference_mode = reference_mode
+        self.dedup_paragraphs = dedup_paragraphs
+        self._last_extracted: Optional[Tuple[Dict[str, Any], ExtractedPaper]] = None
+    
+    def process_paper_json(self, paper_json: Dict[str, Any], auto_truncate: bool = True,
+                           max_tokens: Optional[int] = None) -> str:
         """
         JSON论文转文本
         
         Args:
             paper_json: 论文JSON数据
-            auto_truncate: 是否自动截断到最大长度，默认True
+            auto_truncate: 是否按章节分配token预算截断到最大长度，默认True
+            max_tokens: 论文可用的token预算（由上下文规划得出），默认MAX_TOKENS
         """
         logger.info("处理JSON格式论文数据")
         
         try:
-            text_parts = []
+            paper = self._extract(paper_json)
             
-            # 处理标题
-            title = self._extract_title(paper_json)
-            if title:
-                text_parts.append(f"Title: {title}\n")
-            
-            # 处理作者（可选）
-            if self.include_authors:
-                authors_text = self._extract_authors(paper_json)
-                if authors_text:
-                    text_parts.append(f"Authors: {authors_text}\n")
+            # 根据参数决定是否截断
+            if auto_truncate:
+                budget = self._resolve_budget(max_tokens)
+                return paper.derive(
+                    ('fitted_text', budget),
+                    lambda: self._fit_to_budget(
+                        paper.text, paper.front_text, paper.sections, paper.references_text, budget
+                    )
+                )
             else:
-                # 对于peer review，跳过作者信息以避免偏见
-                logger.info("跳过作者信息处理（匿名评审模式）")
+                return paper.text
             
-            # 处理发表信息
-            publication_text = self._extract_publication(paper_json)
-            if publication_text:
-                text_parts.append(f"Publication: {publication_text}\n")
+        except Exception as e:
+            logger.error(f"处理JSON论文数据失败: {str(e)}")
+            raise RuntimeError(f"处理JSON论文数据失败: {str(e)}")
+    
+    def get_paper_stats(self, paper_json: Dict[str, Any]) -> Dict[str, Any]:
+        """论文全文长度、token数和各章节在全文中的字符偏移"""
+        paper = self._extract(paper_json)
+        return {
+            'text_length': len(paper.text),
+            'token_count': paper.derive(('token_count',), lambda: self.count_tokens(paper.text)),
+            'sections': [
+                {'heading': heading, 'start': start, 'end': end}
+                for heading, start, end in paper.section_offsets
+            ]
+        }
+    
+    def count_tokens(self, text: str) -> int:
+        """文本token数；没有tokenizer时按字符估算"""
+        if self.tokenizer:
+            return count_tokens(self.tokenizer, text)
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    
+    def build_review_chunks(self, paper_json: Dict[str, Any],
+                            max_tokens: Optional[int] = None) -> Tuple[str, List[str]]:
+        """
+        将正文章节分组为不超过max_tokens的分块，用于长论文的分块评审
+        
+        每个分块都带上标题和摘要作为上下文；超出预算的章节按段落拆分，参考文献不参与分块
+        
+        Returns:
+            (前置信息文本, 分块文本列表)
+        """
+        paper = self._extract(paper_json)
+        budget = self._resolve_budget(max_tokens)
+        return paper.derive(
+            ('review_chunks', budget),
+            lambda: self._group_review_chunks(paper.front_text, paper.sections, budget)
+        )
+    
+    def _group_review_chunks(self, front_text: str, sections: List[Dict[str, Any]],
+                             budget: int) -> Tuple[str, List[str]]:
+        """按预算把章节分组为分块"""
+        # 前置信息最多占一半预算
+        front_text = front_text[:self._cut_position(front_text, budget // 2)]
+        section_budget = budget - self._measure(self._join_text(front_text, "\n", ""))
+        
+        groups = []
+        current = []
+        current_size = 0
+        for section in sections:
+            for piece in self._split_section(section, section_budget):
+                # 每个拼接分隔符按2个token估算
+                size = self._measure(self._join_sections([piece])) + 2
+                if current and current_size + size > section_budget:
+                    groups.append(current)
+                    current = []
+                    current_size = 0
+                current.append(piece)
+                current_size += size
+        if current:
+            groups.append(current)
+        
+        chunks = [self._join_text(front_text, self._join_sections(group), "") for group in groups]
+        logger.info(f"论文按章节分为 {len(chunks)} 个分块（每块预算 {budget}）")
+        return front_text, chunks
+    
+    def _split_section(self, section: Dict[str, Any], budget: int) -> List[Dict[str, Any]]:
+        """把超出预算的章节按段落拆成多段，续段标题加(cont.)"""
+        if self._measure(self._join_sections([section])) <= budget:
+            return [section]
+        
+        heading = section['heading']
+        paragraph_budget = budget - self._measure(f"\n{heading} (cont.)") - 2
+        pieces = []
+        current = []
+        current_size = 0
+        for paragraph in section['paragraphs']:
+            # 单个段落超出预算时按预算切开
+            parts = []
+            while paragraph:
+                cut = self._cut_position(paragraph, paragraph_budget)
+                if cut <= 0:
+                    break
+                parts.append(paragraph[:cut])
+                paragraph = paragraph[cut:]
             
-            # 处理摘要
-            abstract_text = self._extract_abstract(paper_json)
-            if abstract_text:
-                text_parts.append("Abstract:\n")
-                text_parts.append(f"{abstract_text}\n")
+            for part in parts:
+                size = self._measure(part) + 2
+                if current and current_size + size > paragraph_budget:
+                    pieces.append(current)
+                    current = []
+                    current_size = 0
+                current.append(part)
+                current_size += size
+        if current:
+            pieces.append(current)
+        
+        return [
+            {'heading': heading if i == 0 or not heading else f"{heading} (cont.)", 'paragraphs': paragraphs}
+            for i, paragraphs in enumerate(pieces)
+        ]
+    
+    def _extract(self, paper_json: Dict[str, Any]) -> ExtractedPaper:
+        """
+        提取论文；配置了memo时按论文内容和提取参数复用，命中时不再解析论文
+
+        同一请求内对同一paper_json对象的多次调用（全文、截断、分块、统计）只提取或查找一次
+        """
+        last = self._last_extracted  # 实例可能被多个线程共用，只读取一次
+        if last is not None and last[0] is paper_json:
+            return last[1]
+        if self.extraction_memo is None:
+            paper = ExtractedPaper(None, None, self._build_extraction(paper_json))
+        else:
+            key = ExtractionMemo.make_key(paper_json, self.include_authors, self.reference_mode, self.dedup_paragraphs)
+            paper = self.extraction_memo.lookup(key, lambda: self._build_extraction(paper_json))
+        self._last_extracted = (paper_json, paper)
+        return paper
+    
+    def _build_extraction(self, paper_json: Dict[str, Any]) -> Dict[str, Any]:
+        """提取各部分并拼接全文"""
+        front_text, sections, references_text, removed = self._extract_parts(paper_json)
+        return {
+            'front_text': front_text,
+            'sections': sections,
+            'references_text': references_text,
+            'removed_paragraphs': removed,
+            'text': self._join_text(front_text, self._join_sections(sections), references_text),
+            'section_offsets': self._section_offsets(front_text, sections)
+        }
+    
+    def _section_offsets(self, front_text: str, sections: List[Dict[str, Any]]) -> List[Tuple[str, int, int]]:
+        """各章节在全文中的 (标题, 起始, 结束) 字符偏移，与_join_text的拼接方式一致"""
+        pos = len(front_text) + 1 if front_text else 0
+        pos += len("\nMain Content:\n") + 1
+        
+        offsets = []
+        for section in sections:
+            start = pos
+            if section['heading']:
+                # 章节标题前有一个空行，偏移从标题文字开始
+                start = pos + 1
+                pos += len(section['heading']) + 2
+            for paragraph in section['paragraphs']:
+                pos += len(paragraph) + 1
+            offsets.append((section['heading'], start, pos - 1))
+        return offsets
+    
+    def _extract_parts(self, paper_json: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]], str, List[str]]:
+        """提取前置信息文本、正文章节、参考文献文本和去重时去除的段落"""
+        # 处理标题
+        title = self._extract_title(paper_json)
+        
+        # 处理作者（可选）
+        authors_text = ""
+        if self.include_authors:
+            authors_text = self._extract_authors(paper_json)
+        else:
+            # 对于peer review，跳过作者信息以避免偏见
+            logger.info("跳过作者信息处理（匿名评审模式）")
+        
+        # 处理发表信息
+        publication_text = self._extract_publication(paper_json)
+        
+        # 处理摘要
+        abstract_text = self._extract_abstract(paper_json)
+        
+        # 处理正文
+        sections = self._extract_body_sections(paper_json)
+        removed = []
+        if self.dedup_paragraphs:
+            sections, removed = self._dedup_sections(abstract_text, sections)
+        
+        # 处理参考文献
+        references_text = self._extract_references(paper_json)
+        
+        front_text = self._join_front_matter(title, authors_text, publication_text, abstract_text)
+        return front_text, sections, references_text, removed
+    
+    def _join_front_matter(self, title: str, authors_text: str, publication_text: str,
+                           abstract_text: str) -> str:
+        """拼接标题、作者、发表信息和摘要"""
+        text_parts = []
+        if title:
+            text_parts.append(f"Title: {title}\n")
+        if authors_text:
+            text_parts.append(f"Authors: {authors_text}\n")
+        if publication_text:
+            text_parts.append(f"Publication: {publication_text}\n")
+        if abstract_text:
+            text_parts.append("Abstract:\n")
+            text_parts.append(f"{abstract_text}\n")
+        return "\n".join(text_parts)
+    
+    def _join_text(self, front_text: str, body_text: str, references_text: str) -> str:
+        """拼接全文"""
+        text_parts = [front_text] if front_text else []
+        if body_text:
+            text_parts.append("\nMain Content:\n")
+            text_parts.append(body_text)
+        if references_text:
+            text_parts.append("\nReferences:\n")
+            text_parts.append(references_text)
+        return "\n".join(text_parts)
+    
+    def _resolve_budget(self, max_tokens: Optional[int]) -> int:
+        """预算换算为_measure的单位：没有tokenizer时按字符估算"""
+        if self.tokenizer:
+            return max_tokens if max_tokens is not None else self.MAX_TOKENS
+        return max_tokens * CHARS_PER_TOKEN if max_tokens is not None else self.MAX_LENGTH
+    
+    def _fit_to_budget(self, full_text: str, front_text: str, sections: List[Dict[str, Any]],
+                       references_text: str, budget: int) -> str:
+        """
+        按章节分配token预算
+        
+        标题、摘要和章节标题优先保留；正文章节按水位线均分剩余预算，
+        附录类章节和参考文献只使用正文放完后剩下的预算。
+        全文只编码一次，各部分的token数和截断位置都由offset mapping得出
+        """
+        spans = _TokenSpans(self, full_text)
+        if spans.fits(budget):
+            return full_text
+        
+        try:
+            # 各章节标题和段落在全文中的区间（与_join_sections的拼接方式一致）
+            regions = []
+            for section, (heading, start, end) in zip(sections, self._section_offsets(front_text, sections)):
+                heading_start = start - 1 if heading else start  # 包含标题前的换行
+                paragraphs_start = start + len(heading) + 1 if heading else start
+                regions.append((section, heading_start, paragraphs_start, max(paragraphs_start, end)))
+            main_regions = [r for r in regions if not self._is_appendix_section(r[0])]
+            appendix_regions = [r for r in regions if self._is_appendix_section(r[0])]
             
-            # 处理正文
-            body_text = self._extract_body(paper_json)
-            if body_text:
-                text_parts.append("\nMain Content:\n")
-                text_parts.append(body_text)
+            # 固定开销：前置信息、正文章节标题和拼接用的分隔符
+            fixed_cost = spans.measure(0, len(front_text))
+            fixed_cost += sum(
+                spans.measure(heading_start, paragraphs_start - 1)
+                for section, heading_start, paragraphs_start, _ in main_regions if section['heading']
+            )
+            fixed_cost += self._measure("\nMain Content:\n\nReferences:\n") + len(sections) * 2
+            available = budget - fixed_cost
+            if available <= 0:
+                return full_text[:spans.cut(0, len(full_text), budget)]
             
-            # 处理参考文献
-            references_text = self._extract_references(paper_json)
-            if references_text:
-                text_parts.append("\nReferences:\n")
-                text_parts.append(references_text)
+            main_sizes = [spans.measure(paragraphs_start, end) for _, _, paragraphs_start, end in main_regions]
+            main_quotas = self._water_fill(main_sizes, available)
+            available -= sum(main_quotas)
             
-            # 合并文本
-            full_text = "\n".join(text_parts)
+            appendix_sizes = [spans.measure(heading_start, end) for _, heading_start, _, end in appendix_regions]
+            appendix_quotas = self._water_fill(appendix_sizes, available)
+            available -= sum(appendix_quotas)
             
-            # 根据参数决定是否截断
-            if auto_truncate:
-                return self._truncate_to_max_tokens(full_text)
-            else:
-                return full_text
+            # 预算确定后再按区间截断段落（保留原文前缀）
+            fitted = {}
+            for (section, _, paragraphs_start, end), quota in zip(main_regions + appendix_regions,
+                                                                   main_quotas + appendix_quotas):
+                if quota > 0 or not self._is_appendix_section(section):
+                    text = full_text[paragraphs_start:spans.cut(paragraphs_start, end, quota)].rstrip()
+                    fitted[id(section)] = {
+                        'heading': section['heading'],
+                        'paragraphs': text.split('\n') if text else []
+                    }
+            fitted_sections = [fitted[id(s)] for s in sections if id(s) in fitted]
+            
+            # 参考文献按整行保留
+            references_start = len(full_text) - len(references_text)
+            fitted_references = full_text[references_start:spans.cut(references_start, len(full_text), available)]
+            if fitted_references != references_text:
+                fitted_references = fitted_references[:fitted_references.rfind('\n') + 1].rstrip('\n')
+            
+            logger.info(
+                f"按章节分配token预算: 正文 {sum(main_quotas)}/{sum(main_sizes)}, "
+                f"附录 {sum(appendix_quotas)}/{sum(appendix_sizes)}, "
+                f"参考文献保留 {len(fitted_references):,}/{len(references_text):,} 字符"
+            )
+            
+            text = self._join_text(front_text, self._join_sections(fitted_sections), fitted_references)
+            # 分隔符合并等误差兜底
+            return text[:self._cut_position(text, budget)]
             
         except Exception as e:
-            logger.error(f"处理JSON论文数据失败: {str(e)}")
-            raise RuntimeError(f"处理JSON论文数据失败: {str(e)}")
+            logger.warning(f"按章节分配预算失败，截断尾部: {str(e)}")
+            return self._truncate_to_max_tokens(full_text, budget) if self.tokenizer else full_text[:budget]
+    
+    def _is_appendix_section(self, section: Dict[str, Any]) -> bool:
+        """附录、致谢等与评审关系较小的章节"""
+        if self.APPENDIX_SECTION_PATTERN.search(section['heading']):
+            return True
+        # 附录章节常以字母编号（A、B.1）
+        return bool(re.match(r'^[A-Z](\.\d+)*\s', section['heading']))
+    
+    @staticmethod
+    def _water_fill(sizes: List[int], budget: int) -> List[int]:
+        """水位线分配：小于水位的部分全部保留，其余部分平分剩余预算"""
+        if sum(sizes) <= budget:
+            return list(sizes)
+        
+        quotas = [0] * len(sizes)
+        remaining = max(0, budget)
+        order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+        for n, i in enumerate(order):
+            quotas[i] = min(sizes[i], remaining // (len(sizes) - n))
+            remaining -= quotas[i]
+        return quotas
+    
+    def _measure(self, text: str) -> int:
+        """文本长度：有tokenizer时为token数，否则为字符数"""
+        if not text:
+            return 0
+        if self.tokenizer:
+            return count_tokens(self.tokenizer, text)
+        return len(text)
+    
+    def _cut_position(self, text: str, budget: int) -> int:
+        """不超过budget的截断位置（单位同_measure）"""
+        if budget <= 0:
+            return 0
+        if self.tokenizer:
+            return find_token_cut(self.tokenizer, text, budget, self.TOKENIZE_BLOCK_CHARS)
+        return min(len(text), budget)
     
     def _truncate_to_max_length(self, text: str) -> str:
         """截断到最大字符长度"""
@@ -106,7 +407,7 @@ class TextProcessorService:
         return text[:self.MAX_LENGTH - 100] + "..."
     
     def _truncate_to_max_tokens(self, text: str, max_tokens: int = None) -> str:
-        """按token数量截断（与predict.py对齐）"""
+        """按token数量截断（与predict.py对齐），保留原文前缀不做decode"""
         if max_tokens is None:
             max_tokens = self.MAX_TOKENS
             
@@ -116,19 +417,13 @@ class TextProcessorService:
             return self._truncate_to_max_length(text)
         
         try:
-            # token级别处理
-            tokens = self.tokenizer.encode(text)
-            if len(tokens) <= max_tokens:
-                return text
-            
-            # 截断并解码
-            truncated_tokens = tokens[:max_tokens]
-            return self.tokenizer.decode(truncated_tokens, skip_special_tokens=True)
+            cut = find_token_cut(self.tokenizer, text, max_tokens, self.TOKENIZE_BLOCK_CHARS)
+            return text if cut >= len(text) else text[:cut]
             
         except Exception as e:
             logger.warning(f"Token截断失败，使用字符截断: {str(e)}")
             return self._truncate_to_max_length(text)
-
+    
     def _extract_title(self, paper_json: Dict[str, Any]) -> str:
         """提取标题"""
         return paper_json.get('title', '').strip()
@@ -189,25 +484,76 @@ class TextProcessorService:
     
     def _extract_body(self, paper_json: Dict[str, Any]) -> str:
         """提取正文"""
+        return self._join_sections(self._extract_body_sections(paper_json))
+    
+    def _extract_body_sections(self, paper_json: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """提取正文章节：[{'heading': 章节标题, 'paragraphs': [段落]}]"""
         body = paper_json.get('body', [])
         if not isinstance(body, list):
-            return ""
+            return []
         
-        body_parts = []
+        sections = []
         for section in body:
             if not isinstance(section, dict):
                 continue
             
             # 章节标题
             section_title = self._extract_section_title(section)
-            if section_title:
-                body_parts.append(f"\n{section_title}")
             
             # 段落内容
             paragraphs = self._extract_paragraphs(section)
-            if paragraphs:
-                body_parts.extend(paragraphs)
+            
+            if section_title or paragraphs:
+                sections.append({'heading': section_title, 'paragraphs': paragraphs})
+        
+        return sections
+    
+    def _dedup_sections(self, abstract_text: str,
+                        sections: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """去除正文中的重复段落（摘要段落先登记，保留首次出现），返回 (去重后的章节, 被去除的段落)"""
+        deduplicator = ParagraphDeduplicator()
+        for paragraph in abstract_text.split('\n'):
+            deduplicator.is_duplicate(paragraph)
         
+        deduped = []
+        removed = []
+        for section in sections:
+            paragraphs = []
+            for paragraph in section['paragraphs']:
+                if deduplicator.is_duplicate(paragraph):
+                    removed.append(paragraph)
+                else:
+                    paragraphs.append(paragraph)
+            # 段落全部重复的无标题章节整体去掉
+            if section['heading'] or paragraphs:
+                deduped.append({'heading': section['heading'], 'paragraphs': paragraphs})
+        
+        if removed:
+            logger.info(f"去除重复段落 {len(removed)} 个")
+        return deduped, removed
+    
+    def get_dedup_stats(self, paper_json: Dict[str, Any]) -> Dict[str, Any]:
+        """段落去重统计：去除的段落数、字符数和token数（未开启去重时均为0），取自提取时的去重结果"""
+        paper = self._extract(paper_json)
+        removed = paper.removed_paragraphs
+        
+        # 每个段落还占一个换行符
+        return {
+            'dedup_paragraphs': self.dedup_paragraphs,
+            'paragraphs_removed': len(removed),
+            'chars_removed': sum(len(paragraph) + 1 for paragraph in removed),
+            'tokens_removed': paper.derive(
+                ('tokens_removed',), lambda: self.count_tokens('\n'.join(removed)) if removed else 0
+            )
+        }
+    
+    def _join_sections(self, sections: List[Dict[str, Any]]) -> str:
+        """拼接章节文本"""
+        body_parts = []
+        for section in sections:
+            if section['heading']:
+                body_parts.append(f"\n{section['heading']}")
+            body_parts.extend(section['paragraphs'])
         return '\n'.join(body_parts)
     
     def _extract_section_title(self, section: Dict[str, Any]) -> str:
@@ -257,18 +603,45 @@ class TextProcessorService:
         return paragraph_texts
     
     def _extract_references(self, paper_json: Dict[str, Any]) -> str:
-        """提取参考文献"""
+        """提取参考文献（按reference_mode渲染）"""
         references = paper_json.get('reference', [])
         if not isinstance(references, list):
             return ""
         
+        if self.reference_mode == 'full':
+            return self._render_references_full(references)
+        
+        cited_ids = self._extract_cited_ids(paper_json) if self.reference_mode == 'cited' else None
+        return self._render_references_compact(references, cited_ids)
+    
+    def get_reference_stats(self, paper_json: Dict[str, Any]) -> Dict[str, Any]:
+        """参考文献渲染统计：与完整渲染（原有输出）相比节省的字符和token数"""
+        paper = self._extract(paper_json)
+        return paper.derive(('reference_stats',), lambda: self._reference_stats(paper_json, paper.references_text))
+    
+    def _reference_stats(self, paper_json: Dict[str, Any], rendered_text: str) -> Dict[str, Any]:
+        references = paper_json.get('reference', [])
+        if not isinstance(references, list):
+            references = []
+        
+        full_text = rendered_text if self.reference_mode == 'full' else self._render_references_full(references)
+        return {
+            'reference_mode': self.reference_mode,
+            'references': len(references),
+            'rendered_references': len(rendered_text.splitlines()),
+            'chars_saved': len(full_text) - len(rendered_text),
+            'tokens_saved': self.count_tokens(full_text) - self.count_tokens(rendered_text)
+        }
+    
+    def _render_references_full(self, references: List[Any]) -> str:
+        """完整渲染：标题、作者（authors）和年份（year），与原有输出一致"""
         ref_parts = []
         for i, ref in enumerate(references):
             if isinstance(ref, dict):
                 # 提取引用信息
-                title = ref.get('title', '').strip()
+                title = str(ref.get('title') or '').strip()
                 authors = ref.get('authors', [])
-                year = ref.get('year', '').strip()
+                year = str(ref.get('year') or '').strip()
                 
                 ref_text = f"[{i+1}]"
                 if title:
@@ -288,3 +661,113 @@ class TextProcessorService:
                 ref_parts.append(f"[{i+1}] {ref.strip()}")
         
         return '\n'.join(ref_parts)
+    
+    def _render_references_compact(self, references: List[Any], cited_ids: Optional[set] = None) -> str:
+        """
+        紧凑渲染：只使用完整渲染中的字段，作者列表缩写为“First et al.”，
+        年份只在有作者时保留（取4位年份），没有内容的文献不输出
+        
+        cited_ids不为空时只保留正文中引用过的文献（编号保持原序号）
+        """
+        ref_parts = []
+        for i, ref in enumerate(references):
+            if isinstance(ref, str):
+                if ref.strip():
+                    ref_parts.append(f"[{i+1}] {ref.strip()}")
+                continue
+            if not isinstance(ref, dict):
+                continue
+            if cited_ids and ref.get('index') not in cited_ids:
+                continue
+            
+            title = str(ref.get('title') or '').strip()
+            authors = self._compact_authors(ref.get('authors') or [])
+            year_match = re.match(r'\d{4}', str(ref.get('year') or '').strip())
+            year = year_match.group(0) if authors and year_match else ''
+            
+            fields = [field for field in (title, authors, year) if field]
+            if fields:
+                ref_parts.append(f"[{i+1}] " + ', '.join(fields))
+        
+        return '\n'.join(ref_parts)
+    
+    @staticmethod
+    def _compact_authors(authors: Any) -> str:
+        """作者列表缩写：一位写姓，两位写“A and B”，更多写“A et al.”"""
+        if not isinstance(authors, list):
+            authors = re.split(r',|\band\b', str(authors))
+        
+        surnames = [str(author).strip().split(' ')[-1] for author in authors if str(author).strip()]
+        if not surnames:
+            return ""
+        if len(surnames) == 1:
+            return surnames[0]
+        if len(surnames) == 2:
+            return f"{surnames[0]} and {surnames[1]}"
+        return f"{surnames[0]} et al."
+    
+    def _extract_cited_ids(self, paper_json: Dict[str, Any]) -> set:
+        """正文引用标注（quote.target，如"#b12"）指向的参考文献编号"""
+        cited_ids = set()
+        body = paper_json.get('body', [])
+        if not isinstance(body, list):
+            return cited_ids
+        
+        for section in body:
+            if not isinstance(section, dict) or not isinstance(section.get('p'), list):
+                continue
+            for paragraph in section['p']:
+                if not isinstance(paragraph, dict) or not isinstance(paragraph.get('quote'), list):
+                    continue
+                for quote in paragraph['quote']:
+                    target = quote.get('target') if isinstance(quote, dict) else None
+                    if isinstance(target, str) and target.startswith('#'):
+                        cited_ids.add(target[1:])
+        return cited_ids
+
+class _TokenSpans:
+    """
+    全文任意区间的token数和截断位置
+
+    fast tokenizer时全文只编码一次，按offset mapping用二分查找计算；
+    其他情况（慢速tokenizer或按字符估算）对区间文本单独计算
+    """
+
+    def __init__(self, processor: TextProcessorService, text: str):
+        self.processor = processor
+        self.text = text
+        self.starts: Optional[List[int]] = None
+        self.ends: Optional[List[int]] = None
+        tokenizer = processor.tokenizer
+        if tokenizer is not None and getattr(tokenizer, 'is_fast', False):
+            offsets = tokenizer(
+                text, add_special_tokens=False, return_offsets_mapping=True, verbose=False
+            )['offset_mapping']
+            self.starts = [start for start, _ in offsets]
+            self.ends = [end for _, end in offsets]
+
+    def fits(self, budget: int) -> bool:
+        """全文是否不超过budget"""
+        if self.starts is None:
+            return self.processor._cut_position(self.text, budget) >= len(self.text)
+        return len(self.starts) <= budget
+
+    def measure(self, start: int, end: int) -> int:
+        """区间[start, end)的token数（以token起点所在区间计）"""
+        if end <= start:
+            return 0
+        if self.starts is None:
+            return self.processor._measure(self.text[start:end])
+        return bisect_left(self.starts, end) - bisect_left(self.starts, start)
+
+    def cut(self, start: int, end: int, budget: int) -> int:
+        """区间[start, end)内不超过budget个token的截断位置（全文中的字符偏移）"""
+        if end <= start or budget <= 0:
+            return start
+        if self.starts is None:
+            return start + self.processor._cut_position(self.text[start:end], budget)
+        first = bisect_left(self.starts, start)
+        last = bisect_left(self.starts, end)
+        if budget >= last - first:
+            return end
+        return min(self.ends[first + budget - 1], end)
@@ -0,0 +1,91 @@
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+try:
+    from transformers import AutoTokenizer
+    HAS_TOKENIZER = True
+except ImportError:
+    HAS_TOKENIZER = False
+
+logger = logging.getLogger(__name__)
+
+_tokenizers: Dict[str, Optional[Any]] = {}
+_tokenizers_lock = threading.Lock()
+
+def get_tokenizer(tokenizer_path: Optional[str]) -> Optional[Any]:
+    """
+    获取进程内共享的tokenizer，首次使用时加载（优先fast tokenizer）
+
+    加载失败的路径也会记录，避免每个请求重复尝试
+    """
+    if not tokenizer_path or not HAS_TOKENIZER:
+        return None
+
+    tokenizer = _tokenizers.get(tokenizer_path)
+    if tokenizer is not None or tokenizer_path in _tokenizers:
+        return tokenizer
+
+    with _tokenizers_lock:
+        if tokenizer_path in _tokenizers:
+            return _tokenizers[tokenizer_path]
+
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer_path, use_fast=True)
+            logger.info(f"成功加载tokenizer: {tokenizer_path} (fast: {getattr(tokenizer, 'is_fast', False)})")
+        except Exception as e:
+            logger.warning(f"无法加载tokenizer {tokenizer_path}: {str(e)}")
+            tokenizer = None
+
+        _tokenizers[tokenizer_path] = tokenizer
+        return tokenizer
+
+def count_tokens(tokenizer: Any, text: str) -> int:
+    """统计文本token数（不含special tokens）"""
+    if not text:
+        return 0
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+def find_token_cut(tokenizer: Any, text: str, max_tokens: int, block_chars: int = 8192) -> int:
+    """
+    找到不超过max_tokens的字符截断位置
+
+    按换行边界分块增量编码，预算用尽即停止，不对整篇文本编码；
+    越界的分块内用offset mapping（或二分查找）定位精确截断点
+    """
+    used_tokens = 0
+    pos = 0
+    while pos < len(text):
+        end = text.find('\n', pos + block_chars)
+        end = len(text) if end == -1 else end + 1
+        block = text[pos:end]
+
+        block_tokens = count_tokens(tokenizer, block)
+        if used_tokens + block_tokens > max_tokens:
+            return pos + _find_block_cut(tokenizer, block, max_tokens - used_tokens)
+
+        used_tokens += block_tokens
+        pos = end
+
+    return len(text)
+
+def _find_block_cut(tokenizer: Any, block: str, budget: int) -> int:
+    """在单个分块内找到最多budget个token对应的字符位置"""
+    if budget <= 0:
+        return 0
+
+    if getattr(tokenizer, 'is_fast', False):
+        offsets = tokenizer(
+            block, add_special_tokens=False, return_offsets_mapping=True
+        )['offset_mapping']
+        return offsets[budget - 1][1] if budget <= len(offsets) else len(block)
+
+    # 慢速tokenizer没有offset mapping，二分查找最长前缀
+    low, high = 0, len(block)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(tokenizer, block[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return low
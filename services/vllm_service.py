@@ -1,16 +1,347 @@
 import requests
 import logging
 import json
-from typing import Optional, Generator
-from config.config import AppConfig
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Optional, Generator, Dict, Any, List, Callable
+from requests.adapters import HTTPAdapter
+from config.config import AppConfig, VllmConfig
+from services.admission_controller import AdmissionRejected
 from models.vllm_models import VllmRequest, VllmMessage, VllmResponse
+from services.replica_router import ReplicaRouter
+from services.context_planner import ContextPlanner, ContextPlan, CHARS_PER_TOKEN
+from services.tokenizer_registry import get_tokenizer
 
 logger = logging.getLogger(__name__)
 
-class VllmService:
+class VllmPoolTimeout(AdmissionRejected):
+    """等待连接池空闲连接超时（本地连接已用满，不是副本故障），调用方应返回429"""
+
+    def __init__(self, base_url: str, pool_timeout: float):
+        super().__init__(
+            f"vLLM连接池已满，等待空闲连接超时 ({pool_timeout:g}s): {base_url}",
+            max(1, math.ceil(pool_timeout))
+        )
+
+class VllmTransport:
+    """vLLM HTTP传输层 - 同一base_url共享keep-alive连接池"""
+    
+    def __init__(self, base_url: str, vllm_config: VllmConfig):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = max(1, vllm_config.pool_size)
+        self.pool_timeout = None if vllm_config.pool_timeout is None else max(0.0, vllm_config.pool_timeout)
+        self.timeout = (
+            vllm_config.connect_timeout,
+            vllm_config.read_timeout or vllm_config.timeout
+        )
+        
+        self.session = requests.Session()
+        # pool_block=True: 连接池满时排队等待，而不是临时新建连接；
+        # urllib3的等待没有超时，由_slots限时并统计等待数
+        self.adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=True,
+            max_retries=0
+        )
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+        if not vllm_config.keep_alive:
+            self.session.headers['Connection'] = 'close'
+        
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._total_requests = 0
+        self._waiting = 0
+        self._peak_waiting = 0
+        self._pool_timeouts = 0
+    
+    def _checkout(self):
+        """占用一个连接名额，连接池满时最多等待pool_timeout秒（为None时一直等待）"""
+        if self._slots.acquire(blocking=False):
+            return
+        with self._lock:
+            self._waiting += 1
+            self._peak_waiting = max(self._peak_waiting, self._waiting)
+        try:
+            acquired = self._slots.acquire(timeout=self.pool_timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            with self._lock:
+                self._pool_timeouts += 1
+            raise VllmPoolTimeout(self.base_url, self.pool_timeout)
+    
+    @contextmanager
+    def post(self, path: str, payload: Dict[str, Any], stream: bool = False):
+        """发送POST请求，退出上下文时关闭响应并归还连接；连接池满且等待超时时抛出VllmPoolTimeout"""
+        url = f"{self.base_url}{path}"
+        self._checkout()
+        with self._lock:
+            self._in_flight += 1
+            self._total_requests += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        
+        response = None
+        try:
+            response = self.session.post(url, json=payload, timeout=self.timeout, stream=stream)
+            yield response
+        finally:
+            if response is not None:
+                response.close()
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """连接池统计"""
+        num_connections = 0
+        num_requests = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            num_connections += getattr(pool, 'num_connections', 0)
+            num_requests += getattr(pool, 'num_requests', 0)
+        
+        with self._lock:
+            in_flight = self._in_flight
+            peak_in_flight = self._peak_in_flight
+            total_requests = self._total_requests
+            waiting = self._waiting
+            peak_waiting = self._peak_waiting
+            pool_timeouts = self._pool_timeouts
+        
+        return {
+            'base_url': self.base_url,
+            'pool_size': self.pool_size,
+            'pool_timeout': self.pool_timeout,
+            'in_flight': in_flight,
+            'peak_in_flight': peak_in_flight,
+            'checkouts_waiting': waiting,
+            'peak_checkouts_waiting': peak_waiting,
+            'pool_timeouts': pool_timeouts,
+            'total_requests': total_requests,
+            'connections_opened': num_connections,
+            'reuse_ratio': round(1 - num_connections / num_requests, 4) if num_requests else 0.0
+        }
+
+_transports: Dict[str, VllmTransport] = {}
+_transports_lock = threading.Lock()
+
+def get_transport(base_url: str, vllm_config: VllmConfig) -> VllmTransport:
+    """获取base_url对应的共享传输层（进程内单例）"""
+    key = base_url.rstrip('/')
+    with _transports_lock:
+        transport = _transports.get(key)
+        if transport is None:
+            transport = VllmTransport(key, vllm_config)
+            _transports[key] = transport
+            logger.info(f"创建vLLM连接池: {key}, 大小: {transport.pool_size}")
+        return transport
+
+SYSTEM_PROMPT = "You are a professional academic peer reviewer with expertise in evaluating research papers."
+
+CHUNK_REVIEW_MAX_TOKENS = 2048  # 分块评审（map阶段）每块的输出上限
+
+# 同行评审的评审要求（缩进是历史格式，改动会使已有的评审缓存失效）
+PEER_REVIEW_QUERY = """Please provide a comprehensive peer review of this academic paper. Focus on the following aspects:
+                1. Novelty and significance of the contribution
+                2. Technical quality and soundness of the methodology
+                3. Clarity of writing and presentation
+                4. Experimental validation and results analysis
+                5. Related work coverage and comparison
+                6. Limitations and potential improvements
+                Please provide detailed comments and recommendations."""
+
+def parse_stream_line(line: str):
+    """解析一行SSE数据，返回 (是否结束, 增量内容)"""
+    if not line.startswith('data: '):
+        return False, ''
+    
+    data_content = line[6:]  # 移除 'data: ' 前缀
+    if data_content.strip() == '[DONE]':
+        return True, ''
+    
+    try:
+        chunk_data = json.loads(data_content)
+    except json.JSONDecodeError:
+        # 忽略无法解析的行
+        return False, ''
+    
+    choices = chunk_data.get('choices', [])
+    if choices and len(choices) > 0:
+        delta = choices[0].get('delta', {})
+        return False, delta.get('content', '') or ''
+    return False, ''
+
+def _is_replica_failure(error: Exception) -> bool:
+    """连接失败、超时和5xx视为副本故障；4xx属于请求本身的问题"""
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500
+    return False
+
+class BaseVllmService:
+    """同步/异步vLLM服务共用的prompt与请求构建逻辑"""
+    
     def __init__(self, config: AppConfig):
         self.config = config
         self.base_url = config.vllm.base_url.rstrip('/')
+        self.router = ReplicaRouter(
+            config.vllm.get_replica_urls(),
+            strategy=config.vllm.routing_strategy,
+            health_check_interval=config.vllm.health_check_interval,
+            health_check_timeout=config.vllm.connect_timeout
+        )
+        self.context_planner = ContextPlanner(
+            config.vllm.max_context_length,
+            tokenizer=get_tokenizer(config.tokenizer_path),
+            safety_margin=config.vllm.context_safety_margin
+        )
+        
+        # 流式生成统计（含客户端断开后取消的生成）
+        self._stream_lock = threading.Lock()
+        self._stream_stats = {
+            'completed_streams': 0,
+            'cancelled_streams': 0,
+            'streamed_tokens': 0,
+            'cancelled_tokens_saved': 0
+        }
+    
+    def get_stream_stats(self) -> Dict[str, Any]:
+        """获取流式生成统计"""
+        with self._stream_lock:
+            return dict(self._stream_stats)
+    
+    def _record_stream(self, max_tokens: int, generated_tokens: int, cancelled: bool):
+        """记录一次流式生成；取消时按剩余可生成token数估算节省量"""
+        with self._stream_lock:
+            self._stream_stats['streamed_tokens'] += generated_tokens
+            if cancelled:
+                self._stream_stats['cancelled_streams'] += 1
+                self._stream_stats['cancelled_tokens_saved'] += max(0, max_tokens - generated_tokens)
+            else:
+                self._stream_stats['completed_streams'] += 1
+    
+    def get_replica_stats(self) -> Dict[str, Any]:
+        """获取各副本负载统计"""
+        return self.router.get_stats()
+    
+    def _estimate_request_tokens(self, vllm_request: VllmRequest) -> int:
+        """粗略估算请求占用的token数（prompt按4字符/token + 最大输出）"""
+        prompt_chars = sum(len(message.content) for message in vllm_request.messages)
+        return prompt_chars // CHARS_PER_TOKEN + vllm_request.max_tokens
+    
+    def plan_context(self, query: str, max_tokens: int) -> ContextPlan:
+        """计算论文可用的token预算：上下文窗口 - system消息 - 模板和query - 预留输出"""
+        return self.context_planner.plan(
+            [SYSTEM_PROMPT, self._build_peer_review_prompt("", query)],
+            max_tokens
+        )
+    
+    def _build_peer_review_request(self, paper_content: str, query: str, temperature: float,
+                                   max_tokens: int, stream: bool = False) -> VllmRequest:
+        """构建peer review请求（按上下文规划兜底，保证prompt + 输出不超出窗口）"""
+        plan = self.plan_context(query, max_tokens)
+        if plan.paper_budget < 0:
+            # query本身过长：压缩输出预留，仍不够则直接报错
+            max_tokens += plan.paper_budget
+            if max_tokens <= 0:
+                raise ValueError(
+                    f"prompt长度 ({plan.prompt_tokens} tokens) 超出上下文窗口 ({plan.context_length} tokens)"
+                )
+            logger.warning(f"prompt过长，输出上限调整为 {max_tokens} tokens")
+        
+        if paper_content:
+            fitted_content = self.context_planner.fit(paper_content, plan.paper_budget)
+            if len(fitted_content) < len(paper_content):
+                logger.warning(
+                    f"论文内容超出上下文预算 ({plan.paper_budget} tokens)，"
+                    f"截断 {len(paper_content):,} -> {len(fitted_content):,} 字符"
+                )
+            paper_content = fitted_content
+        
+        prompt = self._build_peer_review_prompt(paper_content, query)
+        
+        return VllmRequest(
+            model=self.config.vllm.model_name,
+            messages=[
+                VllmMessage(role="system", content=SYSTEM_PROMPT),
+                VllmMessage(role="user", content=prompt)
+            ],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=stream
+        )
+    
+    def build_chunk_review_query(self, query: str, index: int, total: int) -> str:
+        """分块评审（map阶段）的query"""
+        return f"""This paper is too long to review in one pass. The content below is part {index + 1} of {total} of the paper (title and abstract are repeated for context).
+Write concise reviewer notes for this part only: key contributions, strengths, weaknesses, questions and concrete issues, citing the sections they refer to. These notes will be merged with the notes for the other parts into one review.
+
+Original review instructions: {query}"""
+    
+    def build_merge_content(self, front_text: str, chunk_reviews: List[str]) -> str:
+        """合并阶段（reduce）的输入：论文前置信息 + 各分块的评审笔记"""
+        parts = [front_text.rstrip(), "\nReviewer notes for each part of the paper:"]
+        for i, chunk_review in enumerate(chunk_reviews):
+            parts.append(f"\n### Part {i + 1}/{len(chunk_reviews)}\n{chunk_review.strip()}")
+        return "\n".join(parts)
+    
+    def build_merge_query(self, query: str) -> str:
+        """合并阶段（reduce）的query"""
+        return f"""The paper was reviewed part by part; the reviewer notes for every part are given above in place of the full text.
+Synthesize them into a single coherent peer review of the whole paper. Remove duplicates, resolve contradictions and keep the specific evidence.
+
+{query}"""
+    
+    def _build_warmup_request(self) -> VllmRequest:
+        """构建预热请求"""
+        return VllmRequest(
+            model=self.config.vllm.model_name,
+            messages=[
+                VllmMessage(role="system", content="You are an AI assistant."),
+                VllmMessage(role="user", content="test")
+            ],
+            max_tokens=10,
+            temperature=0.1
+        )
+    
+    def _build_peer_review_prompt(self, paper_content: str, query: str) -> str:
+        """构建prompt（论文长度由上下文规划控制）"""
+        prompt = f"""You are conducting a peer review of an academic paper. Please read the paper carefully and provide a comprehensive evaluation.
+
+Paper Content:
+{paper_content}
+
+Review Focus: {query}
+
+Please provide a thorough peer review covering the following aspects:
+1. **Novelty and Significance**: Evaluate the originality and importance of the research contributions
+2. **Technical Quality**: Assess the methodology, experimental design, and technical soundness
+3. **Clarity and Presentation**: Comment on the writing quality, organization, and clarity
+4. **Experimental Validation**: Evaluate the experiments, results, and their interpretation
+5. **Related Work**: Assess how well the paper positions itself relative to existing literature
+6. **Limitations and Future Work**: Identify any limitations and suggestions for improvement
+
+Requirements: Provide a detailed, constructive, and professional peer review response."""
+        
+        return prompt
+
+class VllmService(BaseVllmService):
+    def __init__(self, config: AppConfig):
+        super().__init__(config)
+        self.transports = {
+            replica.url: get_transport(replica.url, config.vllm)
+            for replica in self.router.replicas
+        }
         self._warmup_model()
         
     def generate_peer_review(self, paper_content: str, query: str, 
@@ -19,19 +350,8 @@ class VllmService:
         logger.info("Calling vLLM to generate peer review")
         
         try:
-            # 构建prompt
-            prompt = self._build_peer_review_prompt(paper_content, query)
-            
             # 创建请求
-            vllm_request = VllmRequest(
-                model=self.config.vllm.model_name,
-                messages=[
-                    VllmMessage(role="system", content="You are a professional academic peer reviewer with expertise in evaluating research papers."),
-                    VllmMessage(role="user", content=prompt)
-                ],
-                max_tokens=max_tokens,
-                temperature=temperature
-            )
+            vllm_request = self._build_peer_review_request(paper_content, query, temperature, max_tokens)
             
             # 调用API
             response = self._call_vllm_api(vllm_request)
@@ -43,6 +363,8 @@ class VllmService:
             logger.info(f"vLLM peer review 生成完成，输出长度: {len(content)} 字符")
             return content
             
+        except VllmPoolTimeout:
+            raise
         except Exception as e:
             logger.error(f"vLLM 调用失败: {str(e)}")
             raise RuntimeError(f"论文总结生成失败: {str(e)}")
@@ -53,109 +375,106 @@ class VllmService:
         logger.info("Calling vLLM to generate peer review (streaming)")
         
         try:
-            # 构建prompt
-            prompt = self._build_peer_review_prompt(paper_content, query)
-            
             # 创建流式请求
-            vllm_request = VllmRequest(
-                model=self.config.vllm.model_name,
-                messages=[
-                    VllmMessage(role="system", content="You are a professional academic peer reviewer with expertise in evaluating research papers."),
-                    VllmMessage(role="user", content=prompt)
-                ],
-                max_tokens=max_tokens,
-                temperature=temperature,
-                stream=True
-            )
+            vllm_request = self._build_peer_review_request(paper_content, query, temperature, max_tokens, stream=True)
             
-            # 调用流式API
-            for chunk in self._call_vllm_stream_api(vllm_request):
-                yield chunk
+            # 调用流式API；下游关闭时显式关闭上游，中断vLLM生成
+            stream = self._call_vllm_stream_api(vllm_request)
+            try:
+                for chunk in stream:
+                    yield chunk
+            finally:
+                stream.close()
             
             logger.info("vLLM peer review streaming completed")
             
+        except VllmPoolTimeout:
+            raise
         except Exception as e:
             logger.error(f"vLLM 流式调用失败: {str(e)}")
             raise RuntimeError(f"论文总结流式生成失败: {str(e)}")
     
-    def _build_peer_review_prompt(self, paper_content: str, query: str) -> str:
-        """构建prompt"""
-        max_length = self.config.vllm.max_context_length
-        limited_content = paper_content[:max_length] + "..." if len(paper_content) > max_length else paper_content
+    def generate_chunk_reviews(self, chunks: List[str], query: str, temperature: float = 0.0,
+                               max_tokens: int = CHUNK_REVIEW_MAX_TOKENS, max_workers: Optional[int] = None,
+                               admit: Optional[Callable] = None) -> List[str]:
+        """
+        长论文分块评审的map阶段：各分块并发生成评审笔记，由路由分散到各副本
         
-        prompt = f"""You are conducting a peer review of an academic paper. Please read the paper carefully and provide a comprehensive evaluation.
-
-Paper Content:
-{limited_content}
-
-Review Focus: {query}
-
-Please provide a thorough peer review covering the following aspects:
-1. **Novelty and Significance**: Evaluate the originality and importance of the research contributions
-2. **Technical Quality**: Assess the methodology, experimental design, and technical soundness
-3. **Clarity and Presentation**: Comment on the writing quality, organization, and clarity
-4. **Experimental Validation**: Evaluate the experiments, results, and their interpretation
-5. **Related Work**: Assess how well the paper positions itself relative to existing literature
-6. **Limitations and Future Work**: Identify any limitations and suggestions for improvement
-
-Requirements: Provide a detailed, constructive, and professional peer review response."""
+        Args:
+            chunks: 分块文本
+            query: 原始评审要求
+            max_workers: 并发数，默认为副本数
+            admit: 每个分块生成前获取名额的上下文管理器工厂（如准入控制）
+        """
+        if not chunks:
+            return []
+        max_workers = min(len(chunks), max_workers or len(self.router.replicas))
+        logger.info(f"分块评审: {len(chunks)} 个分块，并发数 {max_workers}")
         
-        return prompt
+        def review_chunk(index: int) -> str:
+            chunk_query = self.build_chunk_review_query(query, index, len(chunks))
+            with admit() if admit else nullcontext():
+                return self.generate_peer_review(chunks[index], chunk_query, temperature, max_tokens)
+        
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chunk-review') as pool:
+            return list(pool.map(review_chunk, range(len(chunks))))
+    
+    def get_pool_stats(self) -> List[Dict[str, Any]]:
+        """获取各副本连接池统计"""
+        return [transport.get_stats() for transport in self.transports.values()]
     
     def _call_vllm_api(self, vllm_request: VllmRequest) -> VllmResponse:
         """调用API"""
-        url = f"{self.base_url}/v1/chat/completions"
+        tokens = self._estimate_request_tokens(vllm_request)
+        attempts = len(self.router.replicas)
         
-        try:
-            response = requests.post(
-                url,
-                json=vllm_request.to_dict(),
-                timeout=self.config.vllm.timeout,
-                headers={'Content-Type': 'application/json'}
-            )
-            response.raise_for_status()
-            
-            return VllmResponse.from_dict(response.json())
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"vLLM API 调用失败: {str(e)}")
-            raise RuntimeError(f"vLLM API 调用失败: {str(e)}")
+        for attempt in range(attempts):
+            try:
+                with self.router.lease(tokens, _is_replica_failure) as replica:
+                    transport = self.transports[replica.url]
+                    with transport.post('/v1/chat/completions', vllm_request.to_dict()) as response:
+                        response.raise_for_status()
+                        return VllmResponse.from_dict(response.json())
+                
+            except requests.exceptions.ConnectionError as e:
+                # 连接失败时请求未被副本处理，换一个副本重试
+                if attempt + 1 < attempts:
+                    logger.warning(f"vLLM副本连接失败，尝试其他副本: {str(e)}")
+                    continue
+                logger.error(f"vLLM API 调用失败: {str(e)}")
+                raise RuntimeError(f"vLLM API 调用失败: {str(e)}")
+            except requests.exceptions.RequestException as e:
+                logger.error(f"vLLM API 调用失败: {str(e)}")
+                raise RuntimeError(f"vLLM API 调用失败: {str(e)}")
 
     def _call_vllm_stream_api(self, vllm_request: VllmRequest) -> Generator[str, None, None]:
         """调用流式API"""
-        url = f"{self.base_url}/v1/chat/completions"
+        tokens = self._estimate_request_tokens(vllm_request)
+        generated_tokens = 0
         
         try:
-            response = requests.post(
-                url,
-                json=vllm_request.to_dict(),
-                timeout=self.config.vllm.timeout,
-                headers={'Content-Type': 'application/json'},
-                stream=True
-            )
-            response.raise_for_status()
+            with self.router.lease(tokens, _is_replica_failure) as replica:
+                transport = self.transports[replica.url]
+                with transport.post('/v1/chat/completions', vllm_request.to_dict(), stream=True) as response:
+                    response.raise_for_status()
+                    
+                    for line in response.iter_lines():
+                        if line:
+                            done, content = parse_stream_line(line.decode('utf-8'))
+                            if done:
+                                break
+                            if content:
+                                # vLLM每个增量约对应一个token
+                                generated_tokens += 1
+                                yield content
             
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        data_content = line[6:]  # 移除 'data: ' 前缀
-                        
-                        if data_content.strip() == '[DONE]':
-                            break
-                            
-                        try:
-                            chunk_data = json.loads(data_content)
-                            choices = chunk_data.get('choices', [])
-                            if choices and len(choices) > 0:
-                                delta = choices[0].get('delta', {})
-                                content = delta.get('content', '')
-                                if content:
-                                    yield content
-                        except json.JSONDecodeError:
-                            # 忽略无法解析的行
-                            continue
+            self._record_stream(vllm_request.max_tokens, generated_tokens, cancelled=False)
             
+        except GeneratorExit:
+            # 下游已断开：退出上下文时关闭响应连接，vLLM检测到断开后中止该请求
+            logger.info(f"流式请求被取消，已生成 {generated_tokens} tokens")
+            self._record_stream(vllm_request.max_tokens, generated_tokens, cancelled=True)
+            raise
         except requests.exceptions.RequestException as e:
             logger.error(f"vLLM 流式API 调用失败: {str(e)}")
             raise RuntimeError(f"vLLM 流式API 调用失败: {str(e)}")
@@ -164,16 +483,16 @@ Requirements: Provide a detailed, constructive, and professional peer review res
         """预热模型"""
         try:
             logger.info("正在预热vLLM模型...")
-            dummy_request = VllmRequest(
-                model=self.config.vllm.model_name,
-                messages=[
-                    VllmMessage(role="system", content="You are an AI assistant."),
-                    VllmMessage(role="user", content="test")
-                ],
-                max_tokens=10,
-                temperature=0.1
-            )
-            self._call_vllm_api(dummy_request)
+            payload = self._build_warmup_request().to_dict()
+            for replica in self.router.replicas:
+                try:
+                    with self.transports[replica.url].post('/v1/chat/completions', payload) as response:
+                        response.raise_for_status()
+                except requests.exceptions.RequestException as e:
+                    logger.warning(f"vLLM副本预热失败: {replica.url}, {str(e)}")
+                    if _is_replica_failure(e):
+                        # 预热失败的副本先摘除，由后台探活恢复
+                        self.router.mark_unhealthy(replica, str(e))
             logger.info("vLLM模型预热完成")
         except Exception as e:
             logger.warning(f"模型预热失败，但服务仍可正常运行: {str(e)}")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+测试请求体裁剪解析：经load_review_request（HTTP入口）解析的论文与直接json.load（CLI/批量入口）
+读取的论文渲染结果必须一致；参考文献各渲染方式的输出
+"""
+
+import io
+import json
+import sys
+from pathlib import Path
+
+from services import paper_ingest
+from services.text_processor_service import TextProcessorService
+
+PAPERS_DIR = Path(__file__).parent / "static" / "papers"
+
+def load_papers():
+    """加载static/papers下的全部论文JSON"""
+    papers = []
+    for path in sorted(PAPERS_DIR.glob("*.json")):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        papers.append((path.name, data.get('paper_json', data)))
+    return papers
+
+def ingest(payload):
+    """模拟HTTP请求体，经load_review_request解析"""
+    return paper_ingest.load_review_request(io.BytesIO(json.dumps(payload).encode('utf-8')))
+
+def render_variants(paper_json):
+    """各种参考文献渲染方式和作者设置下的论文文本"""
+    outputs = []
+    for reference_mode in TextProcessorService.REFERENCE_MODES:
+        for include_authors in (False, True):
+            processor = TextProcessorService(
+                include_authors=include_authors,
+                reference_mode=reference_mode,
+                dedup_paragraphs=True
+            )
+            outputs.append(processor.process_paper_json(paper_json, auto_truncate=False))
+    return outputs
+
+def check_ingested_matches_raw(use_ijson):
+    has_ijson = paper_ingest.HAS_IJSON
+    paper_ingest.HAS_IJSON = has_ijson and use_ijson
+    try:
+        for name, paper_json in load_papers():
+            expected = render_variants(paper_json)
+            single = ingest({'paper_json': paper_json, 'stream': False})
+            assert single['stream'] is False
+            assert render_variants(single['paper_json']) == expected, f"{name}: 单篇请求渲染结果不一致"
+            batch = ingest({'papers': [{'id': name, 'paper_json': paper_json}]})
+            assert batch['papers'][0]['id'] == name
+            assert render_variants(batch['papers'][0]['paper_json']) == expected, f"{name}: 批量请求渲染结果不一致"
+    finally:
+        paper_ingest.HAS_IJSON = has_ijson
+
+def test_ingested_paper_renders_like_raw():
+    """ijson流式裁剪后的论文与原始论文渲染一致"""
+    check_ingested_matches_raw(use_ijson=True)
+
+def test_ingested_paper_renders_like_raw_without_ijson():
+    """未安装ijson时整体解析后裁剪，结果同样一致"""
+    check_ingested_matches_raw(use_ijson=False)
+
+def test_full_references_match_original_output():
+    """full与原有渲染一致：只输出标题、authors和year"""
+    paper_json = {
+        'title': 'T',
+        'reference': [
+            {'title': 'Attention is all you need', 'authors': ['Ashish Vaswani', 'Noam Shazeer', 'Niki Parmar'],
+             'year': '2017', 'venue': 'NeurIPS'},
+            {'title': 'Recognizing textual entailment', 'author': [{'name': 'Ido Dagan'}], 'date': '2005'},
+            'Raw reference string',
+        ]
+    }
+    references = TextProcessorService(reference_mode='full')._extract_references(paper_json)
+    assert references == (
+        "[1] Attention is all you need, Ashish Vaswani, Noam Shazeer, Niki Parmar, 2017\n"
+        "[2] Recognizing textual entailment\n"
+        "[3] Raw reference string"
+    )
+
+def test_compact_references_never_longer_than_full():
+    """compact和cited只缩写完整渲染的内容，不会比full更长"""
+    full = TextProcessorService(reference_mode='full')
+    for mode in ('compact', 'cited'):
+        processor = TextProcessorService(reference_mode=mode)
+        for name, paper_json in load_papers():
+            stats = processor.get_reference_stats(paper_json)
+            assert stats['chars_saved'] >= 0 and stats['tokens_saved'] >= 0, f"{name}: {mode} 比full更长"
+            assert len(processor._extract_references(paper_json)) <= len(full._extract_references(paper_json))
+    compact = TextProcessorService(reference_mode='compact')._extract_references({'reference': [
+        {'title': 'Attention is all you need', 'authors': ['Ashish Vaswani', 'Noam Shazeer'], 'year': '2017a'},
+        {'title': 'Untitled authors', 'year': '2017'},
+    ]})
+    assert compact == "[1] Attention is all you need, Vaswani and Shazeer, 2017\n[2] Untitled authors"
+
+def main():
+    tests = [
+        test_ingested_paper_renders_like_raw,
+        test_ingested_paper_renders_like_raw_without_ijson,
+        test_full_references_match_original_output,
+        test_compact_references_never_longer_than_full,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+测试流式广播的订阅计数：订阅者在subscribe()时计入，尚未迭代就关闭同样算作离开
+"""
+
+import sys
+
+from services.single_flight import StreamBroadcast
+
+def test_close_before_first_iteration_cancels():
+    """客户端在收到首个事件前断开，上游应被取消"""
+    broadcast = StreamBroadcast()
+    subscription = broadcast.subscribe()
+    assert not broadcast.cancelled
+    subscription.close()
+    assert broadcast.cancelled
+
+def test_cancelled_only_after_last_subscriber_leaves():
+    """还有订阅者时不取消；close可重复调用"""
+    broadcast = StreamBroadcast()
+    first = broadcast.subscribe()
+    second = broadcast.subscribe()
+    first.close()
+    first.close()
+    assert not broadcast.cancelled
+    second.close()
+    assert broadcast.cancelled
+
+def test_late_subscriber_replays_and_finishes():
+    """后加入的订阅者先回放已有内容；正常结束后不算取消"""
+    broadcast = StreamBroadcast()
+    broadcast.publish("a")
+    broadcast.publish("b")
+    subscription = broadcast.subscribe()
+    broadcast.finish()
+    assert list(subscription) == ["a", "b"]
+    assert not broadcast.cancelled
+
+def main():
+    tests = [
+        test_close_before_first_iteration_cancels,
+        test_cancelled_only_after_last_subscriber_leaves,
+        test_late_subscriber_replays_and_finishes,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
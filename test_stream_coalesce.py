@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+测试流式输出合并：缓冲内容在interval_ms后按时输出，不依赖下一个增量到达
+"""
+
+import asyncio
+import sys
+import threading
+import time
+
+from services.single_flight import StreamBroadcast
+from services.stream_utils import coalesce_chunks, coalesce_chunks_async
+
+def slow_chunks():
+    """先快速产生两个增量，之后停顿0.5秒再产生最后一个"""
+    yield "a"
+    yield "b"
+    time.sleep(0.5)
+    yield "c"
+
+async def slow_chunks_async():
+    yield "a"
+    yield "b"
+    await asyncio.sleep(0.5)
+    yield "c"
+
+def test_partial_buffer_flushed_on_timer():
+    """上游停顿时，缓冲内容在interval_ms后输出"""
+    start = time.monotonic()
+    outputs = []
+    for text in coalesce_chunks(slow_chunks(), interval_ms=100, max_bytes=0):
+        outputs.append((text, time.monotonic() - start))
+    assert [text for text, _ in outputs] == ["ab", "c"]
+    assert outputs[0][1] < 0.3, f"缓冲内容在 {outputs[0][1]:.2f}s 后才输出"
+
+def test_partial_buffer_flushed_on_timer_async():
+    """异步版本同样按时输出"""
+    async def run():
+        start = time.monotonic()
+        outputs = []
+        async for text in coalesce_chunks_async(slow_chunks_async(), interval_ms=100, max_bytes=0):
+            outputs.append((text, time.monotonic() - start))
+        return outputs
+    outputs = asyncio.run(run())
+    assert [text for text, _ in outputs] == ["ab", "c"]
+    assert outputs[0][1] < 0.3, f"缓冲内容在 {outputs[0][1]:.2f}s 后才输出"
+
+def test_upstream_error_is_raised():
+    """上游异常在消费方重新抛出"""
+    def failing():
+        yield "a"
+        raise RuntimeError("upstream failed")
+    try:
+        list(coalesce_chunks(failing(), interval_ms=100, max_bytes=0))
+    except RuntimeError as e:
+        assert str(e) == "upstream failed"
+    else:
+        assert False, "上游异常未抛出"
+
+def test_subscription_closed_while_coalescing():
+    """后台线程等待订阅增量时关闭订阅，上游随即视为已取消"""
+    broadcast = StreamBroadcast()
+    subscription = broadcast.subscribe()
+    broadcast.publish("a")
+    coalesced = coalesce_chunks(subscription, interval_ms=50, max_bytes=0)
+    assert next(coalesced) == "a"
+    coalesced.close()
+    subscription.close()
+    assert broadcast.cancelled
+    broadcast.finish()
+    reader = [t for t in threading.enumerate() if t.name == 'coalesce-chunks']
+    for thread in reader:
+        thread.join(1.0)
+    assert not any(thread.is_alive() for thread in reader)
+
+def main():
+    tests = [
+        test_partial_buffer_flushed_on_timer,
+        test_partial_buffer_flushed_on_timer_async,
+        test_upstream_error_is_raised,
+        test_subscription_closed_while_coalescing,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+测试单次生成模式的方面标签解析：只有已知方面名算作标签
+"""
+
+import sys
+
+from config.config import AppConfig
+from services.automatic_review_service import AutomaticReviewService
+
+def make_service():
+    return AutomaticReviewService(AppConfig())
+
+def test_known_tags_case_insensitive():
+    """已知方面名不区分大小写，统一为规范名称"""
+    reviews = make_service().parse_tagged_review(
+        "[novelty] The idea is new.\n\n[EXPERIMENTAL VALIDATION] Results are thin."
+    )
+    assert [r["name"] for r in reviews] == ["Novelty", "Experimental Validation"]
+    assert reviews[0]["content"] == "The idea is new."
+    assert reviews[1]["content"] == "Results are thin."
+
+def test_numeric_citation_is_not_a_tag():
+    """"[1]"开头的段落是引用，并入上一个方面"""
+    reviews = make_service().parse_tagged_review(
+        "[Comparison to Previous Studies] The baselines are outdated.\n\n"
+        "[1] cites a stronger method that is not compared against."
+    )
+    assert len(reviews) == 1
+    assert reviews[0]["name"] == "Comparison to Previous Studies"
+    assert reviews[0]["content"].endswith("[1] cites a stronger method that is not compared against.")
+
+def test_unknown_heading_is_not_a_tag():
+    """"[Strengths]"等非方面名的方括号内容不产生新方面"""
+    reviews = make_service().parse_tagged_review(
+        "[Strengths] Well written.\n\n[Clarity and Presentation] Figures are clear."
+    )
+    assert [r["name"] for r in reviews] == ["Overall Review", "Clarity and Presentation"]
+    assert reviews[0]["content"] == "[Strengths] Well written."
+
+def test_markdown_link_is_not_a_tag():
+    """markdown链接即使文字是方面名也不算标签"""
+    reviews = make_service().parse_tagged_review(
+        "[Reproducibility] Code is released.\n\n"
+        "[Novelty](https://example.org/prior-work) already proposes a similar loss."
+    )
+    assert len(reviews) == 1
+    assert reviews[0]["name"] == "Reproducibility"
+    assert "[Novelty](https://example.org/prior-work) already proposes" in reviews[0]["content"]
+
+def test_untagged_review_is_one_aspect():
+    """完全没有标签时整个评审作为一个方面"""
+    reviews = make_service().parse_tagged_review("[1] Good paper.\n\nMinor typos.")
+    assert reviews == [{"name": "Overall Review", "content": "[1] Good paper.\n\nMinor typos."}]
+
+def main():
+    tests = [
+        test_known_tags_case_insensitive,
+        test_numeric_citation_is_not_a_tag,
+        test_unknown_heading_is_not_a_tag,
+        test_markdown_link_is_not_a_tag,
+        test_untagged_review_is_one_aspect,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())